@@ -3,14 +3,14 @@ import sys
 import json
 import asyncio
 from fastapi import FastAPI, Request
-from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from typing import Optional
 from pydantic import BaseModel
 
-from src.rag_app import process_question
+from src.rag_app import process_question_async
 
 app = FastAPI()
 
@@ -32,6 +32,7 @@ templates = Jinja2Templates(directory="templates")
 # APIリクエストのボディ定義
 class Query(BaseModel):
     question: str
+    deadline_ms: Optional[int] = None
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -42,24 +43,25 @@ async def ask_api(query: Query):
 
     async def generate():
         yield json.dumps({"type": "status", "content": "ドキュメントを検索中..."}) + "\n"
-        
-        # RAGパイプラインをスレッドプールで実行（メインループをブロックしないため）
-        result = await run_in_threadpool(process_question, query.question)
-        
-        yield json.dumps({"type": "status", "content": "回答を生成中..."}) + "\n"
-        
-        answer = result.get("answer", "")
-        sources = result.get("sources", [])
-
-        # 回答を少しずつ送信（擬似ストリーミング）
-        chunk_size = 5
-        for i in range(0, len(answer), chunk_size):
-            chunk = answer[i:i+chunk_size]
-            yield json.dumps({"type": "answer", "content": chunk}) + "\n"
-            await asyncio.sleep(0.02) # ストリーミング感を出すためのウェイト
-
-        # 最後にソース情報を送信
-        yield json.dumps({"type": "sources", "content": sources}) + "\n"
+
+        # パイプラインはイベントループ上で実行し、ワーカースレッドから届くイベントをキュー経由で送信
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def on_event(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        task = asyncio.create_task(process_question_async(query.question, on_event=on_event, deadline_ms=query.deadline_ms))
+        task.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield json.dumps(event) + "\n"
+
+        if task.exception() is not None:
+            yield json.dumps({"type": "error", "content": str(task.exception())}) + "\n"
 
     return StreamingResponse(generate(), media_type="application/x-ndjson")
 
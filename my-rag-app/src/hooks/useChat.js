@@ -62,14 +62,15 @@ export const useChat = () => {
     setMessages(prev => [...prev, userMessage]);
     setIsLoading(true);
     setLoadingMessage('AIが思考中...');
-    abortControllerRef.current = new AbortController();
+    const controller = new AbortController();
+    abortControllerRef.current = controller;
 
     try {
       const response = await fetch(api.API_URLS.ask, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ question: questionText, difficulty: questionDifficulty }),
-        signal: abortControllerRef.current.signal,
+        signal: controller.signal,
       });
 
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
@@ -127,9 +128,12 @@ export const useChat = () => {
         }]);
       }
     } finally {
-      setIsLoading(false);
-      setLoadingMessage('');
-      abortControllerRef.current = null;
+      // A newer request may have started since; leave its state alone
+      if (abortControllerRef.current === controller) {
+        setIsLoading(false);
+        setLoadingMessage('');
+        abortControllerRef.current = null;
+      }
     }
   };
 
@@ -3,10 +3,12 @@ import sys
 import json
 import sqlite3
 import datetime
-from typing import List, Any
+import queue
+import threading
+from typing import List, Any, Optional
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 import io
@@ -19,6 +21,7 @@ from PIL import Image
 
 from src.rag_app import (
     process_question, 
+    process_questions_async, 
     add_document_to_kb, 
     clear_knowledge_base, 
     get_all_documents, 
@@ -26,10 +29,13 @@ from src.rag_app import (
     document_exists, 
     analyze_document_content, 
     update_document_title, 
-    update_document_title, 
-    explain_term
+    update_document_title
 )
 from src.rag_app.feedback import log_feedback
+from src.rag_app.history import HistoryStore
+from src.rag_app.llm_memo import warm_llm_memo
+from src.rag_app.explanations import explanation_prefetcher, prefetch_explanations
+from src.rag_app.metrics import render_metrics
 
 app = FastAPI(
     title="RAG Qwen Ultimate API",
@@ -68,6 +74,8 @@ def init_db():
                          sources TEXT)''')
 
 init_db()
+history_store = HistoryStore(DB_PATH)
+warm_llm_memo()
 
 # Static Files Mounting
 from fastapi.staticfiles import StaticFiles
@@ -77,6 +85,12 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 class QueryRequest(BaseModel):
     question: str
     difficulty: str = "normal"
+    deadline_ms: Optional[int] = None  # None: server default (REQUEST_DEADLINE_MS), 0: no deadline
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    difficulty: str = "normal"
+    deadline_ms: Optional[int] = 0  # Batches are offline work: no deadline unless asked
 
 class DeleteRequest(BaseModel):
     filename: str
@@ -166,14 +180,15 @@ def clear_history_endpoint():
     try:
         with sqlite3.connect(DB_PATH) as conn:
             conn.execute("DELETE FROM history")
+        history_store.clear()
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/explain")
-async def explain_endpoint(request: ExplainRequest):
-    """専門用語の解説を生成して返します"""
-    explanation = explain_term(request.term)
+def explain_endpoint(request: ExplainRequest):
+    """専門用語の解説を生成して返します (LLM 呼び出しで待つのでスレッドプールで実行)"""
+    explanation = explanation_prefetcher.explain(request.term)
     return {"term": request.term, "explanation": explanation}
 
 @app.post("/api/feedback")
@@ -203,18 +218,10 @@ async def ask_endpoint(request: QueryRequest):
     """
     timestamp = datetime.datetime.now().strftime("%H:%M")
     
-    # 1. 過去の履歴を取得 (直近3往復分程度)
+    # 1. 過去の履歴を取得 (古い会話の要約 + 直近3往復分。各ステージにはトークン上限付きで渡される)
     history = []
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            # 最新の6件を取得
-            cursor = conn.execute("SELECT sender, text FROM history ORDER BY id DESC LIMIT 6")
-            rows = cursor.fetchall()
-            # 時系列順に戻す
-            for row in reversed(rows):
-                role = "user" if row["sender"] == "user" else "assistant"
-                history.append({"role": role, "content": row["text"]})
+        history = history_store.load()
     except Exception as e:
         print(f"DB Error (History fetch): {e}")
 
@@ -231,8 +238,36 @@ async def ask_endpoint(request: QueryRequest):
             # 【改善】処理開始のステータスを即座に通知
             yield json.dumps({"type": "status", "content": "質問を分析し、ドキュメントを検索中..."}, ensure_ascii=False) + "\n"
 
-            # 処理実行 (同期関数)
-            result = process_question(request.question, history=history, difficulty=request.difficulty)
+            # 処理実行 (別スレッド)。sources / answer の差分イベントを逐次受け取って送信する
+            events: queue.Queue = queue.Queue()
+            outcome = {}
+
+            def run():
+                try:
+                    outcome["result"] = process_question(
+                        request.question, history=history, difficulty=request.difficulty,
+                        on_event=events.put, deadline_ms=request.deadline_ms
+                    )
+                except Exception as e:
+                    outcome["error"] = e
+                finally:
+                    events.put(None)
+
+            threading.Thread(target=run, daemon=True).start()
+
+            answering = False
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+                if event["type"] == "answer" and not answering:
+                    answering = True
+                    yield json.dumps({"type": "status", "content": "回答を生成中..."}, ensure_ascii=False) + "\n"
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+
+            if "error" in outcome:
+                raise outcome["error"]
+            result = outcome["result"]
             
             # AIの回答を保存
             try:
@@ -240,21 +275,52 @@ async def ask_endpoint(request: QueryRequest):
                     sources_json = json.dumps(result["sources"], ensure_ascii=False)
                     conn.execute("INSERT INTO history (sender, text, timestamp, sources) VALUES (?, ?, ?, ?)", 
                                  ("bot", result["answer"], timestamp, sources_json))
+                # 直近の窓から外れた発言を要約に畳み込む (次の質問のため。応答は待たせない)
+                threading.Thread(target=history_store.refresh_summary, daemon=True).start()
             except Exception as e:
                 print(f"DB Error (Bot): {e}")
 
-            # 【改善】生成完了ステータス
-            yield json.dumps({"type": "status", "content": "回答を表示します"}, ensure_ascii=False) + "\n"
+            # 回答中の [[用語]] の解説を低優先度で先読みする (クリック時の /api/explain はキャッシュから即答)
+            # ストリームは "done" で閉じる。先読みの完了は待たない
+            prefetch_explanations(result["answer"])
 
-            # App.jsx が期待する形式で分割して送信
-            yield json.dumps({"type": "sources", "content": result["sources"]}, ensure_ascii=False) + "\n"
-            yield json.dumps({"type": "answer", "content": result["answer"]}, ensure_ascii=False) + "\n"
             yield json.dumps({"type": "done", "content": "completed"}, ensure_ascii=False) + "\n"
         except Exception as e:
             yield json.dumps({"type": "error", "content": f"エラーが発生しました: {str(e)}"}, ensure_ascii=False) + "\n"
 
     return StreamingResponse(generate(), media_type="application/x-ndjson")
 
+@app.post("/api/ask_batch")
+async def ask_batch_endpoint(request: BatchQueryRequest):
+    """
+    複数の質問をまとめて処理し、1問終わるごとに結果を NDJSON で返します（完了順）。
+    埋め込み・Web検索・ページ取得は質問間で共有されます。チャット履歴には保存しません。
+    """
+    async def generate():
+        try:
+            async for i, result in process_questions_async(
+                request.questions, difficulty=request.difficulty, deadline_ms=request.deadline_ms
+            ):
+                yield json.dumps({
+                    "type": "result",
+                    "index": i,
+                    "question": request.questions[i],
+                    "answer": result["answer"],
+                    "sources": result["sources"],
+                    "degraded": result.get("degraded", []),
+                    "error": result.get("error"),
+                }, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "done", "content": len(request.questions)}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "content": f"エラーが発生しました: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """ステージ別レイテンシ・LLM呼び出し・キャッシュ等のメトリクス (Prometheus text format)"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/documents")
 async def get_documents_endpoint():
     """登録済みドキュメントの一覧を取得"""
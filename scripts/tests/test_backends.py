@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+LLM backend routing tests.
+Local stub servers stand in for LM Studio boxes: least-loaded selection weighted by tokens/sec, failover, ejection and health-check re-admission.
+"""
+
+import os
+import sys
+import json
+import socket
+import threading
+import unittest
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+
+class StubServer:
+    """An OpenAI-compatible box that answers with its own name, or fails with `status`."""
+
+    def __init__(self, name):
+        self.name = name
+        self.status = 200
+        self.chats = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                out = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_GET(self):
+                self._reply(stub.status, {"data": [{"id": "qwen"}]})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.chats += 1
+                if stub.status != 200:
+                    self._reply(stub.status, {"error": "unavailable"})
+                    return
+                self._reply(200, {"choices": [{"message": {"content": stub.name}}], "usage": {"completion_tokens": 20}})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/chat/completions"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1/chat/completions"
+
+class TestBackendSelection(unittest.TestCase):
+
+    def test_least_outstanding_weighted_by_throughput(self):
+        pool = backends.BackendPool(["http://a/v1/chat/completions", "http://b/v1/chat/completions"], health_interval=0)
+        a, b = pool.backends
+        pool.record_success(a, 100, 1.0)   # 100 tok/s
+        pool.record_success(b, 50, 1.0)    #  50 tok/s
+        self.assertIs(pool.pick(), a)
+
+        a.outstanding = 1                  # a: 2/100, b: 1/50 -> tie goes to the first
+        self.assertIs(pool.pick(), a)
+        a.outstanding = 2                  # a: 3/100 > b: 1/50
+        self.assertIs(pool.pick(), b)
+        self.assertIs(pool.pick(exclude=[b]), a)
+
+    def test_unmeasured_backend_counts_as_average(self):
+        pool = backends.BackendPool(["http://a/v1/chat/completions", "http://b/v1/chat/completions"], health_interval=0)
+        a, b = pool.backends
+        pool.record_success(a, 100, 1.0)
+        a.outstanding = 1
+        self.assertIs(pool.pick(), b)
+
+    def test_all_ejected_falls_back_to_soonest(self):
+        pool = backends.BackendPool(["http://a/v1/chat/completions", "http://b/v1/chat/completions"],
+                                    max_failures=1, health_interval=0)
+        a, b = pool.backends
+        pool.record_failure(b, backends.requests.ConnectionError("down"))
+        pool.record_failure(a, backends.requests.ConnectionError("down"))
+        self.assertIs(pool.pick(), b)
+        # a bad request is not the server's fault
+        pool.record_failure(a, ValueError("Invalid JSON response"))
+        self.assertEqual(a.failures, 1)
+
+class TestBackendRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.good = StubServer("good")
+        self.bad = StubServer("bad")
+        self.bad.status = 503
+        llm.llm_http = http_client.PooledHTTPClient()
+
+    def tearDown(self):
+        self.good.stop()
+        self.bad.stop()
+
+    def test_failover_and_ejection(self):
+        pool = backends.BackendPool([self.bad.url, self.good.url], max_failures=2, health_interval=0)
+        for _ in range(4):
+            self.assertEqual(llm.lmstudio_chat("system", "user", retries=1, backends=pool), "good")
+        bad = pool.backends[0]
+        self.assertFalse(bad.available(backends.time.time()))
+        # once ejected, the bad box stops receiving calls
+        self.assertEqual(self.bad.chats, 2)
+        self.assertGreater(pool.backends[1].tokens_per_second, 0)
+
+    def test_unreachable_backend_is_skipped(self):
+        pool = backends.BackendPool([closed_port_url(), self.good.url], max_failures=1, health_interval=0)
+        self.assertEqual(llm.lmstudio_chat("system", "user", retries=1, backends=pool), "good")
+        self.assertFalse(pool.backends[0].available(backends.time.time()))
+
+    def test_health_check_ejects_and_readmits(self):
+        pool = backends.BackendPool([self.bad.url, self.good.url], health_interval=0,
+                                    http=http_client.PooledHTTPClient())
+        self.assertEqual(pool.check_health(), {self.bad.url: False, self.good.url: True})
+        self.assertFalse(pool.backends[0].available(backends.time.time()))
+
+        self.bad.status = 200
+        pool.check_health()
+        self.assertTrue(pool.backends[0].available(backends.time.time()))
+
+if __name__ == '__main__':
+    unittest.main()
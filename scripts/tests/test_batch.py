@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Batch memo tests.
+Concurrent callers for the same DDGS query or URL must share one call; distinct keys must not.
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+batch = load_module("rag_app.batch", os.path.join(src_path, "batch.py"))
+
+class TestBatchMemo(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fake_search(self, queries, per_query):
+        with self.lock:
+            self.calls.append(tuple(queries))
+        time.sleep(0.05)
+        return [{"href": f"https://example.com/{q}/{i}", "title": q, "body": ""} for q in queries for i in range(2)]
+
+    def fake_extract(self, url, timeout=8):
+        with self.lock:
+            self.calls.append(url)
+        time.sleep(0.05)
+        return f"text of {url}"
+
+    def test_search_dedupes_queries_across_questions(self):
+        memo = batch.BatchMemo()
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            results = list(ex.map(lambda qs: memo.search(self.fake_search, qs, 4), [
+                ["富士山 標高", "富士山 高さ"], ["富士山 標高？"], ["富士山 高さ", "琵琶湖 面積"], ["琵琶湖 面積"],
+            ]))
+        self.assertEqual(sorted(self.calls), sorted([("富士山 標高",), ("富士山 高さ",), ("琵琶湖 面積",)]))
+        self.assertEqual(len(results[0]), 4)
+        self.assertEqual(len(results[1]), 2)
+
+    def test_page_fetched_once_per_url(self):
+        memo = batch.BatchMemo()
+        urls = ["https://a.example/1", "https://a.example/1", "https://b.example/2", "https://a.example/1"]
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            texts = list(ex.map(lambda u: memo.page_text(self.fake_extract, u, 5), urls))
+        self.assertEqual(sorted(self.calls), ["https://a.example/1", "https://b.example/2"])
+        self.assertEqual(texts[3], "text of https://a.example/1")
+
+    def test_failures_are_shared(self):
+        memo = batch.BatchMemo()
+        def boom():
+            self.calls.append("boom")
+            raise RuntimeError("down")
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                memo.once(("fetch", "x"), boom)
+        self.assertEqual(self.calls, ["boom"])
+
+    def test_llm_slots_bound_concurrency(self):
+        memo = batch.BatchMemo(llm_concurrency=2)
+        active, peak = [0], [0]
+        def call():
+            with memo.llm_slot():
+                with self.lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.03)
+                with self.lock:
+                    active[0] -= 1
+        with ThreadPoolExecutor(max_workers=6) as ex:
+            list(ex.map(lambda _: call(), range(6)))
+        self.assertEqual(peak[0], 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Chroma result handling tests.
+A fake collection.query() response checks that stored embeddings and distances reach the reranker without re-encoding,
+and that per-query result lists merge by chunk id.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+import numpy as np
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+# Keep the module-level caches away from the repository's databases. The settings are read
+# when config loads; restoring them afterwards keeps them out of the test modules collected later.
+tmpdir = tempfile.mkdtemp()
+_ENV = {
+    "RESPONSE_CACHE_PATH": os.path.join(tmpdir, "cache.db"),
+    "EMBED_CACHE_ENABLED": "0",
+    "LLM_MEMO_ENABLED": "0",
+    "TRACE_ENABLED": "0",
+}
+
+with mock.patch.dict(os.environ, _ENV):
+    config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+    utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+    metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+    tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+    http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+    backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+    llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+    keywords = load_module("rag_app.keywords", os.path.join(src_path, "keywords.py"))
+    scraper = load_module("rag_app.scraper", os.path.join(src_path, "scraper.py"))
+    search = load_module("rag_app.search", os.path.join(src_path, "search.py"))
+    cache = load_module("rag_app.cache", os.path.join(src_path, "cache.py"))
+    db = load_module("rag_app.db", os.path.join(src_path, "db.py"))
+    embed_cache = load_module("rag_app.embed_cache", os.path.join(src_path, "embed_cache.py"))
+    llm_memo = load_module("rag_app.llm_memo", os.path.join(src_path, "llm_memo.py"))
+    vectors = load_module("rag_app.vectors", os.path.join(src_path, "vectors.py"))
+    intent_classifier = load_module("rag_app.intent_classifier", os.path.join(src_path, "intent_classifier.py"))
+    feedback = load_module("rag_app.feedback", os.path.join(src_path, "feedback.py"))
+    kb_gate = load_module("rag_app.kb_gate", os.path.join(src_path, "kb_gate.py"))
+    history = load_module("rag_app.history", os.path.join(src_path, "history.py"))
+    deadline = load_module("rag_app.deadline", os.path.join(src_path, "deadline.py"))
+    fetch_pool = load_module("rag_app.fetch_pool", os.path.join(src_path, "fetch_pool.py"))
+    singleflight = load_module("rag_app.singleflight", os.path.join(src_path, "singleflight.py"))
+    batch = load_module("rag_app.batch", os.path.join(src_path, "batch.py"))
+    core = load_module("rag_app.core", os.path.join(src_path, "core.py"))
+
+def unit(*values):
+    v = np.asarray(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+class FakeCollection:
+    """Answers every query with the same stored chunks, like collection.query(include=[...])."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks  # (id, text, embedding, distance)
+        self.queries = []
+
+    def query(self, query_embeddings, n_results, include):
+        self.queries.append((len(query_embeddings), include))
+        column = lambda i: [[c[i] for c in self.chunks] for _ in query_embeddings]
+        return {
+            "ids": column(0),
+            "documents": column(1),
+            "metadatas": [[{"source": "kb.pdf", "title": "KB"} for _ in self.chunks] for _ in query_embeddings],
+            "embeddings": [[c[2].tolist() for c in self.chunks] for _ in query_embeddings],
+            "distances": column(3),
+        }
+
+class CountingModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return np.stack([unit(1.0, 0.0, 0.0) for _ in texts])
+
+class TestStoredEmbeddingsReused(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (db.collection, core.get_embed_model)
+        self.chunks = [
+            ("kb_part0", "富士山の標高は3776mです。", unit(1.0, 0.1, 0.0), 0.12),
+            ("kb_part1", "琵琶湖は日本最大の湖です。", unit(0.0, 1.0, 0.0), 0.85),
+        ]
+        db.collection = FakeCollection(self.chunks)
+        self.model = CountingModel()
+        core.get_embed_model = lambda: self.model
+
+    def tearDown(self):
+        db.collection, core.get_embed_model = self.saved
+
+    def test_unpack_keeps_ids_embeddings_and_distances(self):
+        res = db.collection.query([unit(1.0, 0.0, 0.0), unit(0.0, 1.0, 0.0)], 2, ["documents"])
+        res["embeddings"][1][1] = None
+        items = db._unpack_query_result(res, 1)
+        self.assertEqual([i["id"] for i in items], ["kb_part0", "kb_part1"])
+        np.testing.assert_allclose(items[0]["emb"], self.chunks[0][2])
+        self.assertEqual(items[0]["emb"].dtype, np.float32)
+        self.assertNotIn("emb", items[1])
+        self.assertEqual([i["distance"] for i in items], [0.12, 0.85])
+        self.assertEqual(items[0]["meta"]["title"], "KB")
+
+    def test_unpack_tolerates_missing_columns(self):
+        self.assertEqual(db._unpack_query_result({"documents": [["本文"]]}, 0), [{"text": "本文", "meta": {}}])
+        self.assertEqual(db._unpack_query_result({"documents": [None]}, 0), [])
+
+    def test_rerank_encodes_only_web_chunks(self):
+        [results] = db.query_chroma_by_embeddings([unit(1.0, 0.0, 0.0)], 2)
+        self.assertEqual(db.collection.queries, [(1, ["documents", "metadatas", "embeddings", "distances"])])
+        web = [{"title": "Web", "url": "https://example.com", "text": "富士山は静岡県と山梨県にまたがる山です。" * 3, "score": 3.0}]
+        candidates = core.collect_candidates(results, web)
+        self.assertEqual([c.get("distance") for c in candidates], [0.12, 0.85, None])
+
+        ranked = core.rerank_candidates("富士山の標高", candidates, q_emb=unit(1.0, 0.0, 0.0), top_k=3)
+        self.assertEqual(self.model.encoded, ["passage: " + web[0]["text"]])
+        self.assertEqual(len(ranked), 3)
+        np.testing.assert_allclose(candidates[0]["emb"], self.chunks[0][2])
+
+def hit(chunk_id, text=None):
+    return {"id": chunk_id, "text": text or chunk_id, "meta": {"source": "kb.pdf"}}
+
+class TestMergeChromaResults(unittest.TestCase):
+
+    def test_rrf_merges_overlapping_ids(self):
+        k = 60
+        merged = db.merge_chroma_results([
+            [hit("a"), hit("b"), hit("c")],
+            [hit("c"), hit("a"), hit("d")],
+            [hit("c"), hit("e")],
+        ], rrf=True, rrf_k=k)
+        self.assertEqual([m["id"] for m in merged], ["c", "a", "b", "e", "d"])
+        self.assertAlmostEqual(merged[0]["rrf_score"], 1 / (k + 3) + 2 / (k + 1))
+        self.assertAlmostEqual(merged[1]["rrf_score"], 1 / (k + 1) + 1 / (k + 2))
+
+    def test_without_rrf_first_seen_order(self):
+        merged = db.merge_chroma_results([[hit("a"), hit("b")], [hit("b"), hit("c")]], rrf=False)
+        self.assertEqual([m["id"] for m in merged], ["a", "b", "c"])
+        self.assertNotIn("rrf_score", merged[0])
+
+    def test_results_without_ids_dedupe_by_source_and_text(self):
+        no_id = {"text": "同じ本文", "meta": {"source": "kb.pdf"}}
+        merged = db.merge_chroma_results([[dict(no_id)], [dict(no_id), hit("x")]], rrf=False)
+        self.assertEqual(len(merged), 2)
+
+    def test_search_chroma_many_merges_after_prior_results(self):
+        saved = (db.collection, db.encode_queries)
+        db.collection = FakeCollection([("kb_part1", "琵琶湖", unit(0.0, 1.0, 0.0), 0.3)])
+        db.encode_queries = lambda queries: np.stack([unit(1.0, 0.0, 0.0) for _ in queries])
+        try:
+            merged = db.search_chroma_many(["琵琶湖 面積", "琵琶湖 大きさ"], 2, [[hit("kb_part0"), hit("kb_part1")]], rrf=False)
+            self.assertEqual(db.collection.queries[0][0], 2)  # both variants in one query
+            self.assertEqual([m["id"] for m in merged], ["kb_part0", "kb_part1"])
+            self.assertEqual([m["id"] for m in db.search_chroma_many([], 2, [[hit("kb_part0")]])], ["kb_part0"])
+            self.assertEqual(len(db.collection.queries), 1)
+        finally:
+            db.collection, db.encode_queries = saved
+
+if __name__ == '__main__':
+    unittest.main()
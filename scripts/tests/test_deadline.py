@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Request deadline tests.
+Checks the time arithmetic stages rely on and that degraded stages are recorded once each.
+"""
+
+import os
+import sys
+import time
+import math
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+deadline = load_module("rag_app.deadline", os.path.join(src_path, "deadline.py"))
+
+class TestDeadline(unittest.TestCase):
+    def test_unlimited_never_shrinks(self):
+        d = deadline.Deadline(None)
+        self.assertFalse(d.limited)
+        self.assertEqual(d.remaining(), math.inf)
+        self.assertFalse(d.expired())
+        self.assertTrue(d.allows(1e9, reserve=1e9))
+        self.assertEqual(d.timeout(12), 12)
+        self.assertFalse(deadline.Deadline(0).limited)
+
+    def test_timeout_capped_by_remaining_minus_reserve(self):
+        d = deadline.Deadline(30000)
+        self.assertEqual(d.timeout(8, reserve=5), 8)
+        self.assertLessEqual(d.timeout(60, reserve=20), 10)
+        self.assertGreater(d.timeout(60, reserve=20), 9)
+        # Never below the floor, even when the reserve eats everything
+        self.assertEqual(d.timeout(60, reserve=100, floor=0.5), 0.5)
+        self.assertTrue(d.allows(9, reserve=20))
+        self.assertFalse(d.allows(11, reserve=20))
+
+    def test_expiry(self):
+        d = deadline.Deadline(20)
+        time.sleep(0.03)
+        self.assertTrue(d.expired())
+        self.assertLess(d.remaining(), 0)
+
+    def test_degrade_records_each_stage_once(self):
+        d = deadline.Deadline(1000)
+        d.degrade("refine")
+        d.degrade("fetch", "3 pages dropped")
+        d.degrade("fetch", "again")
+        self.assertEqual(d.degraded, ["refine", "fetch"])
+        self.assertIn('rag_degraded_stages_total{stage="fetch"} 1', metrics.render_metrics())
+
+if __name__ == "__main__":
+    unittest.main()
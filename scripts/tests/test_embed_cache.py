@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Embedding cache tests.
+A counting fake model checks that only cache misses are encoded and that LRU eviction caps the table.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+import importlib.util
+import numpy as np
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+embed_cache = load_module("rag_app.embed_cache", os.path.join(src_path, "embed_cache.py"))
+
+class CountingModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[float(len(t)), 1.0, 0.5] for t in texts], dtype=np.float32)
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "embed_cache.db")
+
+    def test_only_misses_are_encoded(self):
+        cache = embed_cache.EmbeddingCache(self.path, max_entries=100)
+        model = CountingModel()
+
+        first = cache.encode(model, ["富士山", "東京タワー"])
+        self.assertEqual(model.encoded, ["passage: 富士山", "passage: 東京タワー"])
+
+        second = cache.encode(model, ["東京タワー", "富士山", "スカイツリー"])
+        self.assertEqual(model.encoded[2:], ["passage: スカイツリー"])
+        np.testing.assert_allclose(second[0], first[1], rtol=1e-3)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+    def test_persists_across_instances(self):
+        embed_cache.EmbeddingCache(self.path).encode(CountingModel(), ["tenki.jp 東京の天気"])
+        model = CountingModel()
+        embed_cache.EmbeddingCache(self.path).encode(model, ["tenki.jp 東京の天気"])
+        self.assertEqual(model.encoded, [])
+
+    def test_lru_size_cap(self):
+        cache = embed_cache.EmbeddingCache(self.path, max_entries=10)
+        model = CountingModel()
+        cache.encode(model, [f"chunk {i}" for i in range(30)])
+        with cache._connect() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        self.assertLessEqual(count, 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Explanation prefetch tests.
+A fake explain function checks term extraction, deduplication, yielding to foreground work and /api/explain taking over queued terms.
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+
+# core pulls in chromadb; the prefetcher only needs explain_term and its error text
+core = type(sys)('rag_app.core')
+core.EXPLAIN_ERROR_MESSAGE = "解説を取得できませんでした。"
+core.explain_term = lambda term: f"{term} の解説"
+core.pipelines_in_flight = lambda: 0
+sys.modules['rag_app.core'] = core
+explanations = load_module("rag_app.explanations", os.path.join(src_path, "explanations.py"))
+
+class FakeExplain:
+    def __init__(self, gate=None, gated=()):
+        self.calls = []
+        self.priorities = []
+        self.gate = gate
+        self.gated = gated
+
+    def __call__(self, term):
+        self.calls.append(term)
+        self.priorities.append(llm._priority.get())
+        if term in self.gated:
+            self.gate.wait(5)
+        if term == "失敗":
+            return core.EXPLAIN_ERROR_MESSAGE
+        return f"{term} の解説"
+
+class TestExtractTerms(unittest.TestCase):
+
+    def test_order_dedupe_and_limit(self):
+        answer = "[[RAG]] は [[ベクトル検索]] と [[rag]] を使う。[[ ]] [[LLM]]\n[[改行\nあり]]"
+        self.assertEqual(explanations.extract_terms(answer), ["RAG", "ベクトル検索", "LLM"])
+        self.assertEqual(explanations.extract_terms(answer, limit=2), ["RAG", "ベクトル検索"])
+        self.assertEqual(explanations.extract_terms(""), [])
+
+class TestExplanationPrefetcher(unittest.TestCase):
+
+    def test_explains_each_term_once(self):
+        fake = FakeExplain()
+        busy = threading.Event()
+        busy.set()
+        prefetcher = explanations.ExplanationPrefetcher(explain=fake, busy=busy.is_set, idle_poll=0.01)
+        first = prefetcher.submit(["RAG", "失敗"])
+        second = prefetcher.submit(["rag"])
+        self.assertIs(second[0][1], first[0][1])
+        busy.clear()
+        self.assertEqual(first[0][1].result(5), "RAG の解説")
+        self.assertIsNone(first[1][1].result(5))
+        self.assertEqual(fake.calls, ["RAG", "失敗"])
+
+    def test_waits_while_foreground_is_busy(self):
+        fake = FakeExplain()
+        busy = threading.Event()
+        busy.set()
+        prefetcher = explanations.ExplanationPrefetcher(explain=fake, busy=busy.is_set, idle_poll=0.01)
+        [(_, future)] = prefetcher.submit(["API"])
+        time.sleep(0.1)
+        self.assertEqual(fake.calls, [])
+        busy.clear()
+        self.assertEqual(future.result(5), "API の解説")
+
+    def test_explain_takes_over_queued_term(self):
+        gate = threading.Event()
+        fake = FakeExplain(gate, gated=("A",))
+        prefetcher = explanations.ExplanationPrefetcher(explain=fake, busy=lambda: False)
+        (_, running), (_, queued) = prefetcher.submit(["A", "B"])
+        while not fake.calls:
+            time.sleep(0.01)
+
+        # "A" is running and "B" is queued behind it; a click on "B" does not wait for "A"
+        self.assertEqual(prefetcher.explain("B"), "B の解説")
+        self.assertEqual(queued.result(0), "B の解説")
+        self.assertEqual(prefetcher.queue_depth(), 0)
+        self.assertFalse(running.done())
+
+        gate.set()
+        self.assertEqual(running.result(5), "A の解説")
+        self.assertEqual(fake.calls, ["A", "B"])
+        self.assertEqual(fake.priorities, [llm.PRIORITY_ENRICHMENT, llm.PRIORITY_INTERACTIVE])
+
+    def test_explain_stops_waiting_for_a_slow_prefetch(self):
+        gate = threading.Event()
+        fake = FakeExplain(gate, gated=("A",))
+        prefetcher = explanations.ExplanationPrefetcher(explain=fake, busy=lambda: False, join_timeout=0.05)
+        [(_, running)] = prefetcher.submit(["A"])
+        while not fake.calls:
+            time.sleep(0.01)
+
+        # The prefetch of "A" is stuck; the click gets its own explanation instead of waiting on it
+        fake.gated = ()
+        self.assertEqual(prefetcher.explain("A"), "A の解説")
+        self.assertFalse(running.done())
+        self.assertEqual(fake.priorities, [llm.PRIORITY_ENRICHMENT, llm.PRIORITY_INTERACTIVE])
+        gate.set()
+        self.assertEqual(running.result(5), "A の解説")
+
+if __name__ == '__main__':
+    unittest.main()
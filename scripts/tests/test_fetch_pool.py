@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Shared fetch pool tests.
+Blocking fake fetches record how many run at once, globally and per host, and in which order requests are served.
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+fetch_pool = load_module("rag_app.fetch_pool", os.path.join(src_path, "fetch_pool.py"))
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.host_active = {}
+        self.max_host_active = {}
+        self.order = []
+
+    def fetch(self, url, delay=0.05):
+        host = fetch_pool.FetchPool.host_of(url)
+        with self.lock:
+            self.order.append(url)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.host_active[host] = self.host_active.get(host, 0) + 1
+            self.max_host_active[host] = max(self.max_host_active.get(host, 0), self.host_active[host])
+        time.sleep(delay)
+        with self.lock:
+            self.active -= 1
+            self.host_active[host] -= 1
+        return url
+
+def wait_until(predicate, timeout=2.0):
+    end = time.time() + timeout
+    while not predicate():
+        if time.time() > end:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+class TestFetchPool(unittest.TestCase):
+    def setUp(self):
+        self.rec = Recorder()
+
+    def test_global_and_per_host_limits(self):
+        pool = fetch_pool.FetchPool(max_workers=4, per_host=2)
+        urls = [f"https://a.example/{i}" for i in range(6)] + [f"https://h{i}.example/" for i in range(6)]
+        futures = [pool.submit("r1", u, self.rec.fetch, u) for u in urls]
+        self.assertEqual(sorted(f.result(timeout=5) for f in futures), sorted(urls))
+        self.assertLessEqual(self.rec.max_active, 4)
+        self.assertEqual(self.rec.max_host_active["a.example"], 2)
+        self.assertEqual(pool.active(), 0)
+        self.assertEqual(pool.queue_depth(), 0)
+        pool.shutdown()
+
+    def test_requests_are_served_round_robin(self):
+        pool = fetch_pool.FetchPool(max_workers=1, per_host=1)
+        gate = threading.Event()
+        blocker = pool.submit("r0", "https://x.example/", gate.wait)
+        wait_until(lambda: pool.active() == 1)
+        big = [pool.submit("big", f"https://b{i}.example/", self.rec.fetch, f"big{i}", 0) for i in range(6)]
+        small = [pool.submit("small", f"https://s{i}.example/", self.rec.fetch, f"small{i}", 0) for i in range(2)]
+        self.assertEqual(pool.queue_depth(), 8)
+        gate.set()
+        for f in [blocker] + big + small:
+            f.result(timeout=5)
+        # The second request is interleaved instead of waiting for all of the first
+        self.assertEqual(self.rec.order[:4], ["big0", "small0", "big1", "small1"])
+        pool.shutdown()
+
+    def test_cancelled_jobs_never_run(self):
+        pool = fetch_pool.FetchPool(max_workers=1, per_host=1)
+        gate = threading.Event()
+        blocker = pool.submit("r1", "https://x.example/", gate.wait)
+        wait_until(lambda: pool.active() == 1)
+        queued = [pool.submit("r1", f"https://q{i}.example/", self.rec.fetch, f"q{i}") for i in range(3)]
+        self.assertTrue(queued[1].cancel())
+        self.assertEqual(pool.queue_depth(), 2)
+        gate.set()
+        blocker.result(timeout=5)
+        queued[0].result(timeout=5)
+        queued[2].result(timeout=5)
+        self.assertEqual(self.rec.order, ["q0", "q2"])
+        pool.shutdown()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Conversation history tests: token-bounded views and the rolling summary kept
+in chat_history.db (with a fake summarizer instead of the LLM).
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+history = load_module("rag_app.history", os.path.join(src_path, "history.py"))
+
+def make_db(rows):
+    path = os.path.join(tempfile.mkdtemp(), "chat_history.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT, text TEXT, timestamp TEXT, sources TEXT)")
+        conn.executemany("INSERT INTO history (sender, text) VALUES (?, ?)", rows)
+    return path
+
+class TestHistoryView(unittest.TestCase):
+
+    def test_long_answer_is_cut_not_everything_else(self):
+        turns = [
+            {"role": "user", "content": "富士山の標高は？"},
+            {"role": "assistant", "content": "富士山の標高は3776mです。" + "詳しい解説。" * 500},
+            {"role": "user", "content": "では二番目は？"},
+        ]
+        view = history.history_view(turns, 200)
+        self.assertEqual([h["role"] for h in view], ["user", "assistant", "user"])
+        self.assertTrue(view[1]["content"].startswith("富士山の標高は3776m"))
+        self.assertLessEqual(sum(history.estimate_tokens(h["content"]) + 4 for h in view), 200)
+
+    def test_smaller_budget_keeps_newest_turns(self):
+        turns = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"発言{i}" * 20} for i in range(6)]
+        small = history.history_view(turns, 100)
+        large = history.history_view(turns, 1000)
+        self.assertEqual(len(large), 6)
+        self.assertLess(len(small), 6)
+        self.assertEqual(small[-1], turns[-1])
+
+    def test_summary_goes_first_when_it_fits(self):
+        turns = [{"role": "summary", "content": "ユーザーは登山に関心がある。"}, {"role": "user", "content": "おすすめの山は？"}]
+        self.assertEqual(history.history_view(turns, 200)[0]["role"], "summary")
+        self.assertEqual(history.history_view(turns, 0), [])
+
+class TestHistoryStore(unittest.TestCase):
+
+    def test_rolling_summary(self):
+        path = make_db([("user" if i % 2 == 0 else "bot", f"row{i + 1}") for i in range(10)])
+        store = history.HistoryStore(path, recent_rows=4)
+        self.assertEqual([h["content"] for h in store.load()], ["row7", "row8", "row9", "row10"])
+
+        folded = []
+        def summarize(previous, turns):
+            folded.append([t["content"] for t in turns])
+            return (previous + " " if previous else "") + "+".join(t["content"] for t in turns)
+
+        self.assertTrue(store.refresh_summary(summarize))
+        self.assertEqual(folded, [["row1", "row2", "row3", "row4", "row5", "row6"]])
+        self.assertFalse(store.refresh_summary(summarize))  # nothing new aged out
+
+        with sqlite3.connect(path) as conn:
+            conn.executemany("INSERT INTO history (sender, text) VALUES (?, ?)", [("user", "row11"), ("bot", "row12")])
+        self.assertTrue(store.refresh_summary(summarize))
+        self.assertEqual(folded[-1], ["row7", "row8"])
+
+        loaded = store.load()
+        self.assertEqual(loaded[0], {"role": "summary", "content": "row1+row2+row3+row4+row5+row6 row7+row8"})
+        self.assertEqual([h["content"] for h in loaded[1:]], ["row9", "row10", "row11", "row12"])
+
+        store.clear()
+        self.assertEqual(len(store.load()), 4)
+
+    def test_failed_summary_keeps_recent_window(self):
+        path = make_db([("user", f"row{i}") for i in range(8)])
+        store = history.HistoryStore(path, recent_rows=2)
+        def broken(previous, turns):
+            raise RuntimeError("LM down")
+        self.assertFalse(store.refresh_summary(broken))
+        self.assertEqual([h["content"] for h in store.load()], ["row6", "row7"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Pooled LLM HTTP client tests.
+A local HTTP/1.1 stub counts TCP connections to check keep-alive reuse across calls and threads, for plain and streamed completions.
+"""
+
+import os
+import sys
+import json
+import threading
+import unittest
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+
+class StubLLM(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    connections = set()
+    bodies = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        StubLLM.connections.add(id(self.connection))
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        StubLLM.bodies.append(raw)
+        body = json.loads(raw)
+        if body.get("stream"):
+            # chunked like LM Studio: the end of the body comes after the [DONE] line
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            events = [json.dumps({"choices": [{"delta": {"content": piece}}]}) for piece in ["富士山", "です"]]
+            for event in events + ["[DONE]"]:
+                data = f"data: {event}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        out = json.dumps({"choices": [{"message": {"content": "ok"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+class TestPooledHTTPClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLM)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/v1/chat/completions"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        StubLLM.connections = set()
+        StubLLM.bodies = []
+        llm.llm_http = http_client.llm_http = http_client.PooledHTTPClient(pool_size=4)
+        llm.llm_backends = backends.BackendPool([self.url])
+
+    def test_sequential_calls_reuse_one_connection(self):
+        new_before = metrics.LLM_HTTP_CONNECTIONS.value(connection="new")
+        reused_before = metrics.LLM_HTTP_CONNECTIONS.value(connection="reused")
+        for _ in range(3):
+            self.assertEqual(llm.lmstudio_chat("system", "質問", retries=0), "ok")
+        self.assertEqual("".join(llm.lmstudio_chat_stream("system", "質問", retries=0)), "富士山です")
+        self.assertEqual(llm.lmstudio_chat("system", "質問", retries=0), "ok")
+        self.assertEqual(len(StubLLM.connections), 1)
+        self.assertEqual(metrics.LLM_HTTP_CONNECTIONS.value(connection="new") - new_before, 1)
+        self.assertEqual(metrics.LLM_HTTP_CONNECTIONS.value(connection="reused") - reused_before, 4)
+        # UTF-8 on the wire, not \\u escapes
+        self.assertIn("質問".encode("utf-8"), StubLLM.bodies[0])
+
+    def test_threads_share_the_pool(self):
+        def call():
+            for _ in range(3):
+                llm.lmstudio_chat("system", "質問", retries=0)
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(StubLLM.bodies), 9)
+        self.assertLessEqual(len(StubLLM.connections), 3)
+
+    def test_connect_and_read_timeouts_are_split(self):
+        client = http_client.PooledHTTPClient(connect_timeout=2)
+        self.assertEqual(client.timeouts(60), (2, 60))
+        self.assertEqual(client.timeouts(1), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Local intent classifier tests.
+A deterministic bag-of-characters encoder stands in for e5 so centroids and confidences are reproducible.
+"""
+
+import os
+import sys
+import json
+import tempfile
+import unittest
+import importlib.util
+import numpy as np
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+vectors = load_module("rag_app.vectors", os.path.join(src_path, "vectors.py"))
+intent_classifier = load_module("rag_app.intent_classifier", os.path.join(src_path, "intent_classifier.py"))
+
+def char_encode(texts):
+    """Hashed character counts: questions sharing characters land close together."""
+    out = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, t in enumerate(texts):
+        for ch in t:
+            out[i, ord(ch) % 64] += 1.0
+    return out
+
+EXAMPLES = [
+    ("明日の天気", "weather"), ("今日の天気予報", "weather"), ("週末の天気", "weather"),
+    ("最新ニュース", "news"), ("今日のニュース速報", "news"), ("経済ニュース", "news"),
+]
+
+class TestCentroidIntentClassifier(unittest.TestCase):
+
+    def test_predicts_nearest_centroid(self):
+        clf = intent_classifier.CentroidIntentClassifier.fit(EXAMPLES, char_encode)
+        self.assertEqual(clf.labels, ["news", "weather"])
+        label, confidence = clf.predict(char_encode(["大阪の天気"])[0])
+        self.assertEqual(label, "weather")
+        self.assertGreater(confidence, 0.5)
+
+    def test_low_confidence_is_left_to_llm(self):
+        clf = intent_classifier.CentroidIntentClassifier.fit(EXAMPLES, char_encode)
+        intent_classifier._classifier = clf
+        try:
+            self.assertEqual(intent_classifier.classify_intent(char_encode(["週末の天気"])[0], char_encode), "weather")
+            # Equidistant from both centroids: the softmax splits ~50/50, below the threshold.
+            blend = clf.centroids.sum(axis=0)
+            self.assertIsNone(intent_classifier.classify_intent(blend, char_encode))
+        finally:
+            intent_classifier._classifier = None
+
+    def test_save_load_round_trip(self):
+        clf = intent_classifier.CentroidIntentClassifier.fit(EXAMPLES, char_encode, "abc")
+        path = os.path.join(tempfile.mkdtemp(), "centroids.npz")
+        clf.save(path)
+        loaded = intent_classifier.CentroidIntentClassifier.load(path)
+        self.assertEqual((loaded.labels, loaded.fingerprint), (clf.labels, "abc"))
+        np.testing.assert_allclose(loaded.centroids, clf.centroids, rtol=1e-6)
+
+    def test_training_examples_from_log(self):
+        path = os.path.join(tempfile.mkdtemp(), "evaluation_log.jsonl")
+        entries = [
+            {"question": "名古屋の天気は？", "intent": "weather", "rating": "good"},
+            {"question": "渋谷のカフェ", "intent": "local_search", "rating": "bad"},
+            {"question": "q", "intent": "news", "rating": "good"},
+            {"question": "何か", "intent": "unknown", "rating": "good"},
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(json.dumps(e, ensure_ascii=False) for e in entries) + "\nnot json\n")
+        examples = intent_classifier.load_training_examples(path)
+        seeds = sum(len(v) for v in intent_classifier.SEED_EXAMPLES.values())
+        self.assertEqual(len(examples), seeds + 1)
+        self.assertIn(("名古屋の天気は？", "weather"), examples)
+        self.assertNotEqual(
+            intent_classifier.training_fingerprint(examples),
+            intent_classifier.training_fingerprint(examples[:-1]),
+        )
+
+if __name__ == "__main__":
+    unittest.main()
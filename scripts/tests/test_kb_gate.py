@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+KB-confidence gate tests.
+Synthetic unit vectors stand in for e5 embeddings so the similarity, gap and term-coverage signals are exact.
+"""
+
+import os
+import sys
+import unittest
+import importlib.util
+import numpy as np
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+vectors = load_module("rag_app.vectors", os.path.join(src_path, "vectors.py"))
+kb_gate = load_module("rag_app.kb_gate", os.path.join(src_path, "kb_gate.py"))
+
+def vec_with_similarity(q, sim, seed):
+    """A unit vector whose cosine similarity to unit vector q is exactly sim."""
+    rng = np.random.default_rng(1000 + seed)
+    r = rng.normal(size=q.shape).astype(np.float32)
+    r -= r.dot(q) * q
+    r /= np.linalg.norm(r)
+    return (sim * q + np.sqrt(1 - sim ** 2) * r).astype(np.float32)
+
+class TestKBGate(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        q = rng.normal(size=64).astype(np.float32)
+        self.q = q / np.linalg.norm(q)
+
+    def items(self, sims, texts):
+        return [{"text": t, "emb": vec_with_similarity(self.q, s, i)} for i, (s, t) in enumerate(zip(sims, texts))]
+
+    def test_query_terms(self):
+        self.assertEqual(kb_gate.query_terms("富士山の標高は何メートル？"), ["富士山", "標高", "メートル"])
+        self.assertEqual(kb_gate.query_terms("ＲＡＧとは？"), ["rag"])
+
+    def test_confident_kb_hit_passes(self):
+        items = self.items([0.93, 0.84, 0.80], ["富士山の標高は3776メートルです。", "山の一覧", "日本の地理"])
+        conf = kb_gate.kb_confidence("富士山の標高は何メートル？", self.q, items)
+        self.assertAlmostEqual(conf["top"], 0.93, places=4)
+        self.assertAlmostEqual(conf["gap"], 0.13, places=4)
+        self.assertEqual(conf["coverage"], 1.0)
+        self.assertTrue(kb_gate.kb_is_confident(conf, "informational"))
+
+    def test_each_signal_can_fail(self):
+        question = "富士山の標高は何メートル？"
+        low_top = kb_gate.kb_confidence(question, self.q, self.items([0.85, 0.80], ["富士山の標高はメートル", "x"]))
+        flat = kb_gate.kb_confidence(question, self.q, self.items([0.93, 0.925, 0.92], ["富士山の標高はメートル"] * 3))
+        uncovered = kb_gate.kb_confidence(question, self.q, self.items([0.93, 0.80], ["富士山は日本の山です。", "x"]))
+        for conf in (low_top, flat, uncovered):
+            self.assertFalse(kb_gate.kb_is_confident(conf, "informational"), conf)
+
+    def test_time_sensitive_intents_never_gate(self):
+        items = self.items([0.97, 0.80], ["今日の天気は晴れです。", "x"])
+        conf = kb_gate.kb_confidence("今日の天気", self.q, items)
+        self.assertIsNone(kb_gate.kb_gate_thresholds("weather"))
+        self.assertFalse(kb_gate.kb_is_confident(conf, "weather"))
+        self.assertFalse(kb_gate.kb_is_confident(conf, "news"))
+
+    def test_empty_results(self):
+        conf = kb_gate.kb_confidence("富士山", self.q, [])
+        self.assertFalse(kb_gate.kb_is_confident(conf, "informational"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Keyword matcher tests: per-category counts over NFKC text, the shared
+matcher's intent groups, and count_keyword_density on top of it.
+"""
+
+import gc
+import os
+import sys
+import weakref
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+keywords = load_module("rag_app.keywords", os.path.join(src_path, "keywords.py"))
+scraper = load_module("rag_app.scraper", os.path.join(src_path, "scraper.py"))
+
+class TestKeywordMatcher(unittest.TestCase):
+
+    def test_counts_per_category(self):
+        matcher = keywords.KeywordMatcher({"a": ["天気", "予報", "API"], "b": ["api", "速報"]})
+        counts = matcher.counts("明日の天気予報とAPIの更新、天気は晴れ")
+        self.assertEqual(counts, {"a": 3, "b": 1})
+        self.assertEqual(matcher.scan("速報", ["b"]), {"b": frozenset({"速報"})})
+
+    def test_nfkc_equivalent_forms(self):
+        matcher = keywords.KeywordMatcher({"w": ["℃", "%", "ﾗﾝﾁ"], "s": ["バージョン", "API"]})
+        # keywords are stored NFKC-normalized; the text only gets lower()
+        self.assertEqual(matcher.counts("最高気温12°C、降水確率30％、ランチ")["w"], 3)
+        self.assertEqual(matcher.counts("12℃")["w"], 1)
+        self.assertEqual(matcher.counts("ＡＰＩの新しいﾊﾞｰｼﾞｮﾝ")["s"], 2)
+
+    def test_count_keyword_density_matches_manual(self):
+        text = "速報：政府が発表。記者会見で明らかにした。" * 5
+        expected = min(4 / len(text) * 1000, 3.0)
+        self.assertAlmostEqual(scraper.count_keyword_density(text, config.NEWS_KEYWORDS), expected)
+
+    def test_density_reuses_one_matcher_per_keyword_list(self):
+        scraper.count_keyword_density("速報です", config.NEWS_KEYWORDS)
+        matcher = scraper._matcher_for(tuple(config.NEWS_KEYWORDS))
+        scraper.count_keyword_density("記者会見", list(config.NEWS_KEYWORDS))
+        self.assertIs(scraper._matcher_for(tuple(config.NEWS_KEYWORDS)), matcher)
+
+    def test_matcher_is_not_kept_alive_by_its_cache(self):
+        matcher = keywords.KeywordMatcher({"a": ["天気"]})
+        matcher.counts("天気")
+        ref = weakref.ref(matcher)
+        del matcher
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_shared_matcher_has_intent_groups(self):
+        counts = keywords.keyword_matcher.counts("このPDFを要約して", keywords.INTENT_CATEGORIES)
+        self.assertEqual(counts["intent:document_qa"], 2)
+        self.assertEqual(counts["intent:weather"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+LLM gateway tests.
+Checks that freed slots go to the highest priority class first, that enrichment stays under its cap and that waiting times out.
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+
+def wait_until(predicate, timeout=5):
+    end = time.time() + timeout
+    while not predicate():
+        if time.time() > end:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+class TestLLMGateway(unittest.TestCase):
+
+    def test_freed_slot_goes_to_highest_class(self):
+        gateway = llm.LLMGateway(max_in_flight=1)
+        order = []
+
+        def call(priority):
+            with gateway.slot(priority):
+                order.append(priority)
+
+        gateway.acquire(llm.PRIORITY_PLANNING)
+        threads = []
+        for priority in (llm.PRIORITY_ENRICHMENT, llm.PRIORITY_PLANNING, llm.PRIORITY_INTERACTIVE):
+            t = threading.Thread(target=call, args=(priority,))
+            t.start()
+            threads.append(t)
+            wait_until(lambda p=priority: gateway.queue_depth(p) == 1)
+        gateway.release(llm.PRIORITY_PLANNING)
+        for t in threads:
+            t.join(5)
+        self.assertEqual(order, [llm.PRIORITY_INTERACTIVE, llm.PRIORITY_PLANNING, llm.PRIORITY_ENRICHMENT])
+
+    def test_enrichment_cannot_fill_every_slot(self):
+        gateway = llm.LLMGateway(max_in_flight=2, enrichment_max_in_flight=1)
+        gateway.acquire(llm.PRIORITY_ENRICHMENT)
+        with self.assertRaises(RuntimeError):
+            gateway.acquire(llm.PRIORITY_ENRICHMENT, timeout=0.05)
+        self.assertEqual(gateway.queue_depth(llm.PRIORITY_ENRICHMENT), 0)
+
+        # the answer still gets the other slot right away
+        self.assertLess(gateway.acquire(llm.PRIORITY_INTERACTIVE, timeout=1), 0.5)
+        self.assertEqual(gateway.in_flight(llm.PRIORITY_ENRICHMENT), 1)
+        self.assertEqual(gateway.in_flight(llm.PRIORITY_INTERACTIVE), 1)
+
+    def test_slot_uses_priority_from_context(self):
+        gateway = llm.LLMGateway(max_in_flight=2)
+        with llm.llm_priority(llm.PRIORITY_ENRICHMENT):
+            with gateway.slot():
+                self.assertEqual(gateway.in_flight(llm.PRIORITY_ENRICHMENT), 1)
+        with gateway.slot():
+            self.assertEqual(gateway.in_flight(llm.PRIORITY_PLANNING), 1)
+        self.assertEqual(gateway.in_flight(llm.PRIORITY_PLANNING), 0)
+
+if __name__ == '__main__':
+    unittest.main()
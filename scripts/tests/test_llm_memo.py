@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+LLM memo tests.
+Checks prompt-version keying, that fallbacks are not stored, LRU eviction and the startup warm-load.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+llm_memo = load_module("rag_app.llm_memo", os.path.join(src_path, "llm_memo.py"))
+
+class TestLLMMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "llm_memo.db")
+        llm_memo.llm_memo = llm_memo.LLMMemo(self.path, max_entries=100, memory_entries=10)
+
+    def tearDown(self):
+        llm_memo.llm_memo = None
+
+    def test_second_call_is_served_from_memo(self):
+        calls = []
+        def compute():
+            calls.append(1)
+            return ["富士山 標高", "富士山 高さ"]
+
+        inputs = {"question": "富士山の標高", "intent": "informational", "n": 2}
+        first = llm_memo.memoized("query_gen", 1, inputs, compute)
+        second = llm_memo.memoized("query_gen", 1, inputs, compute)
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+
+        # callers get their own copy
+        second.append("mutated")
+        self.assertEqual(len(llm_memo.memoized("query_gen", 1, inputs, compute)), 2)
+
+    def test_version_bump_misses(self):
+        llm_memo.memoized("explain", 1, {"term": "api"}, lambda: "old")
+        self.assertEqual(llm_memo.memoized("explain", 2, {"term": "api"}, lambda: "new"), "new")
+        self.assertEqual(llm_memo.memoized("explain", 1, {"term": "api"}, lambda: "unused"), "old")
+
+    def test_fallbacks_are_not_stored(self):
+        self.assertIsNone(llm_memo.memoized("explain", 1, {"term": "rag"}, lambda: None))
+        self.assertEqual(llm_memo.memoized("explain", 1, {"term": "rag"}, lambda: "ok"), "ok")
+
+    def test_eviction_keeps_recent_rows(self):
+        memo = llm_memo.LLMMemo(self.path, max_entries=20, memory_entries=5)
+        for i in range(30):
+            memo.put("explain", 1, {"term": f"t{i}"}, f"e{i}")
+        with memo._connect() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM llm_memo").fetchone()[0]
+        self.assertLessEqual(count, 20)
+        self.assertLessEqual(len(memo._memory), 5)
+        self.assertEqual(memo.get("explain", 1, {"term": "t29"}), "e29")
+        self.assertIsNone(memo.get("explain", 1, {"term": "t0"}))
+
+    def test_warm_loads_most_recent(self):
+        memo = llm_memo.LLMMemo(self.path)
+        for i in range(5):
+            memo.put("explain", 1, {"term": f"t{i}"}, f"e{i}")
+            time.sleep(0.002)
+
+        fresh = llm_memo.LLMMemo(self.path, memory_entries=3)
+        self.assertEqual(fresh.warm(), 3)
+        self.assertEqual(list(fresh._memory.values()), ['"e2"', '"e3"', '"e4"'])
+
+if __name__ == '__main__':
+    unittest.main()
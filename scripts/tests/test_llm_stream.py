@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Streaming completion parser tests.
+Canned SSE lines check [DONE], blank and keep-alive lines, malformed chunks and failures after the first delta.
+"""
+
+import os
+import sys
+import json
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+
+def delta(text):
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": text}}]}).encode("utf-8")
+
+class FakeRaw:
+    def __init__(self):
+        self.drained = False
+
+    def drain_conn(self):
+        self.drained = True
+
+class FakeResponse:
+    """A streamed response whose body is the given lines; an exception in the list is raised mid-stream."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.raw = FakeRaw()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self.lines:
+            if isinstance(line, Exception):
+                raise line
+            yield line
+
+class FakeHTTP:
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.responses = []
+
+    def post(self, url, body, timeout, headers=None, stream=False):
+        self.responses.append(FakeResponse(self.bodies.pop(0)))
+        return self.responses[-1]
+
+class TestStreamDeltas(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = llm.llm_http
+        llm.llm_backends = backends.BackendPool(["http://stub/v1/chat/completions"], health_interval=0)
+
+    def tearDown(self):
+        llm.llm_http = self.saved
+
+    def stream(self, *bodies, retries=0):
+        llm.llm_http = FakeHTTP(*bodies)
+        return llm.lmstudio_chat_stream("system", "質問", retries=retries)
+
+    def test_skips_blank_keepalive_and_malformed_lines(self):
+        lines = [
+            b"",
+            b": keep-alive",
+            b"event: ping",
+            delta("富士山"),
+            b"data: {not json",
+            b'data: {"choices": []}',
+            b'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            b'data: {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 2}}',
+            b"",
+            delta("です"),
+            b"data: [DONE]",
+            delta("無視される"),
+        ]
+        self.assertEqual(list(self.stream(lines)), ["富士山", "です"])
+        # the rest of the body is drained so the connection can be reused
+        self.assertTrue(llm.llm_http.responses[0].raw.drained)
+
+    def test_stream_without_done_ends_with_the_body(self):
+        self.assertEqual(list(self.stream([delta("a"), delta("b")])), ["a", "b"])
+
+    def test_failure_before_first_delta_is_retried(self):
+        gen = self.stream([b": keep-alive", ConnectionError("reset")], [delta("ok"), b"data: [DONE]"], retries=1)
+        self.assertEqual(list(gen), ["ok"])
+        self.assertEqual(len(llm.llm_http.responses), 2)
+
+    def test_failure_after_first_delta_is_not_retried(self):
+        gen = self.stream([delta("途中"), ConnectionError("reset")], [delta("やり直し")], retries=1)
+        received = []
+        with self.assertRaisesRegex(RuntimeError, "Stream interrupted"):
+            for piece in gen:
+                received.append(piece)
+        self.assertEqual(received, ["途中"])
+        self.assertEqual(len(llm.llm_http.responses), 1)
+
+if __name__ == '__main__':
+    unittest.main()
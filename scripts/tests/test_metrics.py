@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Prometheus exposition tests.
+Renders counters, gauges and histograms on a private registry and checks the /metrics text line by line.
+"""
+
+import os
+import sys
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+
+class TestRendering(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def render(self):
+        return self.registry.render().splitlines()
+
+    def test_counter_lines(self):
+        c = self.registry.register(metrics.Counter("rag_test_total", "Test counter.", ["outcome"]))
+        c.inc(outcome="ok")
+        c.inc(2, outcome="ok")
+        c.inc(0.5, outcome='say "hi"\n')
+        self.assertEqual(self.render(), [
+            "# HELP rag_test_total Test counter.",
+            "# TYPE rag_test_total counter",
+            'rag_test_total{outcome="ok"} 3',
+            'rag_test_total{outcome="say \\"hi\\"\\n"} 0.5',
+        ])
+        with self.assertRaises(ValueError):
+            c.inc(stage="x")
+
+    def test_histogram_buckets_sum_and_count(self):
+        h = self.registry.register(metrics.Histogram("rag_test_seconds", "Test histogram.", ["stage"], buckets=(0.1, 1.0, 0.5)))
+        for value in (0.05, 0.1, 0.3, 0.7, 2.0):  # 0.1 lands in le="0.1": the bounds are inclusive
+            h.observe(value, stage="fetch")
+        h.observe(0.2, stage="embed")
+        self.assertEqual(self.render(), [
+            "# HELP rag_test_seconds Test histogram.",
+            "# TYPE rag_test_seconds histogram",
+            'rag_test_seconds_bucket{stage="embed",le="0.1"} 0',
+            'rag_test_seconds_bucket{stage="embed",le="0.5"} 1',
+            'rag_test_seconds_bucket{stage="embed",le="1"} 1',
+            'rag_test_seconds_bucket{stage="embed",le="+Inf"} 1',
+            'rag_test_seconds_sum{stage="embed"} 0.2',
+            'rag_test_seconds_count{stage="embed"} 1',
+            'rag_test_seconds_bucket{stage="fetch",le="0.1"} 2',
+            'rag_test_seconds_bucket{stage="fetch",le="0.5"} 3',
+            'rag_test_seconds_bucket{stage="fetch",le="1"} 4',
+            'rag_test_seconds_bucket{stage="fetch",le="+Inf"} 5',
+            'rag_test_seconds_sum{stage="fetch"} 3.15',
+            'rag_test_seconds_count{stage="fetch"} 5',
+        ])
+        self.assertEqual(h.count(stage="fetch"), 5)
+
+    def test_gauge_function_sampled_at_render(self):
+        g = self.registry.register(metrics.Gauge("rag_test_depth", "Test gauge."))
+        depth = [3]
+        g.set_function(lambda: depth[0])
+        depth[0] = 7
+        self.assertEqual(self.render()[-1], "rag_test_depth 7")
+
+    def test_register_returns_existing_metric(self):
+        first = self.registry.register(metrics.Counter("rag_test_total", "Test counter."))
+        self.assertIs(self.registry.register(metrics.Counter("rag_test_total", "Again.")), first)
+
+    def test_stage_timer_observes_stage_latency(self):
+        before = metrics.STAGE_LATENCY.count(stage="context")
+        with metrics.stage_timer("context"):
+            pass
+        self.assertEqual(metrics.STAGE_LATENCY.count(stage="context"), before + 1)
+        self.assertIn('rag_stage_latency_seconds_count{stage="context"}', metrics.render_metrics())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Pipeline stage tests for core.py.
+Fakes stand in for the LLM and the network so each stage's fallback paths can be checked in isolation.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+import importlib.util
+from unittest import mock
+import numpy as np
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+# Keep the module-level caches away from the repository's databases. The settings are read
+# when config loads; restoring them afterwards keeps them out of the test modules collected later.
+tmpdir = tempfile.mkdtemp()
+_ENV = {
+    "RESPONSE_CACHE_PATH": os.path.join(tmpdir, "cache.db"),
+    "EMBED_CACHE_PATH": os.path.join(tmpdir, "embed_cache.db"),
+    "LLM_MEMO_ENABLED": "0",
+    "TRACE_ENABLED": "0",
+}
+
+with mock.patch.dict(os.environ, _ENV):
+    config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+    utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+    metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+    tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+    http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+    backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+    llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+    keywords = load_module("rag_app.keywords", os.path.join(src_path, "keywords.py"))
+    scraper = load_module("rag_app.scraper", os.path.join(src_path, "scraper.py"))
+    search = load_module("rag_app.search", os.path.join(src_path, "search.py"))
+    cache = load_module("rag_app.cache", os.path.join(src_path, "cache.py"))
+    db = load_module("rag_app.db", os.path.join(src_path, "db.py"))
+    embed_cache = load_module("rag_app.embed_cache", os.path.join(src_path, "embed_cache.py"))
+    llm_memo = load_module("rag_app.llm_memo", os.path.join(src_path, "llm_memo.py"))
+    vectors = load_module("rag_app.vectors", os.path.join(src_path, "vectors.py"))
+    intent_classifier = load_module("rag_app.intent_classifier", os.path.join(src_path, "intent_classifier.py"))
+    feedback = load_module("rag_app.feedback", os.path.join(src_path, "feedback.py"))
+    kb_gate = load_module("rag_app.kb_gate", os.path.join(src_path, "kb_gate.py"))
+    history = load_module("rag_app.history", os.path.join(src_path, "history.py"))
+    deadline = load_module("rag_app.deadline", os.path.join(src_path, "deadline.py"))
+    fetch_pool = load_module("rag_app.fetch_pool", os.path.join(src_path, "fetch_pool.py"))
+    singleflight = load_module("rag_app.singleflight", os.path.join(src_path, "singleflight.py"))
+    batch = load_module("rag_app.batch", os.path.join(src_path, "batch.py"))
+    core = load_module("rag_app.core", os.path.join(src_path, "core.py"))
+
+class TestFinalAnswerStream(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = core.lmstudio_chat_stream
+
+    def tearDown(self):
+        core.lmstudio_chat_stream = self.saved
+
+    def fake_stream(self, pieces, error=None):
+        def _stream(messages, **kwargs):
+            yield from pieces
+            if error is not None:
+                raise error
+        core.lmstudio_chat_stream = _stream
+
+    def test_deltas_are_forwarded_and_joined(self):
+        self.fake_stream(["富士山は", "3776mです。"])
+        received = []
+        answer = core.final_answer_pipeline("富士山の高さは？", "context", on_delta=received.append)
+        self.assertEqual(received, ["富士山は", "3776mです。"])
+        self.assertEqual(answer, "富士山は3776mです。")
+
+    def test_partial_answer_is_kept_when_the_stream_fails(self):
+        self.fake_stream(["富士山は", "3776m"], RuntimeError("[lmstudio_chat_stream] Stream interrupted: reset"))
+        received = []
+        answer = core.final_answer_pipeline("富士山の高さは？", "context", on_delta=received.append)
+        self.assertEqual(received, ["富士山は", "3776m"])
+        self.assertEqual(answer, "富士山は3776m")
+
+    def test_failure_before_any_delta_gives_the_error_message(self):
+        self.fake_stream([], RuntimeError("[lmstudio_chat_stream] Network/API error after 0 retries"))
+        received = []
+        answer = core.final_answer_pipeline("富士山の高さは？", "context", on_delta=received.append)
+        self.assertEqual(received, [])
+        self.assertEqual(answer, core.ANSWER_ERROR_MESSAGE)
+
+class FakePages:
+    """extract_text stand-in: "good" pages come back at once, "slow" ones block until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, url, timeout=8):
+        self.calls.append(url)
+        if "slow" in url:
+            self.release.wait(10)
+        return f"{url} の本文です。" * 10
+
+class TestFetchStage(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (core.fetch_pool, core.extract_text, core._score_for_intent, core._embed_page_chunks)
+        self.pages = FakePages()
+        self.embedded = []
+        core.fetch_pool = fetch_pool.FetchPool(max_workers=2, per_host=1)
+        core.extract_text = self.pages
+        core._score_for_intent = lambda intent, text, title, url: 3.0 if "good" in url else 0.1
+        core._embed_page_chunks = lambda item: self.embedded.append(item["url"])
+
+    def tearDown(self):
+        self.pages.release.set()
+        core.fetch_pool.shutdown()
+        core.fetch_pool, core.extract_text, core._score_for_intent, core._embed_page_chunks = self.saved
+
+    def run_stage(self, urls, dl):
+        async def _run():
+            with tracing.span("test", new_trace=True) as sp:
+                scored = await core._fetch_stage([{"href": u, "title": u} for u in urls], "informational", dl)
+                return scored, sp.attributes
+        return asyncio.run(_run())
+
+    def test_stops_once_enough_good_pages_and_cancels_the_rest(self):
+        good = [f"https://good{i}.example.com/" for i in range(config.RERANK_MAX_WEB_SOURCES)]
+        # One fetch per host: the other slow.example.com pages queue behind the first
+        queued = ["https://slow.example.com/b", "https://slow.example.com/c", "https://slow.example.com/d"]
+        urls = ["https://slow.example.com/a"] + good + queued
+        enough = metrics.FETCH_STAGE_EXITS.value(reason="enough")
+        cancelled = metrics.FETCH_CANCELLED.value()
+
+        scored, attributes = self.run_stage(urls, deadline.Deadline(0))
+        self.assertEqual(sorted(s["url"] for s in scored), sorted(good))
+        self.assertEqual(sorted(self.embedded), sorted(good))
+        self.assertEqual(attributes["fetch_exit"], "enough")
+        self.assertEqual(attributes["fetch_cancelled"], 1 + len(queued))
+        self.assertEqual(metrics.FETCH_STAGE_EXITS.value(reason="enough"), enough + 1)
+        self.assertEqual(metrics.FETCH_CANCELLED.value(), cancelled + 1 + len(queued))
+
+        # The queued fetches were dropped from the pool and never start
+        self.pages.release.set()
+        time.sleep(0.1)
+        self.assertEqual(core.fetch_pool.queue_depth(), 0)
+        self.assertFalse(set(queued) & set(self.pages.calls))
+
+    def test_deadline_bounds_the_stage(self):
+        urls = ["https://good0.example.com/", "https://slow-a.example.com/", "https://slow-b.example.com/"]
+        # 0.5 s left after the answer reserve; a stage timeout never goes below the 1 s floor
+        dl = deadline.Deadline((config.DEADLINE_ANSWER_RESERVE + 0.5) * 1000)
+        start = time.monotonic()
+        scored, attributes = self.run_stage(urls, dl)
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual([s["url"] for s in scored], ["https://good0.example.com/"])
+        self.assertEqual(attributes["fetch_exit"], "deadline")
+        self.assertEqual(dl.degraded, ["fetch"])
+
+class TestFollowUpIntent(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (core.classify_intent, core.INTENT_CLASSIFIER_ENABLED)
+        self.classified = []
+        def _classify(q_emb, encode, log_path=None):
+            self.classified.append(q_emb)
+            return "weather"
+        core.classify_intent = _classify
+        core.INTENT_CLASSIFIER_ENABLED = True
+        self.history = [{"role": "user", "content": "明日の東京の天気は？"}, {"role": "assistant", "content": "晴れです。"}]
+
+    def tearDown(self):
+        core.classify_intent, core.INTENT_CLASSIFIER_ENABLED = self.saved
+
+    def test_without_history_the_classifier_decides(self):
+        self.assertEqual(core._local_intent("その続きは？", [0.1]), ("weather", "classifier"))
+
+    def test_short_or_anaphoric_follow_up_goes_to_the_llm(self):
+        self.assertIsNone(core._local_intent("その続きは？", [0.1], self.history))
+        self.assertIsNone(core._local_intent("大阪の場合の降水確率と最高気温も同じように教えて", [0.1], self.history))
+        self.assertEqual(self.classified, [])
+
+    def test_self_contained_question_with_history_is_classified(self):
+        self.assertEqual(core._local_intent("大阪の週間天気予報と最高気温を教えてください", [0.1], self.history),
+                         ("weather", "classifier"))
+        # document tokens still win without the classifier
+        self.assertEqual(core._local_intent("それを要約して", [0.1], self.history), ("document_qa", "heuristic"))
+
+class ScriptedLLM:
+    """lmstudio_chat stand-in that answers by call kind: the plan, intent and query-generation prompts."""
+
+    def __init__(self, plan=None, intent="informational", queries='["富士山 標高", "富士山 高さ"]'):
+        self.replies = {"plan": plan, "intent": intent, "query_gen": queries}
+        self.calls = []
+
+    def __call__(self, messages, **kwargs):
+        system = messages[0]["content"]
+        kind = ("plan" if system.startswith("You plan web searches")
+                else "intent" if system.startswith("Classify intent") else "query_gen")
+        self.calls.append(kind)
+        reply = self.replies[kind]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+class TestSearchPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = core.lmstudio_chat
+
+    def tearDown(self):
+        core.lmstudio_chat = self.saved
+
+    def test_parse_plan_accepts_fenced_and_wrapped_objects(self):
+        reply = '```json\n{"intent": "News", "queries": ["台風 速報", " ", 3, "台風 進路"], "needs_web": false}\n```'
+        self.assertEqual(core._parse_plan("台風の情報", reply, 3),
+                         {"intent": "news", "queries": ["台風 速報", "台風 進路"], "needs_web": False})
+        reply = 'Here is the plan: {"intent": "weather", "queries": ["東京 天気", "東京 予報", "東京 気象庁"]} done.'
+        self.assertEqual(core._parse_plan("東京の天気", reply, 2)["queries"], ["東京 天気", "東京 予報"])
+
+    def test_parse_plan_rejects_malformed_and_partial_json(self):
+        for reply in (
+            "",
+            "informational",
+            '{"intent": "news", "queries": ["台風 速報",}',
+            '{"intent": "news", "queries": ["台風 速報", "台風',  # cut off at max_tokens
+            '["台風 速報"]',
+            '{"intent": "recommendation", "queries": ["台風 速報"]}',
+            '{"queries": ["台風 速報"]}',
+        ):
+            self.assertIsNone(core._parse_plan("台風の情報", reply, 3), reply)
+
+    def test_parse_plan_fills_missing_fields(self):
+        plan = core._parse_plan("富士山の高さ", '{"intent": "informational", "queries": "富士山", "needs_web": "no"}', 2)
+        self.assertEqual(plan["queries"], core._fallback_search_queries("富士山の高さ", "informational", 2))
+        self.assertIs(plan["needs_web"], True)
+        # other and document_qa need no queries
+        self.assertEqual(core._parse_plan("こんにちは", '{"intent": "other"}', 3)["queries"], [])
+        self.assertEqual(core._parse_plan("要約して", '{"intent": "document_qa", "queries": []}', 3)["queries"], [])
+
+    def test_plan_search_returns_none_on_error_or_invalid_reply(self):
+        for reply, outcome in ((RuntimeError("timeout"), "error"), ("I cannot help with that.", "invalid"),
+                               ('{"intent": "weather", "queries": ["大阪 天気"]}', "ok")):
+            core.lmstudio_chat = ScriptedLLM(plan=reply)
+            before = metrics.PLAN_CALLS.value(outcome=outcome)
+            plan = core.plan_search("大阪の天気", n=3)
+            self.assertEqual(plan is None, outcome != "ok")
+            self.assertEqual(metrics.PLAN_CALLS.value(outcome=outcome), before + 1)
+
+class TestPlanFallback(unittest.TestCase):
+    """_answer_question with a scripted LLM and no retrieval: which calls decide intent and queries."""
+
+    def setUp(self):
+        names = ("lmstudio_chat", "PLAN_CALL_ENABLED", "_local_intent", "_embed_query", "query_chroma_by_embeddings",
+                 "search_chroma_many", "_kb_gate_stage", "rerank_candidates", "final_answer_pipeline",
+                 "get_semantic_response", "store_cached_response", "store_semantic_response")
+        self.saved = {name: getattr(core, name) for name in names}
+        self.searched = []
+        core.PLAN_CALL_ENABLED = True
+        core._local_intent = lambda question, q_emb=None, history=[]: None
+        core._embed_query = lambda question: np.ones(4, dtype=np.float32) / 2
+        core.query_chroma_by_embeddings = lambda embs, n: [[] for _ in embs]
+        core.search_chroma_many = lambda queries, n, prior=(): self.searched.append(list(queries)) or []
+        async def _no_gate(*args):
+            return False
+        core._kb_gate_stage = _no_gate
+        core.rerank_candidates = lambda question, candidates, *args: []
+        core.final_answer_pipeline = lambda question, context, *args: "資料によると3章は結論です。"
+        # every question here is a cache miss and leaves nothing behind
+        core.get_semantic_response = lambda *args: None
+        core.store_cached_response = core.store_semantic_response = lambda *args: None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(core, name, value)
+
+    def answer(self, question):
+        async def _run():
+            with tracing.span("test", new_trace=True):
+                return await core._answer_question(question, [], "normal", None, deadline.Deadline(0))
+        return asyncio.run(_run())
+
+    def test_unusable_plan_falls_back_to_intent_and_query_calls(self):
+        core.lmstudio_chat = llm_calls = ScriptedLLM(plan='{"intent": "document_qa", "queries": [', intent="document_qa",
+                                                     queries='["第3章 内容", "第3章 結論"]')
+        decisions = metrics.INTENT_DECISIONS.value(source="llm")
+        result = self.answer("第3章には何が書いてあった？")
+        self.assertEqual(llm_calls.calls, ["plan", "intent", "query_gen"])
+        self.assertEqual(self.searched, [["第3章 内容", "第3章 結論"]])
+        self.assertEqual(metrics.INTENT_DECISIONS.value(source="llm"), decisions + 1)
+        self.assertEqual(result["answer"], "資料によると3章は結論です。")
+
+    def test_failed_calls_fall_back_to_heuristics_and_templates(self):
+        question = "第4章の要点は何だった？"
+        core.lmstudio_chat = llm_calls = ScriptedLLM(plan=RuntimeError("down"), intent=RuntimeError("down"),
+                                                     queries=RuntimeError("down"))
+        decisions = metrics.INTENT_DECISIONS.value(source="fallback")
+        self.answer(question)
+        self.assertEqual(llm_calls.calls, ["plan", "intent", "query_gen"])
+        self.assertEqual(metrics.INTENT_DECISIONS.value(source="fallback"), decisions + 1)
+        self.assertEqual(self.searched, [core._fallback_search_queries(question, "informational", config.NUM_SEARCH_QUERIES)])
+
+    def test_usable_plan_skips_the_separate_calls(self):
+        core.lmstudio_chat = llm_calls = ScriptedLLM(
+            plan='{"intent": "document_qa", "queries": ["第5章 内容"], "needs_web": false}')
+        self.answer("第5章には何が書いてあった？")
+        self.assertEqual(llm_calls.calls, ["plan"])
+        self.assertEqual(self.searched, [["第5章 内容"]])
+
+class TestPipelinesInFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (core._answer_question, core.SINGLE_FLIGHT_ENABLED)
+
+    def tearDown(self):
+        core._answer_question, core.SINGLE_FLIGHT_ENABLED = self.saved
+
+    def test_counts_pipelines_with_and_without_single_flight(self):
+        seen = []
+        async def _answer(question, *args):
+            seen.append(core.pipelines_in_flight())
+            await asyncio.sleep(0.01)  # let the other question start
+            if question == "失敗":
+                raise RuntimeError("boom")
+            return {"answer": question, "sources": []}
+        core._answer_question = _answer
+
+        for enabled in (False, True):
+            core.SINGLE_FLIGHT_ENABLED = enabled
+            async def _both():
+                return await asyncio.gather(core.process_question_async("富士山"), core.process_question_async("琵琶湖"))
+            asyncio.run(_both())
+            with self.assertRaises(RuntimeError):
+                asyncio.run(core.process_question_async("失敗"))
+        self.assertEqual(seen, [1, 2, 1] * 2)
+        self.assertEqual(core.pipelines_in_flight(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Refine-query tests for search.py.
+A stand-in lmstudio_chat returns the reply text; the extra queries are parsed out of it.
+"""
+
+import os
+import sys
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+http_client = load_module("rag_app.http_client", os.path.join(src_path, "http_client.py"))
+backends = load_module("rag_app.backends", os.path.join(src_path, "backends.py"))
+llm = load_module("rag_app.llm", os.path.join(src_path, "llm.py"))
+search = load_module("rag_app.search", os.path.join(src_path, "search.py"))
+
+HITS = [
+    {"title": "台風10号 最新情報", "body": "気象庁によると台風10号は..."},
+    {"title": "台風10号 進路予想", "body": "週末にかけて西日本に接近..."},
+]
+
+class TestRefineQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = search.lmstudio_chat
+        self.calls = []
+
+    def tearDown(self):
+        search.lmstudio_chat = self.saved
+
+    def reply_with(self, text):
+        def _chat(messages, **kwargs):
+            self.calls.append(kwargs)
+            if isinstance(text, Exception):
+                raise text
+            return text
+        search.lmstudio_chat = _chat
+
+    def test_parses_numbered_and_bulleted_lines(self):
+        self.reply_with("1. 台風10号 上陸 時期\n\n- \"台風10号 被害 西日本\"\n3) 台風10号 交通 影響")
+        self.assertEqual(search.refine_queries_from_hits(HITS, 2, intent="news", timeout=3),
+                         ["台風10号 上陸 時期", "台風10号 被害 西日本"])
+        self.assertEqual(self.calls[0]["timeout"], 3)
+
+    def test_skips_intents_and_empty_hits_without_calling_the_llm(self):
+        self.reply_with("台風10号 上陸")
+        self.assertEqual(search.refine_queries_from_hits(HITS, intent="weather"), [])
+        self.assertEqual(search.refine_queries_from_hits([], intent="news"), [])
+        self.assertEqual(self.calls, [])
+
+    def test_llm_error_gives_no_queries(self):
+        self.reply_with(RuntimeError("timeout"))
+        self.assertEqual(search.refine_queries_from_hits(HITS, intent="news"), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Response cache tests.
+Checks key normalization, intent TTLs and KB-generation invalidation against a temporary cache.db.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+import numpy as np
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+# Keep the module-level cache instance away from the repository's cache.db (only while loading)
+with mock.patch.dict(os.environ, {"RESPONSE_CACHE_PATH": os.path.join(tempfile.mkdtemp(), "cache.db")}):
+    config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+    utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+    metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+    cache = load_module("rag_app.cache", os.path.join(src_path, "cache.py"))
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = cache.ResponseCache(os.path.join(self.tmpdir, "cache.db"))
+
+    def test_roundtrip_with_normalized_question(self):
+        sources = [{"title": "富士山", "url": "https://ja.wikipedia.org/wiki/富士山"}]
+        self.cache.put("富士山の高さは？", "normal", "informational", "3776mです。", sources)
+
+        hit = self.cache.get("  富士山の高さは? ", "normal")
+        self.assertIsNotNone(hit)
+        self.assertEqual(hit["answer"], "3776mです。")
+        self.assertEqual(hit["sources"], sources)
+        self.assertEqual(hit["intent"], "informational")
+
+    def test_difficulty_is_part_of_key(self):
+        self.cache.put("RAGとは", "easy", "informational", "やさしい説明", [])
+        self.assertIsNone(self.cache.get("RAGとは", "professional"))
+
+    def test_intent_ttl_expiry(self):
+        self.cache.put("東京の天気", "normal", "weather", "晴れです。", [])
+        self.assertIsNotNone(self.cache.get("東京の天気", "normal"))
+
+        # Age the entry past the weather TTL
+        with self.cache._connect() as conn:
+            conn.execute("UPDATE response_cache SET timestamp = ?", (time.time() - cache.ttl_for_intent("weather") - 1,))
+        self.assertIsNone(self.cache.get("東京の天気", "normal"))
+
+    def test_other_intent_not_cached(self):
+        self.cache.put("こんにちは", "normal", "other", "こんにちは！", [])
+        self.assertIsNone(self.cache.get("こんにちは", "normal"))
+
+    def test_generation_bump_invalidates(self):
+        self.cache.put("このドキュメントの要約", "normal", "document_qa", "要約です。", [])
+        before = self.cache.generation()
+        self.assertEqual(self.cache.bump_generation(), before + 1)
+        self.assertIsNone(self.cache.get("このドキュメントの要約", "normal"))
+
+    def test_history_is_part_of_key(self):
+        about_fuji = [{"role": "user", "content": "富士山について教えて"}, {"role": "assistant", "content": "日本一の山です。"}]
+        about_biwa = [{"role": "user", "content": "琵琶湖について教えて"}, {"role": "assistant", "content": "日本一の湖です。"}]
+        self.cache.put("それについてもっと詳しく", "normal", "informational", "富士山の詳細", [], about_fuji)
+
+        self.assertIsNone(self.cache.get("それについてもっと詳しく", "normal", about_biwa))
+        self.assertIsNone(self.cache.get("それについてもっと詳しく", "normal"))
+        self.assertEqual(self.cache.get("それについてもっと詳しく", "normal", list(about_fuji))["answer"], "富士山の詳細")
+
+    def test_answer_finished_after_a_kb_change_stays_unreachable(self):
+        started_on = self.cache.generation()
+        self.cache.bump_generation()  # an upload lands while the request is running
+        self.cache.put("このドキュメントの要約", "normal", "document_qa", "古い要約", [], generation=started_on)
+        self.assertIsNone(self.cache.get("このドキュメントの要約", "normal"))
+
+class TestSemanticCache(unittest.TestCase):
+
+    def _vec(self, seed, noise=0.0, base=None):
+        rng = np.random.default_rng(seed)
+        v = rng.standard_normal(384).astype(np.float32) if base is None else base.copy()
+        if noise:
+            v = v + noise * rng.standard_normal(384).astype(np.float32)
+        return v / np.linalg.norm(v)
+
+    def test_near_duplicate_hit_and_metrics(self):
+        sc = cache.SemanticCache(max_entries=8)
+        base = self._vec(1)
+        sc.add(base, "Gemini 最新バージョン", "normal", 0, "informational", "Gemini 2.5 です。", [])
+
+        hit = sc.lookup(self._vec(2, noise=0.01, base=base), "normal", 0)
+        self.assertIsNotNone(hit)
+        self.assertEqual(hit["answer"], "Gemini 2.5 です。")
+        self.assertIsNone(sc.lookup(self._vec(3), "normal", 0))
+        self.assertEqual((sc.stats()["hits"], sc.stats()["misses"]), (1, 1))
+
+    def test_requires_same_difficulty_and_generation(self):
+        sc = cache.SemanticCache(max_entries=8)
+        base = self._vec(4)
+        sc.add(base, "RAGとは", "easy", 3, "informational", "説明", [])
+        self.assertIsNone(sc.lookup(base, "normal", 3))
+        self.assertIsNone(sc.lookup(base, "easy", 4))
+        self.assertIsNotNone(sc.lookup(base, "easy", 3))
+
+    def test_requires_same_history(self):
+        sc = cache.SemanticCache(max_entries=8)
+        base = self._vec(8)
+        about_fuji = [{"role": "user", "content": "富士山について教えて"}]
+        sc.add(base, "その続きは？", "normal", 0, "informational", "富士山の続き", [], about_fuji)
+        follow_up = self._vec(9, noise=0.01, base=base)
+        self.assertIsNone(sc.lookup(follow_up, "normal", 0, [{"role": "user", "content": "琵琶湖について教えて"}]))
+        self.assertIsNone(sc.lookup(follow_up, "normal", 0))
+        self.assertIsNotNone(sc.lookup(follow_up, "normal", 0, about_fuji))
+
+    def test_lru_eviction_is_size_bounded(self):
+        sc = cache.SemanticCache(max_entries=2)
+        a, b, c = self._vec(5), self._vec(6), self._vec(7)
+        sc.add(a, "a", "normal", 0, "informational", "A", [])
+        time.sleep(0.01)
+        sc.add(b, "b", "normal", 0, "informational", "B", [])
+        time.sleep(0.01)
+        sc.lookup(a, "normal", 0)  # a becomes most recently used
+        sc.add(c, "c", "normal", 0, "informational", "C", [])
+
+        self.assertEqual(len(sc), 2)
+        self.assertEqual(sc.evictions, 1)
+        self.assertIsNone(sc.lookup(b, "normal", 0))
+        self.assertIsNotNone(sc.lookup(a, "normal", 0))
+
+if __name__ == "__main__":
+    unittest.main()
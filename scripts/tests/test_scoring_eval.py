@@ -36,6 +36,9 @@ src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.
 # Load dependencies first
 config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
 utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+keywords = load_module("rag_app.keywords", os.path.join(src_path, "keywords.py"))
 
 # Load scraper
 scraper = load_module("rag_app.scraper", os.path.join(src_path, "scraper.py"))
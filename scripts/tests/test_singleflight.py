@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Single-flight coalescing tests.
+A fake pipeline counts its runs and emits events; concurrent callers with the same key must share one run.
+"""
+
+import os
+import sys
+import asyncio
+import threading
+import unittest
+import importlib.util
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+singleflight = load_module("rag_app.singleflight", os.path.join(src_path, "singleflight.py"))
+
+class FakePipeline:
+    def __init__(self, delay=0.05, fail=False):
+        self.runs = 0
+        self.delay = delay
+        self.fail = fail
+
+    async def __call__(self, emit):
+        self.runs += 1
+        emit({"type": "sources", "content": []})
+        await asyncio.sleep(self.delay)
+        emit({"type": "answer", "content": "こんにち"})
+        emit({"type": "answer", "content": "は"})
+        if self.fail:
+            raise RuntimeError("boom")
+        return {"answer": "こんにちは", "sources": []}
+
+class TestSingleFlight(unittest.TestCase):
+    def test_key_normalizes_question_and_fingerprints_history(self):
+        k = singleflight.flight_key
+        self.assertEqual(k("富士山の高さは？", "normal", []), k(" 富士山の高さは ", "normal", []))
+        self.assertNotEqual(k("富士山の高さは？", "normal", []), k("富士山の高さは？", "easy", []))
+        history = [{"role": "user", "content": "こんにちは"}]
+        self.assertNotEqual(k("富士山の高さは？", "normal", []), k("富士山の高さは？", "normal", history))
+
+    def test_concurrent_callers_share_one_run_and_all_events(self):
+        sf = singleflight.SingleFlight()
+        pipeline = FakePipeline()
+
+        async def main():
+            events = [[], [], []]
+            results = await asyncio.gather(*[
+                sf.run("k", events[i].append, pipeline) for i in range(3)
+            ])
+            return results, events
+
+        results, events = asyncio.run(main())
+        self.assertEqual(pipeline.runs, 1)
+        self.assertEqual([r["answer"] for r in results], ["こんにちは"] * 3)
+        self.assertNotIn("coalesced", results[0])
+        self.assertTrue(results[1]["coalesced"] and results[2]["coalesced"])
+        for ev in events:
+            self.assertEqual([e["type"] for e in ev], ["sources", "answer", "answer"])
+        self.assertEqual(sf.in_flight(), 0)
+
+    def test_joiners_from_other_threads_and_loops(self):
+        sf = singleflight.SingleFlight()
+        pipeline = FakePipeline(delay=0.2)
+        results = [None] * 4
+        events = [[] for _ in range(4)]
+
+        def worker(i):
+            results[i] = asyncio.run(sf.run("k", events[i].append, pipeline))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(pipeline.runs, 1)
+        self.assertTrue(all(r["answer"] == "こんにちは" for r in results))
+        self.assertTrue(all(len(ev) == 3 for ev in events))
+
+    def test_errors_reach_every_caller_and_release_the_key(self):
+        sf = singleflight.SingleFlight()
+        pipeline = FakePipeline(fail=True)
+
+        async def main():
+            return await asyncio.gather(*[sf.run("k", None, pipeline) for _ in range(2)], return_exceptions=True)
+
+        outcomes = asyncio.run(main())
+        self.assertTrue(all(isinstance(o, RuntimeError) for o in outcomes))
+        self.assertEqual(pipeline.runs, 1)
+        # A later request runs again instead of reusing the failure
+        pipeline.fail = False
+        self.assertEqual(asyncio.run(sf.run("k", None, pipeline))["answer"], "こんにちは")
+        self.assertEqual(pipeline.runs, 2)
+
+    def test_different_keys_run_separately(self):
+        sf = singleflight.SingleFlight()
+        pipeline = FakePipeline()
+
+        async def main():
+            await asyncio.gather(sf.run("a", None, pipeline), sf.run("b", None, pipeline))
+
+        asyncio.run(main())
+        self.assertEqual(pipeline.runs, 2)
+
+if __name__ == "__main__":
+    unittest.main()
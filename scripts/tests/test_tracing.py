@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Span tracing tests.
+Spans are written to a temporary JSONL sink and read back by trace_id, across threads and rotated files.
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+# Create a mock rag_app package
+rag_app_pkg = type(sys)('rag_app')
+rag_app_pkg.__path__ = []
+sys.modules['rag_app'] = rag_app_pkg
+
+# Helper to load module
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "rag_app")
+
+# config reads TRACE_ENABLED while loading; later test modules keep their own setting
+with mock.patch.dict(os.environ, {"TRACE_ENABLED": "1"}):
+    config = load_module("rag_app.config", os.path.join(src_path, "config.py"))
+    utils = load_module("rag_app.utils", os.path.join(src_path, "utils.py"))
+    metrics = load_module("rag_app.metrics", os.path.join(src_path, "metrics.py"))
+    tracing = load_module("rag_app.tracing", os.path.join(src_path, "tracing.py"))
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = tracing._sink
+        self.path = os.path.join(tempfile.mkdtemp(), "logs", "traces.jsonl")
+        tracing._sink = tracing.RotatingJsonlSink(self.path)
+
+    def tearDown(self):
+        tracing._sink = self.saved
+
+    def test_trace_id_propagates_to_threads_and_is_read_back(self):
+        def fetch():
+            with tracing.span("fetch_html", url="https://example.com"):
+                return tracing.current_trace_id()
+
+        async def pipeline():
+            with tracing.span("process_question", new_trace=True, question="富士山") as root:
+                embedded = await asyncio.to_thread(tracing.run_stage, "embed", tracing.current_trace_id)
+                with ThreadPoolExecutor(max_workers=1) as pool:
+                    fetched = pool.submit(tracing.bind_context(fetch)).result()
+                sp = tracing.start_span("lmstudio_chat_stream")
+                tracing.finish_span(sp, RuntimeError("reset"))
+                return root, embedded, fetched
+
+        root, embedded, fetched = asyncio.run(pipeline())
+        with tracing.span("other_request", new_trace=True):
+            pass
+        self.assertEqual((embedded, fetched), (root.trace_id, root.trace_id))
+
+        spans = tracing.read_trace(root.trace_id)
+        by_name = {s["name"]: s for s in spans}
+        self.assertEqual(sorted(by_name), ["embed", "fetch_html", "lmstudio_chat_stream", "process_question"])
+        self.assertEqual(spans[0]["name"], "process_question")
+        self.assertIsNone(by_name["process_question"]["parent_id"])
+        for name in ("embed", "fetch_html", "lmstudio_chat_stream"):
+            self.assertEqual(by_name[name]["parent_id"], root.span_id)
+        self.assertEqual(by_name["process_question"]["attributes"]["question"], "富士山")
+        self.assertEqual(by_name["lmstudio_chat_stream"]["status"], "error")
+        self.assertNotEqual(tracing.last_trace_id(), root.trace_id)
+
+    def test_error_marks_span_and_propagates(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("failing", new_trace=True) as s:
+                raise ValueError("bad")
+        [rec] = tracing.read_trace(s.trace_id)
+        self.assertEqual(rec["status"], "error")
+        self.assertEqual(rec["attributes"]["error"], "ValueError: bad")
+
+    def test_rotation_keeps_backups_and_reads_across_files(self):
+        tracing._sink = sink = tracing.RotatingJsonlSink(self.path, max_bytes=600, backups=2)
+        with tracing.span("root", new_trace=True) as root:
+            for i in range(4):
+                with tracing.span("child", i=i):
+                    pass
+        trace_ids = [root.trace_id]
+        for _ in range(2):
+            with tracing.span("root", new_trace=True) as later:
+                pass
+            trace_ids.append(later.trace_id)
+
+        self.assertEqual(sink.files(), [self.path, self.path + ".1", self.path + ".2"])
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        for path in sink.files():
+            self.assertLessEqual(os.path.getsize(path), 600)
+        # the newest trace is whole; the oldest lost the spans that rotated out
+        self.assertEqual(len(tracing.read_trace(trace_ids[-1])), 1)
+        self.assertLess(len(tracing.read_trace(trace_ids[0])), 5)
+        self.assertEqual(tracing.last_trace_id(), trace_ids[-1])
+
+if __name__ == '__main__':
+    unittest.main()
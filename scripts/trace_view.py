@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Render one request trace from the span JSONL sink as a waterfall.
+
+    python scripts/trace_view.py <trace_id>     # trace id from the NDJSON "trace" event
+    python scripts/trace_view.py --last         # most recent request
+    python scripts/trace_view.py --list 20      # recent requests with total time
+"""
+
+import os
+import sys
+import json
+import argparse
+import importlib.util
+from typing import Dict, List
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# Load config/metrics/tracing only; importing the package would pull in ChromaDB and the embedding model
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(PROJECT_ROOT, "src", "rag_app")
+rag_app_pkg = type(sys)("rag_app")
+rag_app_pkg.__path__ = []
+sys.modules["rag_app"] = rag_app_pkg
+for mod in ("config", "utils", "metrics", "tracing"):
+    load_module(f"rag_app.{mod}", os.path.join(src_path, f"{mod}.py"))
+tracing = sys.modules["rag_app.tracing"]
+
+BAR_WIDTH = 48
+SHOWN_ATTRS = ("intent", "cache", "url", "status", "bytes", "html_bytes", "chars", "queries", "hits", "results",
+               "prompt_tokens", "completion_tokens", "ttft_ms", "attempts", "degraded", "error")
+
+def _depths(spans: List[Dict]) -> Dict[str, int]:
+    by_id = {s["span_id"]: s for s in spans}
+    depths = {}
+    def depth(s):
+        if s["span_id"] in depths:
+            return depths[s["span_id"]]
+        parent = by_id.get(s.get("parent_id"))
+        d = 0 if parent is None else depth(parent) + 1
+        depths[s["span_id"]] = d
+        return d
+    for s in spans:
+        depth(s)
+    return depths
+
+def _order(spans: List[Dict]) -> List[Dict]:
+    """Depth-first, children sorted by start time."""
+    children: Dict[str, List[Dict]] = {}
+    ids = {s["span_id"] for s in spans}
+    roots = []
+    for s in spans:
+        if s.get("parent_id") in ids:
+            children.setdefault(s["parent_id"], []).append(s)
+        else:
+            roots.append(s)
+    out = []
+    def walk(s):
+        out.append(s)
+        for c in sorted(children.get(s["span_id"], []), key=lambda x: x["start"]):
+            walk(c)
+    for r in sorted(roots, key=lambda x: x["start"]):
+        walk(r)
+    return out
+
+def render(spans: List[Dict]) -> str:
+    if not spans:
+        return "(no spans)"
+    t0 = min(s["start"] for s in spans)
+    t1 = max(s["end"] or s["start"] for s in spans)
+    total = max(t1 - t0, 1e-6)
+    depths = _depths(spans)
+
+    lines = [f"trace {spans[0]['trace_id']}  total {total * 1000:.0f} ms  spans {len(spans)}", ""]
+    for s in _order(spans):
+        start = int((s["start"] - t0) / total * BAR_WIDTH)
+        width = max(int(((s["end"] or s["start"]) - s["start"]) / total * BAR_WIDTH), 1)
+        bar = " " * start + ("█" if s.get("status") == "ok" else "▓") * width
+        name = ("  " * depths[s["span_id"]] + s["name"])[:34]
+        attrs = s.get("attributes") or {}
+        shown = " ".join(f"{k}={attrs[k]}" for k in SHOWN_ATTRS if attrs.get(k) not in (None, ""))
+        lines.append(f"{name:<34} {s['duration_ms']:>9.1f}ms |{bar:<{BAR_WIDTH}}| {shown[:100]}")
+    return "\n".join(lines)
+
+def list_recent(n: int) -> str:
+    roots = []
+    for path in tracing.get_sink().files():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if rec.get("parent_id") is None:
+                    roots.append(rec)
+    roots.sort(key=lambda r: r["start"], reverse=True)
+    lines = []
+    for r in roots[:n]:
+        attrs = r.get("attributes") or {}
+        lines.append(f"{r['trace_id']}  {r['duration_ms']:>9.1f}ms  {attrs.get('intent', '-'):<14} {str(attrs.get('question', ''))[:40]}")
+    return "\n".join(lines) or "(no traces)"
+
+def main():
+    parser = argparse.ArgumentParser(description="Waterfall view of a RAG request trace")
+    parser.add_argument("trace_id", nargs="?", help="trace id (from the NDJSON 'trace' event)")
+    parser.add_argument("--last", action="store_true", help="show the most recent request")
+    parser.add_argument("--list", type=int, metavar="N", help="list the N most recent requests")
+    args = parser.parse_args()
+
+    if args.list:
+        print(list_recent(args.list))
+        return
+    trace_id = args.trace_id or (tracing.last_trace_id() if args.last else None)
+    if not trace_id:
+        parser.error("give a trace id, --last or --list N")
+    print(render(tracing.read_trace(trace_id)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Train the local intent classifier from the seed set and evaluation_log.jsonl,
+save it to INTENT_CLASSIFIER_PATH and report leave-one-out accuracy.
+
+    python scripts/train_intent_classifier.py [--log evaluation_log.jsonl]
+"""
+
+import os
+import sys
+import argparse
+from collections import Counter
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from rag_app.config import INTENT_CLASSIFIER_PATH, INTENT_CLASSIFIER_MIN_CONFIDENCE
+from rag_app.db import encode_queries
+from rag_app.feedback import FEEDBACK_FILE
+from rag_app.intent_classifier import (
+    CentroidIntentClassifier, load_training_examples, train_intent_classifier
+)
+from rag_app.vectors import as_unit_matrix
+
+def leave_one_out(examples, embs):
+    """Accuracy and low-confidence share when each example is held out of its own centroid."""
+    labels = [l for _, l in examples]
+    correct = low = 0
+    for i in range(len(examples)):
+        rest = [j for j in range(len(examples)) if j != i]
+        clf = CentroidIntentClassifier.fit([examples[j] for j in rest], lambda _: embs[rest])
+        label, confidence = clf.predict(embs[i])
+        if confidence < INTENT_CLASSIFIER_MIN_CONFIDENCE:
+            low += 1
+        elif label == labels[i]:
+            correct += 1
+    confident = len(examples) - low
+    return correct / max(confident, 1), low / len(examples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the nearest-centroid intent classifier")
+    parser.add_argument("--log", default=FEEDBACK_FILE, help="evaluation log with labelled questions")
+    args = parser.parse_args()
+
+    examples = load_training_examples(args.log)
+    print(f"{len(examples)} examples: {dict(Counter(l for _, l in examples))}")
+
+    embs = as_unit_matrix(encode_queries([q for q, _ in examples]))
+    accuracy, llm_share = leave_one_out(examples, embs)
+    print(f"leave-one-out: {accuracy:.1%} accurate when confident, {llm_share:.1%} would go to the LLM "
+          f"(threshold {INTENT_CLASSIFIER_MIN_CONFIDENCE})")
+
+    train_intent_classifier(lambda _: embs, args.log, INTENT_CLASSIFIER_PATH)
+    print(f"saved to {INTENT_CLASSIFIER_PATH}")
+
+if __name__ == "__main__":
+    main()
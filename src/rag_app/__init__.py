@@ -1,4 +1,7 @@
-from .core import process_question, analyze_document_content, explain_term
+from .core import (
+    process_question, process_question_async, process_questions, process_questions_async,
+    analyze_document_content, explain_term
+)
 from .db import (
     add_document_to_kb, 
     clear_knowledge_base, 
@@ -0,0 +1,173 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Collection, Dict, Iterator, List, Optional
+
+import requests
+
+from .config import (
+    LMSTUDIO_URLS, LLM_BACKEND_MAX_FAILURES, LLM_BACKEND_EJECT_SECONDS,
+    LLM_HEALTH_CHECK_INTERVAL, LLM_HEALTH_CHECK_TIMEOUT
+)
+from .utils import log
+from .metrics import LLM_BACKEND_UP, LLM_BACKEND_OUTSTANDING, LLM_BACKEND_TOKENS_PER_SECOND, LLM_BACKEND_EJECTIONS
+from .http_client import PooledHTTPClient, llm_http
+
+_TPS_SMOOTHING = 0.3  # weight of the newest tokens/sec sample
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Errors that say the server is unwell (not that the request was bad)."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return False
+
+class Backend:
+    """One OpenAI-compatible chat/completions endpoint and what we have observed of it."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.health_url = url.rsplit("/chat/completions", 1)[0] + "/models"
+        self.outstanding = 0
+        self.tokens_per_second: Optional[float] = None
+        self.failures = 0              # consecutive
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def __repr__(self) -> str:
+        return f"Backend({self.url!r})"
+
+class BackendPool:
+    """
+    The LLM servers lmstudio_chat spreads its calls over.
+
+    pick() chooses the available backend with the lowest
+    (outstanding + 1) / tokens_per_second, i.e. the one expected to finish
+    a new request first; a backend without throughput samples yet counts
+    as average. Throughput is an EWMA of completion tokens / call duration.
+
+    A backend that fails max_failures calls in a row is ejected for
+    eject_seconds. With more than one backend, a daemon thread GETs each
+    /models endpoint every health_interval seconds: a failing check ejects,
+    a passing one re-admits early. When every backend is ejected, the one
+    coming back soonest is used anyway rather than failing the call.
+    """
+
+    def __init__(self, urls: List[str] = LMSTUDIO_URLS, max_failures: int = LLM_BACKEND_MAX_FAILURES,
+                 eject_seconds: float = LLM_BACKEND_EJECT_SECONDS,
+                 health_interval: float = LLM_HEALTH_CHECK_INTERVAL,
+                 http: PooledHTTPClient = llm_http):
+        if not urls:
+            raise ValueError("[BackendPool] at least one backend URL is required")
+        self.backends = [Backend(u) for u in dict.fromkeys(urls)]
+        self.max_failures = max(max_failures, 1)
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.http = http
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        for b in self.backends:
+            LLM_BACKEND_UP.set_function(lambda b=b: float(b.available(time.time())), backend=b.url)
+            LLM_BACKEND_OUTSTANDING.set_function(lambda b=b: b.outstanding, backend=b.url)
+            LLM_BACKEND_TOKENS_PER_SECOND.set_function(lambda b=b: b.tokens_per_second or 0.0, backend=b.url)
+
+    # --- Selection ---
+    def _cost(self, backend: Backend, default_tps: float) -> float:
+        return (backend.outstanding + 1) / (backend.tokens_per_second or default_tps)
+
+    def pick(self, exclude: Collection[Backend] = ()) -> Backend:
+        """The backend for the next call, preferring ones not in exclude (already tried)."""
+        self._ensure_health_checks()
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if b.available(now) and b not in exclude]
+            if not candidates:
+                candidates = [b for b in self.backends if b not in exclude] or self.backends
+                return min(candidates, key=lambda b: b.ejected_until)
+            known = [b.tokens_per_second for b in self.backends if b.tokens_per_second]
+            default_tps = sum(known) / len(known) if known else 1.0
+            return min(candidates, key=lambda b: self._cost(b, default_tps))
+
+    @contextmanager
+    def use(self, exclude: Collection[Backend] = ()) -> Iterator[Backend]:
+        """pick() and count the call as outstanding on that backend for the block."""
+        backend = self.pick(exclude)
+        with self._lock:
+            backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+
+    # --- Outcomes ---
+    def record_success(self, backend: Backend, tokens: Optional[int], seconds: float) -> None:
+        with self._lock:
+            backend.failures = 0
+            if tokens and seconds > 0:
+                sample = tokens / seconds
+                prev = backend.tokens_per_second
+                backend.tokens_per_second = sample if prev is None else prev + _TPS_SMOOTHING * (sample - prev)
+
+    def record_failure(self, backend: Backend, error: BaseException) -> None:
+        if not is_backend_failure(error):
+            return
+        with self._lock:
+            backend.failures += 1
+            if backend.failures < self.max_failures:
+                return
+            self._eject(backend, f"{backend.failures} failures in a row, last: {error}")
+
+    def _eject(self, backend: Backend, reason: str) -> None:
+        # Called with the lock held
+        newly = backend.available(time.time())
+        backend.ejected_until = time.time() + self.eject_seconds
+        if newly:
+            LLM_BACKEND_EJECTIONS.inc(backend=backend.url)
+            log(f"[Backends] ejected {backend.url} for {self.eject_seconds}s ({reason})")
+
+    # --- Health checks ---
+    def check_health(self) -> Dict[str, bool]:
+        """GET every backend's /models once; eject the failing, re-admit the passing."""
+        results = {}
+        for backend in self.backends:
+            try:
+                self.http.get(backend.health_url, LLM_HEALTH_CHECK_TIMEOUT).raise_for_status()
+                ok = True
+            except Exception as e:
+                ok = False
+                error = e
+            with self._lock:
+                if ok:
+                    if not backend.available(time.time()):
+                        log(f"[Backends] {backend.url} passed its health check, re-admitted")
+                    backend.failures = 0
+                    backend.ejected_until = 0.0
+                else:
+                    self._eject(backend, f"health check failed: {error}")
+            results[backend.url] = ok
+        return results
+
+    def _ensure_health_checks(self) -> None:
+        if len(self.backends) < 2 or self.health_interval <= 0 or self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                log(f"[Backends] health check error: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+llm_backends = BackendPool()
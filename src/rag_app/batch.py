@@ -0,0 +1,75 @@
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+
+import numpy as np
+
+from .config import BATCH_LLM_CONCURRENCY, BATCH_DDGS_CONCURRENCY
+from .utils import normalize_question
+from .metrics import BATCH_SHARED_WORK
+
+class BatchMemo:
+    """
+    Work shared by the questions of one process_questions() batch.
+
+    Question embeddings are computed up front in one encode call. DDGS
+    queries and page fetches are memoized per batch: the first question to
+    need one does the work, and the others wait for that result instead of
+    repeating it. LLM and DDGS calls go through semaphores, so a
+    batch of hundreds of questions cannot flood the model server or the
+    search engine.
+    """
+
+    def __init__(self, llm_concurrency: int = BATCH_LLM_CONCURRENCY, ddgs_concurrency: int = BATCH_DDGS_CONCURRENCY):
+        self._lock = threading.Lock()
+        self._memo: Dict[Hashable, Future] = {}
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._llm = threading.BoundedSemaphore(llm_concurrency)
+        self._ddgs = threading.BoundedSemaphore(ddgs_concurrency)
+
+    # -- embeddings --------------------------------------------------------
+    def set_embeddings(self, questions: List[str], embeddings: np.ndarray) -> None:
+        for q, emb in zip(questions, embeddings):
+            self._embeddings[normalize_question(q)] = emb
+
+    def embedding(self, question: str) -> Optional[np.ndarray]:
+        return self._embeddings.get(normalize_question(question))
+
+    # -- memoized work -----------------------------------------------------
+    def once(self, key: Hashable, fn: Callable, *args: Any) -> Any:
+        """fn(*args) computed once per key for the whole batch; concurrent callers wait for the first."""
+        with self._lock:
+            future = self._memo.get(key)
+            owner = future is None
+            if owner:
+                future = self._memo[key] = Future()
+        if not owner:
+            BATCH_SHARED_WORK.inc(kind=key[0] if isinstance(key, tuple) else "other")
+            return future.result()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future.result()
+
+    def search(self, search_fn: Callable[[List[str], int], List[Dict]], queries: List[str], per_query: int) -> List[Dict]:
+        """search_fn over queries, each distinct query searched once per batch; hits merged by URL."""
+        def _one(q: str) -> List[Dict]:
+            with self._ddgs:
+                return search_fn([q], per_query)
+
+        merged: Dict[str, Dict] = {}
+        for q in queries:
+            for h in self.once(("ddgs", normalize_question(q), per_query), _one, q):
+                key = h.get("href") or (h.get("title", "") + h.get("body", ""))
+                merged.setdefault(key, h)
+        return list(merged.values())
+
+    def page_text(self, extract_fn: Callable[..., str], url: str, timeout: float) -> str:
+        return self.once(("fetch", url), lambda: extract_fn(url, timeout=timeout))
+
+    @contextmanager
+    def llm_slot(self) -> Iterator[None]:
+        with self._llm:
+            yield
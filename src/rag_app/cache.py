@@ -0,0 +1,307 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+from .config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL_DEFAULT, RESPONSE_CACHE_TTL_BY_INTENT,
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_THRESHOLD_DEFAULT, SEMANTIC_CACHE_THRESHOLD_BY_INTENT
+)
+from .utils import log, normalize_question, history_fingerprint
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+def ttl_for_intent(intent: Optional[str]) -> int:
+    return RESPONSE_CACHE_TTL_BY_INTENT.get(intent or "", RESPONSE_CACHE_TTL_DEFAULT)
+
+class ResponseCache:
+    """
+    Persistent answer cache on the response_cache table of cache.db.
+
+    Keys combine the normalized question, the difficulty, a fingerprint of the
+    conversation history and the knowledge-base generation, so a follow-up is
+    only answered from its own conversation and any KB change makes earlier
+    answers unreachable. Entries expire according to the TTL of the intent
+    they were answered under.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH):
+        self.path = path
+        self._init_db()
+        self.purge_expired()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+                                key TEXT PRIMARY KEY,
+                                response TEXT,
+                                sources TEXT,
+                                timestamp DATETIME,
+                                intent TEXT,
+                                params TEXT
+                            )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON response_cache(timestamp)")
+            conn.execute('''CREATE TABLE IF NOT EXISTS kb_state (
+                                name TEXT PRIMARY KEY,
+                                value INTEGER
+                            )''')
+            conn.execute("INSERT OR IGNORE INTO kb_state (name, value) VALUES ('generation', 0)")
+
+    # --- KB generation ---
+    def generation(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM kb_state WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def bump_generation(self) -> int:
+        """Record a KB change. Cached answers from older generations are dropped."""
+        with self._connect() as conn:
+            conn.execute("UPDATE kb_state SET value = value + 1 WHERE name = 'generation'")
+            conn.execute("DELETE FROM response_cache")
+            row = conn.execute("SELECT value FROM kb_state WHERE name = 'generation'").fetchone()
+        log(f"[Cache] KB generation -> {row[0]}")
+        return row[0]
+
+    # --- Answers ---
+    @staticmethod
+    def make_key(question: str, difficulty: str, generation: int, history_fp: str = "") -> str:
+        raw = json.dumps([normalize_question(question), difficulty, generation, history_fp], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, question: str, difficulty: str = "normal", history: Optional[List[Dict]] = None,
+            generation: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """generation defaults to the current one; pass the one read when the request started."""
+        if generation is None:
+            generation = self.generation()
+        key = self.make_key(question, difficulty, generation, history_fingerprint(history))
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, sources, timestamp, intent FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        response, sources, ts, intent = row
+        if time.time() - float(ts) > ttl_for_intent(intent):
+            with self._connect() as conn:
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+
+        return {
+            "answer": response,
+            "sources": json.loads(sources) if sources else [],
+            "intent": intent,
+        }
+
+    def put(self, question: str, difficulty: str, intent: str, answer: str, sources: List[Dict],
+            history: Optional[List[Dict]] = None, generation: Optional[int] = None):
+        """
+        Store under `generation`: the one the answer was built on. An answer
+        finished after a KB change thus stays unreachable, like older ones.
+        """
+        if ttl_for_intent(intent) <= 0:
+            return
+        if generation is None:
+            generation = self.generation()
+        history_fp = history_fingerprint(history)
+        params = {"question": normalize_question(question), "difficulty": difficulty,
+                  "generation": generation, "history": history_fp}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, sources, timestamp, intent, params) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.make_key(question, difficulty, generation, history_fp),
+                    answer,
+                    json.dumps(sources, ensure_ascii=False),
+                    time.time(),
+                    intent,
+                    json.dumps(params, ensure_ascii=False),
+                ),
+            )
+
+    def purge_expired(self) -> int:
+        """Delete entries older than the longest TTL. Returns the number of rows removed."""
+        longest = max([RESPONSE_CACHE_TTL_DEFAULT] + list(RESPONSE_CACHE_TTL_BY_INTENT.values()))
+        with self._connect() as conn:
+            cur = conn.execute("DELETE FROM response_cache WHERE timestamp < ?", (time.time() - longest,))
+        return cur.rowcount
+
+class SemanticCache:
+    """
+    In-memory near-duplicate question cache.
+
+    Previously answered questions are kept as L2-normalized query embeddings in
+    one contiguous float32 matrix; a lookup is a single matrix-vector product.
+    A hit needs the same difficulty, conversation history and KB generation, an
+    unexpired entry, and a cosine similarity at or above the threshold of the
+    entry's intent. When full,
+    the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None  # (max_entries, dim), allocated on first add
+        self._entries: List[Dict[str, Any]] = []
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+
+    def lookup(self, q_emb: np.ndarray, difficulty: str, generation: int,
+               history: Optional[List[Dict]] = None) -> Optional[Dict[str, Any]]:
+        vec = _normalize(q_emb)
+        history_fp = history_fingerprint(history)
+        now = time.time()
+        with self._lock:
+            n = len(self._entries)
+            if n == 0 or self._matrix is None or self._matrix.shape[1] != vec.shape[0]:
+                self.misses += 1
+                return None
+
+            sims = self._matrix[:n] @ vec
+            floor = min(SEMANTIC_CACHE_THRESHOLD_DEFAULT, *SEMANTIC_CACHE_THRESHOLD_BY_INTENT.values())
+            for idx in np.argsort(-sims):
+                if sims[idx] < floor:
+                    break  # sorted; nothing below can pass any threshold
+                entry = self._entries[idx]
+                if sims[idx] < SEMANTIC_CACHE_THRESHOLD_BY_INTENT.get(entry["intent"], SEMANTIC_CACHE_THRESHOLD_DEFAULT):
+                    continue
+                if entry["difficulty"] != difficulty or entry["generation"] != generation:
+                    continue
+                if entry["history"] != history_fp:
+                    continue
+                if now - entry["timestamp"] > ttl_for_intent(entry["intent"]):
+                    continue
+                self._last_used[idx] = now
+                self.hits += 1
+                return dict(entry, similarity=float(sims[idx]))
+
+            self.misses += 1
+            return None
+
+    def add(self, q_emb: np.ndarray, question: str, difficulty: str, generation: int,
+            intent: str, answer: str, sources: List[Dict], history: Optional[List[Dict]] = None):
+        if ttl_for_intent(intent) <= 0:
+            return
+        vec = _normalize(q_emb)
+        now = time.time()
+        entry = {
+            "question": question,
+            "difficulty": difficulty,
+            "generation": generation,
+            "history": history_fingerprint(history),
+            "intent": intent,
+            "answer": answer,
+            "sources": sources,
+            "timestamp": now,
+        }
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vec.shape[0]:
+                self._matrix = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+                self._entries = []
+
+            if len(self._entries) < self.max_entries:
+                idx = len(self._entries)
+                self._entries.append(entry)
+            else:
+                idx = int(np.argmin(self._last_used[:len(self._entries)]))
+                self._entries[idx] = entry
+                self.evictions += 1
+            self._matrix[idx] = vec
+            self._last_used[idx] = now
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+def _normalize(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    return v / (np.linalg.norm(v) + 1e-8)
+
+response_cache = ResponseCache()
+semantic_cache = SemanticCache()
+
+def bump_kb_generation():
+    """Called by the KB write paths in db.py."""
+    try:
+        response_cache.bump_generation()
+    except Exception as e:
+        log(f"[Cache] bump_kb_generation error: {e}")
+    semantic_cache.clear()
+
+def kb_generation() -> Optional[int]:
+    """
+    The KB generation, read once when a request starts and passed to the cache
+    reads and writes of that request. None when it cannot be read.
+    """
+    try:
+        return response_cache.generation()
+    except Exception as e:
+        log(f"[Cache] generation read error: {e}")
+        return None
+
+def get_cached_response(question: str, difficulty: str = "normal", history: Optional[List[Dict]] = None,
+                        generation: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    try:
+        hit = response_cache.get(question, difficulty, history, generation)
+    except Exception as e:
+        log(f"[Cache] read error: {e}")
+        hit = None
+    (CACHE_HITS if hit is not None else CACHE_MISSES).inc(cache="response")
+    return hit
+
+def store_cached_response(question: str, difficulty: str, intent: str, answer: str, sources: List[Dict],
+                          history: Optional[List[Dict]] = None, generation: Optional[int] = None):
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    try:
+        response_cache.put(question, difficulty, intent, answer, sources, history, generation)
+    except Exception as e:
+        log(f"[Cache] write error: {e}")
+
+def get_semantic_response(q_emb, difficulty: str = "normal", history: Optional[List[Dict]] = None,
+                          generation: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """In-memory only: generation is the kb_generation() read at request start (None skips the lookup)."""
+    if not SEMANTIC_CACHE_ENABLED or generation is None:
+        return None
+    try:
+        hit = semantic_cache.lookup(q_emb, difficulty, generation, history)
+    except Exception as e:
+        log(f"[Cache] semantic read error: {e}")
+        hit = None
+    (CACHE_HITS if hit is not None else CACHE_MISSES).inc(cache="semantic")
+    return hit
+
+def store_semantic_response(q_emb, question: str, difficulty: str, intent: str, answer: str, sources: List[Dict],
+                            history: Optional[List[Dict]] = None, generation: Optional[int] = None):
+    if not SEMANTIC_CACHE_ENABLED or generation is None:
+        return
+    try:
+        semantic_cache.add(q_emb, question, difficulty, generation, intent, answer, sources, history)
+    except Exception as e:
+        log(f"[Cache] semantic write error: {e}")
@@ -8,6 +8,9 @@ class AnswerMode(Enum):
     CONTEXT_QA = "context_qa"
 
 LMSTUDIO_URL = os.environ.get("LMSTUDIO_URL", "http://10.23.130.252:1234/v1/chat/completions")
+# Several OpenAI-compatible servers (comma-separated chat/completions URLs) share the load;
+# defaults to LMSTUDIO_URL alone
+LMSTUDIO_URLS = [u.strip() for u in os.environ.get("LMSTUDIO_URLS", LMSTUDIO_URL).split(",") if u.strip()]
 QWEN_MODEL = os.environ.get("QWEN_MODEL", "qwen2.5-7b-instruct")
 EMBED_MODEL_NAME = "intfloat/multilingual-e5-small"
 
@@ -29,6 +32,94 @@ REQUESTS_TIMEOUT = 8
 LM_TIMEOUT = int(os.environ.get("LM_TIMEOUT", "60"))
 LM_SHORT_TIMEOUT = int(os.environ.get("LM_SHORT_TIMEOUT", "12"))
 LM_RETRIES = int(os.environ.get("LM_RETRIES", "1"))
+# Pooled keep-alive connections to the LLM server; LM_TIMEOUT / LM_SHORT_TIMEOUT are read timeouts
+LM_CONNECT_TIMEOUT = float(os.environ.get("LM_CONNECT_TIMEOUT", "3"))
+LM_HTTP_POOL_SIZE = int(os.environ.get("LM_HTTP_POOL_SIZE", "16"))  # idle connections kept per host
+# LLM gateway: calls in flight across the process (match the servers' parallel slots), by
+# priority class interactive (answers) > planning (intent, queries) > enrichment (uploads,
+# summaries, prefetched explanations). Enrichment is capped so it never fills every slot.
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", str(4 * len(LMSTUDIO_URLS))))
+LLM_ENRICHMENT_MAX_IN_FLIGHT = int(os.environ.get("LLM_ENRICHMENT_MAX_IN_FLIGHT", "1"))
+# Backend routing: least outstanding requests weighted by observed tokens/sec. A backend
+# failing LLM_BACKEND_MAX_FAILURES calls in a row (connection error, timeout, 5xx) or a
+# health check is ejected for LLM_BACKEND_EJECT_SECONDS; a passing health check re-admits it.
+LLM_BACKEND_MAX_FAILURES = int(os.environ.get("LLM_BACKEND_MAX_FAILURES", "2"))
+LLM_BACKEND_EJECT_SECONDS = float(os.environ.get("LLM_BACKEND_EJECT_SECONDS", "30"))
+LLM_HEALTH_CHECK_INTERVAL = float(os.environ.get("LLM_HEALTH_CHECK_INTERVAL", "10"))  # 0 disables
+LLM_HEALTH_CHECK_TIMEOUT = 2.0
+
+# Local intent classifier (nearest centroid over e5 query embeddings); the LLM is
+# only asked when the classifier's softmax confidence is below the threshold.
+INTENT_CLASSIFIER_ENABLED = os.environ.get("INTENT_CLASSIFIER_ENABLED", "1") == "1"
+INTENT_CLASSIFIER_PATH = os.environ.get("INTENT_CLASSIFIER_PATH", os.path.join(PROJECT_ROOT, "intent_centroids.npz"))
+INTENT_CLASSIFIER_MIN_CONFIDENCE = 0.6
+INTENT_CLASSIFIER_TEMPERATURE = 0.02  # e5 cosine scores sit in a narrow band; sharpen before softmax
+# The classifier only sees the question: with a conversation history, short or
+# anaphoric questions ("その続きは？") go to the LLM, which sees the history too.
+INTENT_FOLLOW_UP_MAX_CHARS = 12
+
+# When the LLM has to decide the intent, ask for the search queries in the same
+# call ("plan"); the separate intent + query-generation calls remain the fallback.
+PLAN_CALL_ENABLED = os.environ.get("PLAN_CALL_ENABLED", "1") == "1"
+
+# Conversation history: the newest rows verbatim, older turns folded into a rolling
+# summary cached in chat_history.db. Each stage sees a token-bounded view.
+HISTORY_RECENT_ROWS = 6
+HISTORY_SUMMARY_ENABLED = os.environ.get("HISTORY_SUMMARY_ENABLED", "1") == "1"
+HISTORY_SUMMARY_MAX_TOKENS = 300
+HISTORY_TOKENS_CLASSIFY = 200  # intent / plan / query generation
+HISTORY_TOKENS_ANSWER = 800    # final answer
+
+# Request Deadline
+# Overall budget for one question (0 disables). QueryRequest.deadline_ms overrides it per request.
+REQUEST_DEADLINE_MS = int(os.environ.get("REQUEST_DEADLINE_MS", "60000"))
+DEADLINE_ANSWER_RESERVE = 20.0  # seconds retrieval must leave for answer generation
+DEADLINE_MIN_LLM_STEP = 3.0     # below this, intent/query generation fall back to heuristics
+DEADLINE_MIN_WEB_SEARCH = 4.0   # below this, DDGS + fetch are skipped
+DEADLINE_MIN_REFINE = 8.0       # below this, the refine search round is skipped
+DEADLINE_FULL_QUERIES = 15.0    # below this, only one search query is generated
+
+# Response Cache (cache.db)
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(PROJECT_ROOT, "cache.db"))
+RESPONSE_CACHE_TTL_DEFAULT = 24 * 3600  # seconds
+RESPONSE_CACHE_TTL_BY_INTENT = {
+    "weather": 10 * 60,           # Forecasts change quickly
+    "news": 15 * 60,
+    "local_search": 24 * 3600,
+    "spec": 3 * 24 * 3600,
+    "informational": 7 * 24 * 3600,
+    "document_qa": 7 * 24 * 3600, # Invalidated by KB generation anyway
+    "other": 0,                   # Chitchat is never cached
+}
+
+# Single-flight: identical concurrent questions (normalized question, difficulty,
+# history) share one pipeline run and its streamed events
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Batch question API (process_questions / /api/ask_batch)
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))   # Questions in flight
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "2"))   # LLM calls in flight
+BATCH_DDGS_CONCURRENCY = 1  # DDGS rate-limits aggressively; one search at a time per batch
+
+# Semantic (near-duplicate) question cache over e5 query embeddings
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+SEMANTIC_CACHE_THRESHOLD_DEFAULT = 0.95  # cosine similarity; e5 scores sit in a narrow high band
+SEMANTIC_CACHE_THRESHOLD_BY_INTENT = {
+    "informational": 0.94,
+    "spec": 0.96,          # "v1.5" vs "v2.0" must not collide
+    "news": 0.96,
+    "weather": 0.97,       # Place names differ by a single token
+    "local_search": 0.96,
+    "document_qa": 0.95,
+}
+
+# Request tracing (span JSONL sink, see scripts/trace_view.py)
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "1") == "1"
+TRACE_PATH = os.environ.get("TRACE_PATH", os.path.join(PROJECT_ROOT, "logs", "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.environ.get("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get("TRACE_BACKUPS", "3"))
 
 # Hybrid Scoring & Reranking
 HYBRID_ALPHA_DEFAULT = 0.4  # Weight for heuristic score (0.0 - 1.0)
@@ -41,11 +132,59 @@ HYBRID_ALPHA_BY_INTENT = {
     "document_qa": 0.2,   # Mostly vector relevance
 }
 
+# Web chunk embedding cache (keyed by model name + sha1 of chunk text)
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE_ENABLED", "1") == "1"
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", os.path.join(PROJECT_ROOT, "embed_cache.db"))
+EMBED_CACHE_MAX_ENTRIES = int(os.environ.get("EMBED_CACHE_MAX_ENTRIES", "200000"))
+EMBED_CACHE_DTYPE = os.environ.get("EMBED_CACHE_DTYPE", "float16")  # float16 halves disk use; cosine error ~1e-3
+
+# Memo for deterministic LLM sub-tasks (query expansion, search plans, term explanations),
+# keyed by task + prompt template version + model + inputs
+LLM_MEMO_ENABLED = os.environ.get("LLM_MEMO_ENABLED", "1") == "1"
+LLM_MEMO_PATH = os.environ.get("LLM_MEMO_PATH", os.path.join(PROJECT_ROOT, "llm_memo.db"))
+LLM_MEMO_MAX_ENTRIES = int(os.environ.get("LLM_MEMO_MAX_ENTRIES", "50000"))
+LLM_MEMO_MEMORY_ENTRIES = int(os.environ.get("LLM_MEMO_MEMORY_ENTRIES", "2000"))  # warm-loaded at startup
+
+# Background explanations of the [[terms]] in each answer (served by /api/explain from the memo)
+EXPLAIN_PREFETCH_ENABLED = os.environ.get("EXPLAIN_PREFETCH_ENABLED", "1") == "1"
+EXPLAIN_PREFETCH_MAX_TERMS = int(os.environ.get("EXPLAIN_PREFETCH_MAX_TERMS", "8"))        # per answer
+EXPLAIN_PREFETCH_IDLE_POLL = 0.2  # seconds between checks while foreground pipelines are running
+EXPLAIN_JOIN_TIMEOUT = float(os.environ.get("EXPLAIN_JOIN_TIMEOUT", "10"))  # /api/explain waits this long for a running prefetch
+
+# Multi-query Chroma search
+CHROMA_N_RESULTS = 5   # Per query variant
+CHROMA_USE_RRF = True  # Reciprocal-rank fusion across query variants
+CHROMA_RRF_K = 60
+
+# Adaptive retrieval: answer from the KB alone (no query generation, DDGS or page
+# fetches) when the raw-question Chroma hits pass every threshold for the intent.
+# Similarities are e5 cosine scores; None means the intent always goes to the web.
+KB_GATE_ENABLED = os.environ.get("KB_GATE_ENABLED", "1") == "1"
+KB_GATE_COVERAGE_TOP_N = 3  # Hits whose text is checked for the question's terms
+KB_GATE_DEFAULT = {"min_top_sim": 0.88, "min_gap": 0.02, "min_coverage": 0.75}
+KB_GATE_BY_INTENT = {
+    "informational": {"min_top_sim": 0.88, "min_gap": 0.02, "min_coverage": 0.75},
+    "spec": {"min_top_sim": 0.90, "min_gap": 0.02, "min_coverage": 0.9},  # Versions/numbers must match
+    "news": None,          # Freshness matters more than a KB match
+    "weather": None,
+    "local_search": None,
+}
+
 # Reranking Chunk Parameters
 RERANK_CHUNK_SIZE = 800
 RERANK_CHUNK_OVERLAP = 200
 RERANK_TOP_K = 20     # Number of candidates to keep for final context
 RERANK_MAX_WEB_SOURCES = 5 # Limit number of web sites to chunk for reranking
+RERANK_MIN_WEB_SCORE = 0.5 # Web pages at or below this heuristic score are never chunked
+
+# Process-wide fetch executor shared by all requests (see fetch_pool.py)
+FETCH_POOL_MAX_WORKERS = int(os.environ.get("FETCH_POOL_MAX_WORKERS", "16"))
+FETCH_POOL_PER_HOST = int(os.environ.get("FETCH_POOL_PER_HOST", "2"))
+
+# Streaming fetch stage: pages are scored and chunk-embedded as they arrive; the stage
+# stops once RERANK_MAX_WEB_SOURCES pages reach FETCH_EARLY_STOP_SCORE or the cap passes.
+FETCH_STAGE_MAX_SECONDS = float(os.environ.get("FETCH_STAGE_MAX_SECONDS", "6"))
+FETCH_EARLY_STOP_SCORE = 2.0  # Heuristic page scores run roughly 0.5 - 3.5
 
 PRIORITY_DOMAINS = [
     "tabelog.com",
@@ -157,3 +296,23 @@ INFORMATIONAL_KEYWORDS = [
     "歴史", "由来", "特徴", "仕組み", "原理",
 ]
 
+# Page-scoring cue words
+NEWS_FRESHNESS_KEYWORDS = ["今日", "本日", "昨日", "速報", "最新"]
+WEATHER_TIME_KEYWORDS = ["今日", "明日", "週間", "時間ごと", "3時間"]
+CITATION_KEYWORDS = ["参考", "出典", "引用", "文献", "source"]
+EXPLANATORY_KEYWORDS = ["例えば", "具体的", "つまり", "すなわち"]
+
+# Question tokens for the keyword intent heuristics, checked in this order
+INTENT_TOKENS = {
+    "document_qa": ["このドキュメント", "この文書", "アップロード", "ファイル", "資料", "pdf", "要約", "抽出", "セクション", "章", "ドキュメント内検索", "ドキュメント検索"],
+    "other": ["こんにちは", "こんばんは", "おはよう", "ありがとう", "初めまして", "ようこそ", "調子はどう", "誰ですか", "名前は"],
+    "weather": ["天気", "予報", "気温", "雨", "晴れ", "台風", "気象"],
+    "local_search": ["近く", "ランチ", "店", "レストラン", "営業時間", "おいしい", "予約"],
+    "news": ["ニュース", "発表", "速報", "昨日", "今日"],
+    "informational": ["なぜ", "どうやって", "いつ", "とは", "教えて", "標高", "定義", "意味"],
+    "spec": ["バージョン", "仕様", "対応", "api", "model", "release"],
+}
+
+# Question tokens that refer back to the conversation (see INTENT_FOLLOW_UP_MAX_CHARS)
+FOLLOW_UP_TOKENS = ["それ", "その", "あれ", "あの", "これ", "続き", "さっき", "先ほど", "前の", "上記", "もっと", "詳しく", "他には", "ほかには", "同じ"]
+
@@ -1,19 +1,26 @@
 import time
-import json
 import re
+import asyncio
+import threading
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Tuple, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Any, Optional, Callable, AsyncIterator
 
 from .config import (
     NUM_SEARCH_QUERIES, DDGS_MAX_PER_QUERY, CHARS_LIMIT, 
-    LM_SHORT_TIMEOUT, LM_TIMEOUT, AnswerMode,
+    LM_SHORT_TIMEOUT, LM_TIMEOUT,
     HYBRID_ALPHA_DEFAULT, HYBRID_ALPHA_BY_INTENT,
     RERANK_CHUNK_SIZE, RERANK_CHUNK_OVERLAP, RERANK_TOP_K,
-    RERANK_MAX_WEB_SOURCES
+    RERANK_MAX_WEB_SOURCES, RERANK_MIN_WEB_SCORE, CHROMA_N_RESULTS, REQUESTS_TIMEOUT,
+    FETCH_STAGE_MAX_SECONDS, FETCH_EARLY_STOP_SCORE, FETCH_POOL_MAX_WORKERS,
+    SINGLE_FLIGHT_ENABLED, BATCH_MAX_CONCURRENCY, INTENT_CLASSIFIER_ENABLED, INTENT_FOLLOW_UP_MAX_CHARS, PLAN_CALL_ENABLED,
+    HISTORY_TOKENS_CLASSIFY, HISTORY_TOKENS_ANSWER, REQUEST_DEADLINE_MS, DEADLINE_ANSWER_RESERVE, DEADLINE_MIN_LLM_STEP,
+    DEADLINE_MIN_WEB_SEARCH, DEADLINE_MIN_REFINE, DEADLINE_FULL_QUERIES
+)
+from .utils import log, safe_json_load, try_fast_path, normalize_question
+from .llm import (
+    lmstudio_chat, lmstudio_chat_stream, PRIORITY_INTERACTIVE, PRIORITY_ENRICHMENT
 )
-from .utils import log, safe_json_load, try_fast_path
-from .llm import lmstudio_chat, generate_system_prompt
 from .scraper import (
     extract_text, 
     score_text_for_restaurant, 
@@ -23,96 +30,198 @@ from .scraper import (
     score_text_for_informational
 )
 from .search import ddgs_search_many, refine_queries_from_hits
-from .db import search_chroma, get_embed_model
+from .db import (
+    get_embed_model, encode_queries, query_chroma_by_embeddings, merge_chroma_results, search_chroma_many
+)
+from .embed_cache import encode_passages
+from .llm_memo import memoized
+from .metrics import REQUEST_LATENCY, KB_GATE_DECISIONS, INTENT_DECISIONS, PLAN_CALLS, FETCH_STAGE_EXITS, FETCH_CANCELLED
+from .intent_classifier import classify_intent
+from .keywords import keyword_matcher, INTENT_CATEGORIES
+from .feedback import FEEDBACK_FILE
+from .kb_gate import kb_confidence, kb_gate_thresholds, kb_is_confident
+from .history import history_view
+from .deadline import Deadline
+from .tracing import span, stage, run_stage, bind_context, current_span, current_trace_id
+from .fetch_pool import fetch_pool
+from .singleflight import single_flight, flight_key
+from .batch import BatchMemo
+from .vectors import as_unit_matrix, as_unit_vector, top_k_indices, greedy_dedupe
+from .cache import (
+    kb_generation, get_cached_response, store_cached_response,
+    get_semantic_response, store_semantic_response
+)
+
+ANSWER_ERROR_MESSAGE = "回答生成中にエラーが発生しました。"
+EXPLAIN_ERROR_MESSAGE = "解説を取得できませんでした。"
+
+# Bump when the prompt of a memoized sub-task changes, so earlier results stop matching
+QUERY_GEN_PROMPT_VERSION = 1
+PLAN_PROMPT_VERSION = 1
+EXPLAIN_PROMPT_VERSION = 1
 
 # -----------------------
 # Intent detection
 # -----------------------
-def detect_search_intent(question: str, history: List[Dict] = []) -> str:
+def detect_search_intent(
+    question: str,
+    history: List[Dict] = [],
+    timeout: float = LM_SHORT_TIMEOUT,
+    use_llm: bool = True,
+    q_emb: Optional[np.ndarray] = None,
+) -> str:
+    return detect_search_intent_with_source(question, history, timeout, use_llm, q_emb)[0]
+
+def detect_search_intent_with_source(
+    question: str,
+    history: List[Dict] = [],
+    timeout: float = LM_SHORT_TIMEOUT,
+    use_llm: bool = True,
+    q_emb: Optional[np.ndarray] = None,
+) -> Tuple[str, str]:
+    """
+    (intent, source), where source is how it was decided: "heuristic" (document
+    tokens), "classifier" (local centroid classifier, confident), "llm", or
+    "fallback" (keyword heuristics after the LLM failed or was skipped).
+    """
+    return _local_intent(question, q_emb, history) or _llm_intent(question, history, timeout, use_llm)
+
+def _is_follow_up(question: str, history: List[Dict]) -> bool:
+    """A question that only makes sense with the conversation: history, and short or anaphoric."""
+    if not history:
+        return False
+    if len(normalize_question(question)) <= INTENT_FOLLOW_UP_MAX_CHARS:
+        return True
+    return bool(keyword_matcher.scan(question, ["follow_up"])["follow_up"])
+
+def _local_intent(
+    question: str, q_emb: Optional[np.ndarray] = None, history: List[Dict] = []
+) -> Optional[Tuple[str, str]]:
+    """Intent from document-token heuristics or a confident local classifier; None if neither decides."""
     # 1. Fast heuristics
-    qlow = question.lower()
-    doc_tokens = ["このドキュメント", "この文書", "アップロード", "ファイル", "資料", "pdf", "要約", "抽出", "セクション", "章", "ドキュメント内検索", "ドキュメント検索"]
-    for tok in doc_tokens:
-        if tok in qlow:
-            log(f"[Intent] Heuristic match: '{tok}' -> document_qa")
-            return "document_qa"
+    doc_hits = keyword_matcher.scan(question, ["intent:document_qa"])["intent:document_qa"]
+    if doc_hits:
+        log(f"[Intent] Heuristic match: {sorted(doc_hits)} -> document_qa")
+        INTENT_DECISIONS.inc(source="heuristic")
+        return "document_qa", "heuristic"
 
+    # 2. Local classifier over the e5 query embedding (about a millisecond); it cannot see the history
+    if INTENT_CLASSIFIER_ENABLED and _is_follow_up(question, history):
+        log("[Intent] follow-up question, leaving it to the LLM")
+    elif INTENT_CLASSIFIER_ENABLED:
+        try:
+            if q_emb is None:
+                q_emb = encode_queries([question])[0]
+            label = classify_intent(q_emb, encode_queries, FEEDBACK_FILE)
+            if label is not None:
+                INTENT_DECISIONS.inc(source="classifier")
+                return label, "classifier"
+        except Exception as e:
+            log("[Intent] classifier failed:", e)
+    return None
+
+_INTENT_DEFINITIONS = (
+    "Definitions:\n"
+    "- document_qa: Questions explicitly about the *uploaded file content* (e.g., 'summarize this doc', 'what does section 3 say?'). If the user asks about a general topic that MIGHT be in the doc but doesn't explicitly reference 'this document', classify as 'informational'.\n"
+    "- informational: General knowledge questions, definitions, technical terms, or facts (e.g., 'who is X?', 'release date of Y', 'what is RAG?').\n"
+    "- news/weather: Questions about current events or weather.\n"
+    "- local_search: Questions about shops, restaurants, places.\n"
+    "- other: Greetings, chitchat."
+)
+
+def _history_block(history: List[Dict], title: str) -> str:
+    if not history:
+        return ""
+    return f"{title}:\n" + "\n".join([f"- {h['role']}: {h['content']}" for h in history]) + "\n\n"
+
+def _llm_intent(question: str, history: List[Dict], timeout: float, use_llm: bool) -> Tuple[str, str]:
     system = (
         "Classify intent into one of: informational / local_search / news / weather / document_qa / other\n\n"
-        "Definitions:\n"
-        "- document_qa: Questions explicitly about the *uploaded file content* (e.g., 'summarize this doc', 'what does section 3 say?'). If the user asks about a general topic that MIGHT be in the doc but doesn't explicitly reference 'this document', classify as 'informational'.\n"
-        "- informational: General knowledge questions, definitions, technical terms, or facts (e.g., 'who is X?', 'release date of Y', 'what is RAG?').\n"
-        "- news/weather: Questions about current events or weather.\n"
-        "- local_search: Questions about shops, restaurants, places.\n"
-        "- other: Greetings, chitchat."
+        + _INTENT_DEFINITIONS
     )
-    
-    history_text = ""
-    if history:
-        history_text = "Conversation History:\n" + "\n".join([f"- {h['role']}: {h['content']}" for h in history]) + "\n\n"
+    history_text = _history_block(history, "Conversation History")
 
     user = f"{history_text}User Question: {question}\n\nReturn ONLY the label."
-    try:
-        resp = lmstudio_chat(
-            [{"role":"system","content":system},
-             {"role":"user","content":user}],
-            max_tokens=32,
-            temperature=0.0,
-            timeout=LM_SHORT_TIMEOUT
-        )
-        text = resp.strip().lower()
-        for t in ["informational","local_search","news","weather","document_qa","other"]:
-            if t in text:
-                return t
-    except Exception as e:
-        log("[Intent] LM failed:", e)
-
-    # fallback heuristics
-    local_tokens = ["近く", "ランチ", "店", "レストラン", "営業時間", "おいしい", "予約"]
-    news_tokens = ["ニュース", "発表", "速報", "昨日", "今日"]
-    info_tokens = ["なぜ", "どうやって", "いつ", "とは", "教えて", "標高", "定義", "意味"]
-    spec_tokens = ["バージョン", "仕様", "対応", "api", "model", "release"]
-    weather_tokens = ["天気", "予報", "気温", "雨", "晴れ", "台風", "気象"]
-    chat_tokens = ["こんにちは", "こんばんは", "おはよう", "ありがとう", "初めまして", "ようこそ", "調子はどう", "誰ですか", "名前は"]
-
-    if any(tok in qlow for tok in chat_tokens):
-        return "other"
-    if any(tok in qlow for tok in weather_tokens):
-        return "weather"
-    if any(tok in qlow for tok in local_tokens):
-        return "local_search"
-    if any(tok in qlow for tok in news_tokens):
-        return "news"
-    if any(tok in qlow for tok in info_tokens):
-        return "informational"
-    if any(tok in qlow for tok in spec_tokens):
-        return "spec"
+    # 3. LLM, only when the classifier was not confident
+    if use_llm:
+        try:
+            resp = lmstudio_chat(
+                [{"role":"system","content":system},
+                 {"role":"user","content":user}],
+                max_tokens=32,
+                temperature=0.0,
+                timeout=timeout
+            )
+            text = resp.strip().lower()
+            for t in ["informational","local_search","news","weather","document_qa","other"]:
+                if t in text:
+                    INTENT_DECISIONS.inc(source="llm")
+                    return t, "llm"
+        except Exception as e:
+            log("[Intent] LM failed:", e)
+
+    INTENT_DECISIONS.inc(source="fallback")
+    return _heuristic_intent(question), "fallback"
+
+# document_qa is decided up front in _local_intent
+_FALLBACK_INTENT_CATEGORIES = tuple(c for c in INTENT_CATEGORIES if c != "intent:document_qa")
+
+def _heuristic_intent(question: str) -> str:
+    # keyword heuristics: the first INTENT_TOKENS group with a hit wins
+    counts = keyword_matcher.counts(question, _FALLBACK_INTENT_CATEGORIES)
+    for category in _FALLBACK_INTENT_CATEGORIES:
+        if counts[category]:
+            return category.split(":", 1)[1]
     return "informational"
 
 # -----------------------
 # Query generation
 # -----------------------
-def qwen_generate_search_queries(question: str, intent: str, history: List[Dict] = [], n: int = NUM_SEARCH_QUERIES) -> List[str]:
+# intent -> (system prompt, query hint); None is the default
+_QUERY_PROMPTS: Dict[Optional[str], Tuple[str, str]] = {
+    "local_search": (
+        "You are a search-query generator for local business searches (Japanese).",
+        "- Prefer terms like 'ランチ', '営業時間', '口コミ', '食べログ', '住所' etc.",
+    ),
+    "news": (
+        "You are a search-query generator for news-related searches (Japanese).",
+        "- Prefer terms like 'ニュース', '速報', '発表', '原因', '影響'.",
+    ),
+    "weather": (
+        "You are a search-query generator for weather forecasts (Japanese).",
+        "- Prefer terms like '天気', '1時間ごと', '週間予報', '気象庁'.",
+    ),
+    "informational": (
+        "You are a search-query generator for factual informational search (Japanese).",
+        "- Use factual terms. Expand acronyms if ambiguous. If the term refers to a famous AI model (e.g., Gemini), add 'Google' or 'AI' to disambiguate (e.g. 'Google Gemini').",
+    ),
+    None: (
+        "You are a search-query generator for general informational search (Japanese).",
+        "- Use neutral factual keywords only.",
+    ),
+}
+
+def qwen_generate_search_queries(
+    question: str,
+    intent: str,
+    history: List[Dict] = [],
+    n: int = NUM_SEARCH_QUERIES,
+    timeout: float = LM_SHORT_TIMEOUT,
+    use_llm: bool = True,
+) -> List[str]:
     log("[Search Intent]", intent)
-    if intent == "local_search":
-        sys_prompt = "You are a search-query generator for local business searches (Japanese)."
-        extra_instruction = "- Prefer terms like 'ランチ', '営業時間', '口コミ', '食べログ', '住所' etc."
-    elif intent == "news":
-        sys_prompt = "You are a search-query generator for news-related searches (Japanese)."
-        extra_instruction = "- Prefer terms like 'ニュース', '速報', '発表', '原因', '影響'."
-    elif intent == "weather":
-        sys_prompt = "You are a search-query generator for weather forecasts (Japanese)."
-        extra_instruction = "- Prefer terms like '天気', '1時間ごと', '週間予報', '気象庁'."
-    elif intent == "informational":
-        sys_prompt = "You are a search-query generator for factual informational search (Japanese)."
-        extra_instruction = "- Use factual terms. Expand acronyms if ambiguous. If the term refers to a famous AI model (e.g., Gemini), add 'Google' or 'AI' to disambiguate (e.g. 'Google Gemini')."
-    else:
-        sys_prompt = "You are a search-query generator for general informational search (Japanese)."
-        extra_instruction = "- Use neutral factual keywords only."
+    if not use_llm:
+        return _fallback_search_queries(question, intent, n)
 
-    history_text = ""
-    if history:
-        history_text = "会話履歴:\n" + "\n".join([f"- {h['role']}: {h['content']}" for h in history]) + "\n\n"
+    inputs = {"question": normalize_question(question), "intent": intent, "history": history, "n": n}
+    queries = memoized("query_gen", QUERY_GEN_PROMPT_VERSION, inputs,
+                       lambda: _llm_search_queries(question, intent, history, n, timeout))
+    return queries or _fallback_search_queries(question, intent, n)
+
+def _llm_search_queries(question: str, intent: str, history: List[Dict], n: int,
+                        timeout: float) -> Optional[List[str]]:
+    sys_prompt, extra_instruction = _QUERY_PROMPTS.get(intent, _QUERY_PROMPTS[None])
+    history_text = _history_block(history, "会話履歴")
 
     user = (
         f"{history_text}ユーザーの質問: {question}\n\n"
@@ -124,12 +233,12 @@ def qwen_generate_search_queries(question: str, intent: str, history: List[Dict]
 
     messages = [{"role":"system","content":sys_prompt},{"role":"user","content":user}]
     try:
-        resp = lmstudio_chat(messages=messages, max_tokens=160, temperature=0.0, timeout=LM_SHORT_TIMEOUT)
+        resp = lmstudio_chat(messages=messages, max_tokens=160, temperature=0.0, timeout=timeout)
         text = resp
         parsed = safe_json_load(text)
         if isinstance(parsed, list) and parsed:
             qs = [q.strip() for q in parsed if isinstance(q, str) and q.strip()]
-            return qs[:n]
+            return qs[:n] or None
         lines = [l.strip(" -•\"'") for l in text.splitlines() if l.strip()]
         qs = []
         for ln in lines:
@@ -142,7 +251,10 @@ def qwen_generate_search_queries(question: str, intent: str, history: List[Dict]
             return qs[:n]
     except Exception as e:
         log("[Qwen] query-gen error (LM):", e)
+    return None
 
+def _fallback_search_queries(question: str, intent: str, n: int) -> List[str]:
+    """Template query variants, used when the LLM fails or there is no time to ask it."""
     base = question.strip()
     if intent == "local_search":
         variants = [f"{base} ランチ", f"{base} 営業時間", f"{base} 口コミ", f"{base} 食べログ"]
@@ -163,9 +275,93 @@ def qwen_generate_search_queries(question: str, intent: str, history: List[Dict]
         out.append(base)
     return out[:n]
 
+# -----------------------
+# Search planning (intent + queries in one call)
+# -----------------------
+_PLAN_INTENTS = ("informational", "local_search", "news", "weather", "document_qa", "other")
+
+def plan_search(
+    question: str,
+    history: List[Dict] = [],
+    n: int = NUM_SEARCH_QUERIES,
+    timeout: float = LM_SHORT_TIMEOUT,
+) -> Optional[Dict[str, Any]]:
+    """
+    Intent, search queries and whether the web is needed, from one LLM call:
+    {"intent": str, "queries": [str], "needs_web": bool}. None when the call
+    fails or the reply is not a usable plan; callers then fall back to
+    _llm_intent + qwen_generate_search_queries.
+    """
+    inputs = {"question": normalize_question(question), "history": history, "n": n}
+    return memoized("plan", PLAN_PROMPT_VERSION, inputs,
+                    lambda: _llm_plan(question, history, n, timeout))
+
+def _llm_plan(question: str, history: List[Dict], n: int, timeout: float) -> Optional[Dict[str, Any]]:
+    hints = "\n".join(f"- {label}: {hint[2:]}" for label, (_, hint) in _QUERY_PROMPTS.items() if label)
+    system = (
+        "You plan web searches for a Japanese question-answering assistant.\n"
+        "Classify the intent into one of: informational / local_search / news / weather / document_qa / other\n\n"
+        f"{_INTENT_DEFINITIONS}\n\n"
+        f"Query hints by intent:\n{hints}"
+    )
+    user = (
+        f"{_history_block(history, 'Conversation History')}User Question: {question}\n\n"
+        "Return ONLY one JSON object on one line:\n"
+        f'{{"intent": "<label>", "queries": [<{n} different Japanese search queries>], "needs_web": true|false}}\n'
+        "- needs_web is false only when the answer needs no current or external facts (greetings, arithmetic, rephrasing).\n"
+        "- queries may be [] when intent is other or document_qa."
+    )
+    try:
+        resp = lmstudio_chat(
+            [{"role": "system", "content": system},
+             {"role": "user", "content": user}],
+            max_tokens=200,
+            temperature=0.0,
+            timeout=timeout
+        )
+    except Exception as e:
+        log("[Plan] LM failed:", e)
+        PLAN_CALLS.inc(outcome="error")
+        return None
+
+    plan = _parse_plan(question, resp, n)
+    PLAN_CALLS.inc(outcome="ok" if plan else "invalid")
+    if plan is None:
+        log("[Plan] unusable reply:", resp[:200])
+    return plan
+
+def _parse_plan(question: str, text: str, n: int) -> Optional[Dict[str, Any]]:
+    # The object may come wrapped in a code fence or a sentence
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    parsed = safe_json_load(match.group(0)) if match else None
+    if not isinstance(parsed, dict):
+        return None
+    intent = str(parsed.get("intent", "")).strip().lower()
+    if intent not in _PLAN_INTENTS:
+        return None
+    raw_queries = parsed.get("queries")
+    queries = [q.strip() for q in raw_queries if isinstance(q, str) and q.strip()] if isinstance(raw_queries, list) else []
+    if not queries and intent not in ("other", "document_qa"):
+        queries = _fallback_search_queries(question, intent, n)
+    needs_web = parsed.get("needs_web", True)
+    return {"intent": intent, "queries": queries[:n], "needs_web": needs_web if isinstance(needs_web, bool) else True}
+
 # -----------------------
 # Context Helpers
 # -----------------------
+def chunk_text(full_text: str) -> List[str]:
+    """Split a web page into overlapping rerank chunks (short pages stay whole)."""
+    if len(full_text) <= RERANK_CHUNK_SIZE * 1.5:
+        return [full_text]
+    chunks = []
+    start = 0
+    while start < len(full_text):
+        chunk = full_text[start:start + RERANK_CHUNK_SIZE]
+        if len(chunk) > 100:
+            chunks.append(chunk)
+        start += (RERANK_CHUNK_SIZE - RERANK_CHUNK_OVERLAP)
+    return chunks
+
 def collect_candidates(chroma_docs: List[Dict], scored_web: List[Dict], intent: str = "informational"):
     """
     Collect and chunk candidates for reranking.
@@ -183,12 +379,18 @@ def collect_candidates(chroma_docs: List[Dict], scored_web: List[Dict], intent:
         # For informational, we want web to win if it's more relevant.
         h_score = 1.0 if intent == "informational" else 4.0
         
-        candidates.append({
+        cand = {
             "source": "chroma",
             "text": text,
             "h_score": h_score / 5.0, # normalize to 0-1
             "meta": {"title": title, "url": meta.get("source")}
-        })
+        }
+        # Reuse the vector Chroma already stores instead of re-encoding the chunk
+        if item.get("emb") is not None:
+            cand["emb"] = item["emb"]
+        if "distance" in item:
+            cand["distance"] = item["distance"]
+        candidates.append(cand)
 
     # 2. Web Hits (Chunking)
     for item in scored_web:
@@ -199,30 +401,28 @@ def collect_candidates(chroma_docs: List[Dict], scored_web: List[Dict], intent:
         h_score_raw = item.get("score", 1.0)
         h_score = min(h_score_raw / 5.0, 1.0) # normalize
         
-        # Chunking for finer reranking
-        chunks = []
-        if len(full_text) > RERANK_CHUNK_SIZE * 1.5:
-            start = 0
-            while start < len(full_text):
-                end = start + RERANK_CHUNK_SIZE
-                chunk = full_text[start:end]
-                if len(chunk) > 100:
-                    chunks.append(chunk)
-                start += (RERANK_CHUNK_SIZE - RERANK_CHUNK_OVERLAP)
-        else:
-            chunks = [full_text]
-            
-        for chunk in chunks:
-            candidates.append({
+        # Chunking for finer reranking; the fetch stage may already have chunked and embedded the page
+        chunks = item.get("chunks") or [(chunk, None) for chunk in chunk_text(full_text)]
+        for chunk, emb in chunks:
+            cand = {
                 "source": "web",
                 "text": chunk,
                 "h_score": h_score,
                 "meta": {"title": item.get("title"), "url": item.get("url")}
-            })
+            }
+            if emb is not None:
+                cand["emb"] = emb
+            candidates.append(cand)
             
     return candidates
 
-def rerank_candidates(question: str, candidates: List[Dict], intent: str = "informational", top_k: int = RERANK_TOP_K):
+def rerank_candidates(
+    question: str,
+    candidates: List[Dict],
+    intent: str = "informational",
+    top_k: int = RERANK_TOP_K,
+    q_emb: Optional[np.ndarray] = None,
+):
     if not candidates:
         return []
     
@@ -230,51 +430,35 @@ def rerank_candidates(question: str, candidates: List[Dict], intent: str = "info
     log(f"[Rerank] Using hybrid alpha={alpha} for intent={intent}")
     
     model = get_embed_model()
-    q_emb = model.encode([f"query: {question}"])[0]
-    scored_candidates = []
+    if q_emb is None:
+        q_emb = model.encode([f"query: {question}"])[0]
 
-    # Batch encode for efficiency if many candidates
-    texts_to_embed = [f"passage: {c['text']}" for c in candidates if "emb" not in c]
+    # Only chunks without a stored vector (web chunks) are encoded, each distinct text once
+    texts_to_embed = list(dict.fromkeys(c["text"] for c in candidates if c.get("emb") is None))
     if texts_to_embed:
-        embs = model.encode(texts_to_embed)
-        idx = 0
+        log(f"[Rerank] Encoding {len(texts_to_embed)} new chunks ({len(candidates) - len(texts_to_embed)} reused)")
+        with stage("embed"):
+            embs = encode_passages(model, texts_to_embed)
+        by_text = dict(zip(texts_to_embed, embs))
         for c in candidates:
-            if "emb" not in c:
-                c["emb"] = embs[idx]
-                idx += 1
+            if c.get("emb") is None:
+                c["emb"] = by_text[c["text"]]
 
-    for c in candidates:
-        emb = c["emb"]
-        # Vector Similarity (0-1 approx)
-        v_score = float(
-            np.dot(q_emb, emb) / 
-            (np.linalg.norm(q_emb) * np.linalg.norm(emb) + 1e-8)
-        )
-        
-        # Hybrid Score
-        h_score = c.get("h_score", 0.2)
-        final_score = alpha * h_score + (1.0 - alpha) * v_score
-        scored_candidates.append((final_score, c))
+    # Vector similarity for all candidates in one matrix-vector product
+    emb_matrix = as_unit_matrix([c["emb"] for c in candidates])
+    v_scores = emb_matrix @ as_unit_vector(q_emb)
 
-    scored_candidates.sort(key=lambda x: x[0], reverse=True)
-    
-    return [c for _, c in scored_candidates[:top_k]]
+    # Hybrid Score
+    h_scores = np.fromiter((c.get("h_score", 0.2) for c in candidates), dtype=np.float32, count=len(candidates))
+    final_scores = alpha * h_scores + (1.0 - alpha) * v_scores
+
+    return [candidates[i] for i in top_k_indices(final_scores, top_k)]
 
 def dedupe_by_similarity(candidates, threshold=0.92):
-    deduped = []
-    for c in candidates:
-        keep = True
-        for o in deduped:
-            sim = float(
-                np.dot(c["emb"], o["emb"]) /
-                (np.linalg.norm(c["emb"]) * np.linalg.norm(o["emb"]) + 1e-8)
-            )
-            if sim >= threshold:
-                keep = False
-                break
-        if keep:
-            deduped.append(c)
-    return deduped
+    if not candidates:
+        return []
+    emb_matrix = as_unit_matrix([c["emb"] for c in candidates])
+    return [candidates[i] for i in greedy_dedupe(emb_matrix, threshold)]
 
 def build_context_from_candidates(candidates, char_limit=CHARS_LIMIT):
     buf = []
@@ -300,7 +484,23 @@ def build_context_from_candidates(candidates, char_limit=CHARS_LIMIT):
 # -----------------------
 # Final Answer Pipeline
 # -----------------------
-def final_answer_pipeline(question: str, context: str, history: List[Dict] = [], intent: str = "informational", difficulty: str = "normal") -> str:
+def final_answer_pipeline(
+    question: str,
+    context: str,
+    history: List[Dict] = [],
+    intent: str = "informational",
+    difficulty: str = "normal",
+    on_delta: Optional[Callable[[str], None]] = None,
+    deadline: Optional[Deadline] = None,
+) -> str:
+    """
+    Generate the final answer. When on_delta is given the completion is
+    streamed and every content delta is passed to it as it arrives.
+    With a deadline, the LLM timeout is capped at the time left and a stream
+    still running when it expires is cut off (the answer stage is then
+    reported as degraded).
+    """
+    deadline = deadline or Deadline()
     if intent == "weather":
         system = (
             "あなたは天気予報のアシスタントです。\n"
@@ -340,15 +540,30 @@ def final_answer_pipeline(question: str, context: str, history: List[Dict] = [],
             "【指示】:\n"
             "回答に含まれる重要な専門用語、システム名、機能名などは、必ず `[[用語]]` のように二重角括弧で囲ってください。"
         )
-        return lmstudio_chat(
-            [
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
-            max_tokens=512,
-            temperature=0.0,
-            timeout=LM_TIMEOUT,
-        )
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+        timeout = deadline.timeout(LM_TIMEOUT)
+        if on_delta is None:
+            return lmstudio_chat(messages, max_tokens=512, temperature=0.0, timeout=timeout,
+                                 priority=PRIORITY_INTERACTIVE)
+
+        parts = []
+        try:
+            for delta in lmstudio_chat_stream(messages, max_tokens=512, temperature=0.0, timeout=timeout,
+                                              priority=PRIORITY_INTERACTIVE):
+                parts.append(delta)
+                on_delta(delta)
+                if deadline.expired():
+                    deadline.degrade("llm_answer", "answer truncated at deadline")
+                    break
+        except Exception as e:
+            if not parts:
+                raise
+            # Part of the answer is already on the user's screen; keep what we have.
+            log("[Qwen] stream interrupted:", e)
+        return "".join(parts)
 
     try:
         resp = _try_generate(context)
@@ -362,14 +577,14 @@ def final_answer_pipeline(question: str, context: str, history: List[Dict] = [],
 
     except Exception as e:
         log("[Qwen] final_answer_pipeline error:", e)
-        if "400" in str(e):
+        if "400" in str(e) and not deadline.expired():
             log("[Qwen] 400 Error detected. Retrying with shorter context...")
             try:
                 resp = _try_generate(context[:len(context)//2])
                 return resp.strip()
             except Exception as e2:
                 log("[Qwen] Retry failed:", e2)
-        return "回答生成中にエラーが発生しました。"
+        return ANSWER_ERROR_MESSAGE
 
 # -----------------------
 # Other Analysis Tools
@@ -393,7 +608,8 @@ def analyze_document_content(text: str) -> Dict[str, Any]:
             [{"role": "system", "content": system},
              {"role": "user", "content": user}],
             max_tokens=350,
-            temperature=0.2
+            temperature=0.2,
+            priority=PRIORITY_ENRICHMENT
         )
         content = resp.strip()
         if "```json" in content:
@@ -406,6 +622,11 @@ def analyze_document_content(text: str) -> Dict[str, Any]:
         return {}
 
 def explain_term(term: str) -> str:
+    explanation = memoized("explain", EXPLAIN_PROMPT_VERSION, {"term": normalize_question(term)},
+                           lambda: _llm_explain(term))
+    return explanation or EXPLAIN_ERROR_MESSAGE
+
+def _llm_explain(term: str) -> Optional[str]:
     system = "You are a helpful teacher. Explain the technical term concisely for a student in Japanese."
     user = f"Term: {term}\n\nExplanation:"
     try:
@@ -416,168 +637,607 @@ def explain_term(term: str) -> str:
             temperature=0.2,
             timeout=LM_SHORT_TIMEOUT
         )
-        return resp.strip()
+        return resp.strip() or None
     except Exception as e:
         log(f"[Explain] Error: {e}")
-        return "解説を取得できませんでした。"
+        return None
 
 # -----------------------
-# Main Process
+# Pipeline Stages
 # -----------------------
-def process_question(question: str, history: List[Dict] = [], difficulty: str = "normal") -> dict:
-    fast = try_fast_path(question)
-    if fast is not None:
-        return {"answer": fast, "sources": []}
-    start_time = time.time()
-
-    intent = detect_search_intent(question, history)
-    log(f"[Intent] {intent}")
+def _score_for_intent(intent: str, text: str, title: str, url: str) -> float:
+    if intent == "news":
+        return score_text_for_news(text, title=title, url=url)
+    elif intent == "weather":
+        return score_text_for_weather(text, title=title, url=url)
+    elif intent == "local_search":
+        return score_text_for_restaurant(text, title=title, url=url)
+    elif intent == "spec":
+        return score_text_for_spec(text, title=title, url=url)
+    # informational, document_qa and anything else use informational scoring
+    return score_text_for_informational(text, title=title, url=url)
 
-    
-    if intent == "other":
-        log("=== Search skipped (conversational/other) ===")
-        queries = []
-        hits = []
-        chroma_docs = []
+def _fetch_and_score(
+    h: Dict, intent: str, timeout: float = REQUESTS_TIMEOUT, batch: Optional[BatchMemo] = None
+) -> Optional[Dict]:
+    """Fetch one search hit and score it. Blocking; runs on a worker thread."""
+    url = h.get("href", "")
+    title = h.get("title", "")
+    if batch is not None:
+        text = batch.page_text(extract_text, url, timeout)
     else:
-        log("=== STEP 2: 検索クエリ生成 ===")
-        queries = qwen_generate_search_queries(question, intent, history, n=NUM_SEARCH_QUERIES)
-        log("Generated queries:", queries)
+        text = extract_text(url, timeout=timeout)
 
-        log("=== STEP 3: 検索実行 (Chroma + Web) ===")
-        # Chroma 検索: 元の質問と生成されたクエリの両方を使用
-        all_search_terms = [question] + queries
-        chroma_docs = []
-        seen_ids = set()
-        for q_term in all_search_terms:
-            results = search_chroma(q_term, n_results=5)
-            for r in results:
-                # メタデータ内の ID または テキストのハッシュで重複排除
-                # ここでは簡易的にソースとテキストの組み合わせで判定
-                key = (r['meta'].get('source'), r['text'][:100])
-                if key not in seen_ids:
-                    seen_ids.add(key)
-                    chroma_docs.append(r)
-        
-        if intent == "document_qa":
-            log("=== Web search skipped (document_qa) ===")
-            hits = []
-        else:
-            log("=== ddgs wide search ===")
-            hits = ddgs_search_many(queries, per_query=DDGS_MAX_PER_QUERY)
+    if not text or len(text) < 50:
+        snippet = h.get("body", "")
+        if snippet and len(snippet) > 30:
+            text = f"{snippet}\n(Note: Full content fetch failed, using search snippet.)"
+
+    if not text:
+        return None
+
+    return {
+        "title": title,
+        "url": url,
+        "text": text,
+        "score": _score_for_intent(intent, text, title, url),
+    }
+
+def _unique_hits(hits: List[Dict]) -> List[Dict]:
+    unique_hits = []
+    seen = set()
+    for h in hits:
+        key = h.get("href") or (h.get("title","") + h.get("body",""))
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        unique_hits.append(h)
+    return unique_hits
+
+def _collect_sources(ranked_candidates: List[Dict]) -> List[Dict]:
+    sources = []
+    seen_urls = set()
+    for c in ranked_candidates:
+        meta = c.get("meta", {})
+        url = meta.get("url")
+        if url:
+            if url not in seen_urls:
+                sources.append(meta)
+                seen_urls.add(url)
+        elif meta: # Local docs might not have URL but have title
+             sources.append(meta)
+    return sources
 
-            if intent == "informational":
-                hits = hits[:5]
-            elif intent in ("local_search", "news", "recommendation", "weather"):
-                hits = hits[:10]
+def _embed_query(question: str) -> np.ndarray:
+    return encode_queries([question])[0]
+
+async def _chroma_variants_stage(queries: List[str], raw_chroma: "asyncio.Future") -> List[Dict]:
+    """The query variants in one search_chroma_many call, merged after the raw-question hits."""
+    raw_results = await raw_chroma
+    return await asyncio.to_thread(run_stage, "chroma", search_chroma_many, queries, CHROMA_N_RESULTS, raw_results)
+
+def _query_count(deadline: Deadline, reserve: float) -> int:
+    """NUM_SEARCH_QUERIES, or a single query when the deadline is too close for a full search."""
+    return NUM_SEARCH_QUERIES if deadline.allows(DEADLINE_FULL_QUERIES, reserve) else 1
+
+async def _kb_gate_stage(question: str, q_emb: np.ndarray, intent: str, raw_chroma: "asyncio.Future") -> bool:
+    """True when the raw-question Chroma hits are good enough to answer without the web."""
+    if kb_gate_thresholds(intent) is None:
+        return False
+    confidence = kb_confidence(question, q_emb, (await raw_chroma)[0])
+    confident = kb_is_confident(confidence, intent)
+    KB_GATE_DECISIONS.inc(intent=intent, outcome="pass" if confident else "fail")
+    current_span().set_attributes(
+        kb_gate="pass" if confident else "fail",
+        kb_top=round(confidence["top"], 4), kb_gap=round(confidence["gap"], 4),
+        kb_coverage=round(confidence["coverage"], 2),
+    )
+    log(f"[KB Gate] top={confidence['top']:.3f} gap={confidence['gap']:.3f} "
+        f"coverage={confidence['coverage']:.2f} -> {'KB only' if confident else 'web'}")
+    return confident
+
+def _run_llm_stage(batch: Optional[BatchMemo], name: str, fn: Callable, *args, **kwargs):
+    """run_stage for LLM-bound stages; inside a batch, first wait for one of its LLM slots."""
+    if batch is None:
+        return run_stage(name, fn, *args, **kwargs)
+    with batch.llm_slot():
+        return run_stage(name, fn, *args, **kwargs)
+
+def _search_web(batch: Optional[BatchMemo], queries: List[str], per_query: int) -> List[Dict]:
+    if batch is None:
+        return ddgs_search_many(queries, per_query)
+    return batch.search(ddgs_search_many, queries, per_query)
+
+async def _web_search_stage(
+    queries: List[str], intent: str, deadline: Deadline, batch: Optional[BatchMemo] = None
+) -> List[Dict]:
+    log("=== ddgs wide search ===")
+    hits = await asyncio.to_thread(run_stage, "ddgs", _search_web, batch, queries, DDGS_MAX_PER_QUERY)
+
+    if intent == "informational":
+        hits = hits[:5]
+    elif intent in ("local_search", "news", "recommendation", "weather"):
+        hits = hits[:10]
 
     log("=== STEP 4: refine search ===")
     if intent in ("local_search", "news", "recommendation"):
-        extra = refine_queries_from_hits(hits, n_extra=2, intent=intent)
+        if not deadline.allows(DEADLINE_MIN_REFINE, DEADLINE_ANSWER_RESERVE):
+            deadline.degrade("refine", "skipped")
+            return hits
+        extra = await asyncio.to_thread(
+            _run_llm_stage, batch, "refine", refine_queries_from_hits, hits, 2, intent=intent,
+            timeout=deadline.timeout(LM_SHORT_TIMEOUT, DEADLINE_ANSWER_RESERVE)
+        )
         if extra:
             log("Refined queries:", extra)
-            more_hits = ddgs_search_many(extra, per_query=6)
+            more_hits = await asyncio.to_thread(run_stage, "ddgs", _search_web, batch, extra, 6)
             seen = {h.get("href") for h in hits if h.get("href")}
             for h in more_hits:
                 if h.get("href") and h["href"] not in seen:
                     hits.append(h)
+    return hits
 
-    # STEP 5: unique + fetch + score
-    unique_hits = []
-    seen = set()
-    for h in hits:
-        key = h.get("href") or (h.get("title","") + h.get("body",""))
-        if not key or key in seen:
+def _embed_page_chunks(item: Dict) -> None:
+    """Chunk a fetched page and attach (chunk, embedding) pairs for the reranker."""
+    chunks = chunk_text(item["text"].strip())
+    with stage("embed"):
+        embs = encode_passages(get_embed_model(), chunks)
+    item["chunks"] = list(zip(chunks, embs))
+
+async def _embed_worker(pages: "asyncio.Queue", wanted: Dict[str, Any]) -> None:
+    """
+    Consumer side of the fetch stage: chunk-embeds good pages while other
+    fetches are still in flight. Once the stage has picked its final sources
+    (wanted["urls"]), pages that did not make the cut are skipped.
+    """
+    while True:
+        item = await pages.get()
+        if item is None:
+            return
+        if wanted["urls"] is not None and item["url"] not in wanted["urls"]:
             continue
-        seen.add(key)
-        unique_hits.append(h)
+        try:
+            await asyncio.to_thread(_embed_page_chunks, item)
+        except Exception as e:
+            # The reranker encodes whatever is left without vectors
+            log(f"[Fetch] chunk embedding failed for {item['url']}: {e}")
 
-    scored = []
-    
-    # Helper for parallel fetch
-    def _fetch_content(h):
-        u = h.get("href", "")
-        return (h, extract_text(u))
+async def _fetch_stage(
+    hits: List[Dict], intent: str, deadline: Deadline, batch: Optional[BatchMemo] = None
+) -> List[Dict]:
+    """
+    Producer/consumer fetch: pages are fetched on the shared fetch_pool and scored as each
+    one arrives; pages good enough to be reranked are chunk-embedded meanwhile.
+    The stage returns as soon as RERANK_MAX_WEB_SOURCES pages score at least
+    FETCH_EARLY_STOP_SCORE, or when FETCH_STAGE_MAX_SECONDS (or the request
+    deadline) runs out; outstanding fetches are then cancelled.
+    """
+    unique_hits = _unique_hits(hits)
+    if not unique_hits:
+        return []
 
-    log(f"=== Parallel Fetch (max_workers=10) for {len(unique_hits)} hits ===")
-    
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(_fetch_content, h) for h in unique_hits]
-        
-        for future in as_completed(futures):
-            try:
-                h, text = future.result()
-                url = h.get("href","")
-                title = h.get("title","")
+    reserve = DEADLINE_ANSWER_RESERVE
+    fetch_timeout = deadline.timeout(REQUESTS_TIMEOUT, reserve)
+    # Hits beyond one wave of pool workers queue behind it and need a second fetch timeout.
+    if len(unique_hits) > FETCH_POOL_MAX_WORKERS and not deadline.allows(2 * fetch_timeout, reserve):
+        unique_hits = unique_hits[:FETCH_POOL_MAX_WORKERS]
+        deadline.degrade("fetch", "capped to one wave")
 
-                if not text or len(text) < 50:
-                    snippet = h.get("body", "")
-                    if snippet and len(snippet) > 30:
-                        text = f"{snippet}\n(Note: Full content fetch failed, using search snippet.)"
+    wall_cap = FETCH_STAGE_MAX_SECONDS
+    deadline_bound = deadline.remaining(reserve) < wall_cap
+    if deadline_bound:
+        wall_cap = deadline.timeout(wall_cap, reserve)
 
-                if not text:
+    log(f"=== Streaming Fetch (shared pool, cap={wall_cap:.1f}s) for {len(unique_hits)} hits ===")
+    loop = asyncio.get_running_loop()
+    request_key = current_trace_id() or object()
+    stop_at = loop.time() + wall_cap
+    scored = []
+    good = 0
+    exit_reason = "complete"
+    pages: asyncio.Queue = asyncio.Queue()
+    wanted: Dict[str, Any] = {"urls": None}
+    embedder = asyncio.ensure_future(_embed_worker(pages, wanted))
+    pending = set()
+    try:
+        pending = {
+            asyncio.wrap_future(fetch_pool.submit(
+                request_key, h.get("href", ""), bind_context(_fetch_and_score), h, intent, fetch_timeout, batch
+            ))
+            for h in unique_hits
+        }
+        while pending:
+            remaining = stop_at - loop.time()
+            if remaining <= 0:
+                exit_reason = "deadline" if deadline_bound else "cap"
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    item = future.result()
+                except Exception as e:
+                    log(f"[Streaming Fetch] Error processing hit: {e}")
+                    continue
+                if not item:
                     continue
+                scored.append(item)
+                if item["score"] > RERANK_MIN_WEB_SCORE:
+                    pages.put_nowait(item)
+                if item["score"] >= FETCH_EARLY_STOP_SCORE:
+                    good += 1
+            if pending and good >= RERANK_MAX_WEB_SOURCES:
+                exit_reason = "enough"
+                break
+    except BaseException:
+        embedder.cancel()
+        raise
+    finally:
+        # Queued fetches are dropped from the pool; running ones are bounded by fetch_timeout.
+        for future in pending:
+            future.cancel()
 
-                # Intent-specific scoring
-                if intent == "news":
-                    score = score_text_for_news(text, title=title, url=url)
-                elif intent == "weather":
-                    score = score_text_for_weather(text, title=title, url=url)
-                elif intent == "local_search":
-                    score = score_text_for_restaurant(text, title=title, url=url)
-                elif intent == "spec":
-                    score = score_text_for_spec(text, title=title, url=url)
-                elif intent == "informational":
-                    score = score_text_for_informational(text, title=title, url=url)
-                elif intent == "document_qa":
-                    # For document_qa, use informational scoring as fallback
-                    score = score_text_for_informational(text, title=title, url=url)
-                else:
-                    # Default to informational scoring
-                    score = score_text_for_informational(text, title=title, url=url)
-
-                scored.append({
-                    "title": title,
-                    "url": url,
-                    "text": text,
-                    "score": score
-                })
-            except Exception as e:
-                log(f"[Parallel Fetch] Error processing hit: {e}")
+    # Only the pages the reranker will actually see still need their chunks embedded
+    scored.sort(key=lambda x: x["score"], reverse=True)
+    selected = [s for s in scored if s["score"] > RERANK_MIN_WEB_SCORE][:RERANK_MAX_WEB_SOURCES]
+    wanted["urls"] = {s["url"] for s in selected}
+    pages.put_nowait(None)
+    await embedder
+
+    FETCH_STAGE_EXITS.inc(reason=exit_reason)
+    if pending:
+        FETCH_CANCELLED.inc(len(pending))
+        if exit_reason == "deadline":
+            deadline.degrade("fetch", f"{len(pending)} pages dropped")
+    current_span().set_attributes(fetch_exit=exit_reason, fetched=len(scored), fetch_cancelled=len(pending))
+    log(f"[Streaming Fetch] {exit_reason}: {len(scored)} pages, {good} good, {len(pending)} cancelled")
+    return scored
+
+# -----------------------
+# Main Process
+# -----------------------
+async def process_question_async(
+    question: str,
+    history: List[Dict] = [],
+    difficulty: str = "normal",
+    on_event: Optional[Callable[[Dict], None]] = None,
+    deadline_ms: Optional[int] = None,
+    batch: Optional[BatchMemo] = None,
+) -> dict:
+    """
+    Asyncio-native RAG pipeline. Independent stages are scheduled concurrently:
+
+        chroma(question) ──────────────────────────────┐
+        intent ─> queries ─┬─> chroma(queries) ────────┼─> rerank -> context -> answer
+                           └─> ddgs -> refine -> fetch ┘
+
+    When the chroma(question) hits pass the KB-confidence gate for the intent
+    (see kb_gate.py), query generation and the whole web branch are skipped.
+    Blocking stages (LLM, embedding, HTTP) run on worker threads.
+
+    on_event, if given, receives NDJSON-style events as they become available:
+    {"type": "trace"} with the trace id first, {"type": "sources", ...} once
+    retrieval is done, then {"type": "answer", ...} deltas while the answer
+    streams. It may be called from worker threads.
+
+    deadline_ms bounds the whole request (None uses REQUEST_DEADLINE_MS, 0
+    disables it). Stages shrink their work to fit the time left; the ones
+    that did are listed in result["degraded"] and sent as a
+    {"type": "degraded"} event before the pipeline returns.
+
+    Identical concurrent questions (same normalized question, difficulty and
+    history) are coalesced: one run executes, every caller receives all of
+    its events, and joiners get result["coalesced"] = True. A joiner waits for
+    the running request, whose deadline applies.
+
+    batch is set by process_questions to share embeddings, searches, fetches
+    and LLM slots across the questions of one batch.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return await _run_pipeline(question, history, difficulty, on_event, deadline_ms, batch)
+    return await single_flight.run(
+        flight_key(question, difficulty, history), on_event,
+        lambda emit: _run_pipeline(question, history, difficulty, emit, deadline_ms, batch),
+    )
+
+# Pipelines running right now, coalesced or not; background work (explanation prefetch) waits for zero
+_pipelines_lock = threading.Lock()
+_pipelines_running = 0
+
+def pipelines_in_flight() -> int:
+    with _pipelines_lock:
+        return _pipelines_running
+
+async def _run_pipeline(
+    question: str,
+    history: List[Dict],
+    difficulty: str,
+    on_event: Optional[Callable[[Dict], None]],
+    deadline_ms: Optional[int],
+    batch: Optional[BatchMemo] = None,
+) -> dict:
+    global _pipelines_running
+    with _pipelines_lock:
+        _pipelines_running += 1
+    try:
+        return await _traced_pipeline(question, history, difficulty, on_event, deadline_ms, batch)
+    finally:
+        with _pipelines_lock:
+            _pipelines_running -= 1
+
+async def _traced_pipeline(
+    question: str,
+    history: List[Dict],
+    difficulty: str,
+    on_event: Optional[Callable[[Dict], None]],
+    deadline_ms: Optional[int],
+    batch: Optional[BatchMemo],
+) -> dict:
+    deadline = Deadline(REQUEST_DEADLINE_MS if deadline_ms is None else deadline_ms)
+    with span("process_question", new_trace=True, question=question[:200], difficulty=difficulty, deadline_ms=deadline_ms) as root:
+        if on_event:
+            on_event({"type": "trace", "content": root.trace_id})
+        result = await _answer_question(question, history, difficulty, on_event, deadline, batch)
+        root.set_attributes(sources=len(result["sources"]), answer_chars=len(result["answer"]))
+        result["trace_id"] = root.trace_id
+        result["degraded"] = list(deadline.degraded)
+        if deadline.degraded:
+            root.set_attribute("degraded", ",".join(deadline.degraded))
+            if on_event:
+                on_event({"type": "degraded", "content": result["degraded"]})
+        return result
+
+async def _answer_question(
+    question: str,
+    history: List[Dict],
+    difficulty: str,
+    on_event: Optional[Callable[[Dict], None]],
+    deadline: Deadline,
+    batch: Optional[BatchMemo] = None,
+) -> dict:
+    emit = on_event or (lambda event: None)
+    reserve = DEADLINE_ANSWER_RESERVE
+
+    fast = try_fast_path(question)
+    if fast is not None:
+        emit({"type": "sources", "content": []})
+        emit({"type": "answer", "content": fast})
+        REQUEST_LATENCY.observe(0.0, outcome="fast_path")
+        return {"answer": fast, "sources": []}
+    start_time = time.time()
+
+    # Read once: an answer built on this KB state must not be cached under a later one
+    generation = await asyncio.to_thread(kb_generation)
+    cached = await asyncio.to_thread(get_cached_response, question, difficulty, history, generation)
+    if cached is not None:
+        log(f"[Cache] Response cache hit (intent={cached['intent']})")
+        current_span().set_attributes(cache="response", intent=cached["intent"])
+        emit({"type": "sources", "content": cached["sources"]})
+        emit({"type": "answer", "content": cached["answer"]})
+        REQUEST_LATENCY.observe(time.time() - start_time, outcome="cache_hit")
+        return {"answer": cached["answer"], "sources": cached["sources"]}
+
+    q_emb = batch.embedding(question) if batch is not None else None
+    if q_emb is None:
+        q_emb = await asyncio.to_thread(run_stage, "embed", _embed_query, question)
+    similar = await asyncio.to_thread(get_semantic_response, q_emb, difficulty, history, generation)
+    if similar is not None:
+        log(f"[Cache] Semantic cache hit: '{similar['question']}' (sim={similar['similarity']:.3f})")
+        current_span().set_attributes(cache="semantic", intent=similar["intent"])
+        emit({"type": "sources", "content": similar["sources"]})
+        emit({"type": "answer", "content": similar["answer"]})
+        REQUEST_LATENCY.observe(time.time() - start_time, outcome="cache_hit")
+        return {"answer": similar["answer"], "sources": similar["sources"]}
+
+    # Token-bounded history: a small view for classification and query prompts, a larger one for the answer
+    history_short = history_view(history, HISTORY_TOKENS_CLASSIFY)
+    history_answer = history_view(history, HISTORY_TOKENS_ANSWER)
+
+    # The raw-question Chroma lookup does not depend on the intent, so start it right away.
+    raw_chroma = asyncio.ensure_future(asyncio.to_thread(run_stage, "chroma", query_chroma_by_embeddings, [q_emb], CHROMA_N_RESULTS))
+
+    # Heuristics and the local classifier first; the LLM (and a batch LLM slot) only if they can't decide.
+    # The LLM is then asked for intent and queries together; the two-call path is the fallback.
+    plan, n_planned = None, NUM_SEARCH_QUERIES
+    decided = await asyncio.to_thread(run_stage, "intent", _local_intent, question, q_emb, history_short)
+    if decided is None:
+        use_llm = deadline.allows(DEADLINE_MIN_LLM_STEP, reserve)
+        if not use_llm:
+            deadline.degrade("intent", "heuristics only")
+        elif PLAN_CALL_ENABLED:
+            n_planned = _query_count(deadline, reserve)
+            plan = await asyncio.to_thread(
+                _run_llm_stage, batch, "plan", plan_search, question, history_short,
+                n_planned, deadline.timeout(LM_SHORT_TIMEOUT, reserve)
+            )
+            if plan is not None:
+                INTENT_DECISIONS.inc(source="plan")
+                decided = plan["intent"], "plan"
+        if decided is None:
+            decided = await asyncio.to_thread(
+                _run_llm_stage, batch, "intent", _llm_intent, question, history_short,
+                deadline.timeout(LM_SHORT_TIMEOUT, reserve), use_llm
+            )
+    intent, intent_source = decided
+    log(f"[Intent] {intent} ({intent_source})")
+    current_span().set_attributes(intent=intent, intent_source=intent_source)
+    if plan is not None:
+        current_span().set_attribute("needs_web", plan["needs_web"])
+
+    if intent == "other":
+        log("=== Search skipped (conversational/other) ===")
+        raw_chroma.cancel()
+        chroma_docs = []
+        scored = []
+    elif await _kb_gate_stage(question, q_emb, intent, raw_chroma):
+        log("=== Query generation and web search skipped (KB confident) ===")
+        chroma_docs = merge_chroma_results(await raw_chroma)
+        scored = []
+    else:
+        log("=== STEP 2: 検索クエリ生成 ===")
+        if plan is not None and plan["queries"]:
+            queries = plan["queries"]
+            if n_planned < NUM_SEARCH_QUERIES:
+                deadline.degrade("query_gen", "one query")
+        else:
+            use_llm = deadline.allows(DEADLINE_MIN_LLM_STEP, reserve)
+            n_queries = _query_count(deadline, reserve)
+            if n_queries < NUM_SEARCH_QUERIES:
+                deadline.degrade("query_gen", "one query" if use_llm else "template queries")
+            queries = await asyncio.to_thread(
+                _run_llm_stage, batch, "query_gen", qwen_generate_search_queries, question, intent, history_short,
+                n_queries, deadline.timeout(LM_SHORT_TIMEOUT, reserve), use_llm
+            )
+        log("Generated queries:", queries)
+
+        log("=== STEP 3: 検索実行 (Chroma + Web) ===")
+        # Chroma 検索: 元の質問と生成されたクエリの両方を使用
+        query_chroma = asyncio.ensure_future(_chroma_variants_stage(queries, raw_chroma))
+
+        if intent == "document_qa":
+            log("=== Web search skipped (document_qa) ===")
+            scored = []
+        elif plan is not None and not plan["needs_web"] and intent not in ("news", "weather", "local_search"):
+            log("=== Web search skipped (plan: needs_web=false) ===")
+            scored = []
+        elif not deadline.allows(DEADLINE_MIN_WEB_SEARCH, reserve):
+            deadline.degrade("web_search", "skipped")
+            scored = []
+        else:
+            # STEP 5: unique + fetch + score
+            hits = await _web_search_stage(queries, intent, deadline, batch)
+            scored = await _fetch_stage(hits, intent, deadline, batch)
+
+        chroma_docs = await query_chroma
 
     scored.sort(key=lambda x: x["score"], reverse=True)
     
     # Pre-filter: only chunk the top-N web sources based on heuristic score
-    scored_top = [s for s in scored if s.get("score", 0) > 0.5] # Remove extremely low quality only
+    scored_top = [s for s in scored if s.get("score", 0) > RERANK_MIN_WEB_SCORE] # Remove extremely low quality only
     scored_top = scored_top[:RERANK_MAX_WEB_SOURCES]
     log(f"[Performance] Pre-filtering: {len(scored)} -> {len(scored_top)} sources for chunking.")
     
     # STEP 6: summarize (collect/rerank)
     candidates = collect_candidates(chroma_docs, scored_top, intent=intent)
-    ranked_candidates = rerank_candidates(question, candidates, intent=intent, top_k=RERANK_TOP_K)
-    ranked_candidates = dedupe_by_similarity(ranked_candidates)
+    ranked_candidates = await asyncio.to_thread(run_stage, "rerank", rerank_candidates, question, candidates, intent, RERANK_TOP_K, q_emb)
+    ranked_candidates = await asyncio.to_thread(dedupe_by_similarity, ranked_candidates)
 
     log("=== STEP 7: context build ===")
-    context = build_context_from_candidates(ranked_candidates)
+    char_limit = CHARS_LIMIT
+    if deadline.remaining() < reserve / 2:
+        # Well under the time planned for the answer: a shorter prompt means faster prefill.
+        char_limit = int(CHARS_LIMIT * max(deadline.remaining() / (reserve / 2), 1 / 3))
+        deadline.degrade("context", f"trimmed to {char_limit} chars")
+    with stage("context"):
+        context = build_context_from_candidates(ranked_candidates, char_limit)
+
+    sources = _collect_sources(ranked_candidates)
+    emit({"type": "sources", "content": sources})
 
     # STEP 8: final answer
-    # STEP 8: final answer
-    answer = final_answer_pipeline(question, context, history, intent=intent, difficulty=difficulty)
+    streamed = []
+    def _on_delta(delta: str):
+        streamed.append(delta)
+        emit({"type": "answer", "content": delta})
 
-    sources = []
-    seen_urls = set()
-    for c in ranked_candidates:
-        meta = c.get("meta", {})
-        url = meta.get("url")
-        if url:
-            if url not in seen_urls:
-                sources.append(meta)
-                seen_urls.add(url)
-        elif meta: # Local docs might not have URL but have title
-             sources.append(meta)
+    answer = await asyncio.to_thread(
+        _run_llm_stage, batch, "llm_answer", final_answer_pipeline, question, context, history_answer, intent, difficulty,
+        _on_delta if on_event else None, deadline
+    )
+    if on_event and not streamed:
+        # Generation failed before any delta was sent; deliver the fallback text.
+        emit({"type": "answer", "content": answer})
 
-    log(f"\nTotal time: {time.time() - start_time:.1f}s")
+    # A degraded answer was built from partial retrieval; let the next asker get a full one.
+    if answer and answer != ANSWER_ERROR_MESSAGE and not deadline.degraded:
+        await asyncio.to_thread(store_cached_response, question, difficulty, intent, answer, sources, history, generation)
+        await asyncio.to_thread(store_semantic_response, q_emb, question, difficulty, intent, answer, sources, history, generation)
+
+    elapsed = time.time() - start_time
+    REQUEST_LATENCY.observe(elapsed, outcome="error" if answer == ANSWER_ERROR_MESSAGE else "answered")
+    log(f"\nTotal time: {elapsed:.1f}s")
     return {"answer": answer, "sources": sources}
 
+def _run_sync(coro):
+    """Run a coroutine to completion from synchronous code, even if this thread already has a loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def process_question(
+    question: str,
+    history: List[Dict] = [],
+    difficulty: str = "normal",
+    on_event: Optional[Callable[[Dict], None]] = None,
+    deadline_ms: Optional[int] = None,
+) -> dict:
+    """Synchronous entry point kept for existing callers; wraps process_question_async."""
+    return _run_sync(process_question_async(question, history, difficulty, on_event, deadline_ms))
+
+# -----------------------
+# Batch API
+# -----------------------
+async def process_questions_async(
+    questions: List[str],
+    difficulty: str = "normal",
+    deadline_ms: Optional[int] = 0,
+    concurrency: int = BATCH_MAX_CONCURRENCY,
+) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Answer a batch of independent questions (no history), yielding
+    (index, result) as each one finishes.
+
+    All question embeddings are computed in one encode call. DDGS queries
+    and page fetches repeated across the batch are done once (BatchMemo).
+    At most `concurrency` questions and BATCH_LLM_CONCURRENCY LLM calls are in
+    flight. deadline_ms defaults to 0 (none) because batches are offline work.
+    A question that raises gets the error message as its answer and an
+    "error" field; it does not stop the rest of the batch.
+    """
+    batch = BatchMemo()
+    unique = list(dict.fromkeys(q for q in questions if q and q.strip()))
+    if unique:
+        batch.set_embeddings(unique, await asyncio.to_thread(run_stage, "embed", encode_queries, unique))
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def _answer(i: int, question: str) -> Tuple[int, dict]:
+        async with slots:
+            try:
+                return i, await process_question_async(question, [], difficulty, None, deadline_ms, batch)
+            except Exception as e:
+                log(f"[Batch] question {i} failed: {e}")
+                return i, {"answer": ANSWER_ERROR_MESSAGE, "sources": [], "error": str(e)}
+
+    tasks = [asyncio.ensure_future(_answer(i, q)) for i, q in enumerate(questions)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def process_questions(
+    questions: List[str],
+    difficulty: str = "normal",
+    on_result: Optional[Callable[[int, dict], None]] = None,
+    deadline_ms: Optional[int] = 0,
+    concurrency: int = BATCH_MAX_CONCURRENCY,
+) -> List[dict]:
+    """
+    Synchronous batch API. Returns results in input order; on_result(index,
+    result), if given, is called as each question finishes.
+    """
+    async def _collect() -> List[dict]:
+        results: List[dict] = [None] * len(questions)
+        async for i, result in process_questions_async(questions, difficulty, deadline_ms, concurrency):
+            results[i] = result
+            if on_result:
+                on_result(i, result)
+        return results
+    return _run_sync(_collect())
+
 # Alias for cleaner naming in external scripts
 execute_rag_pipeline = process_question
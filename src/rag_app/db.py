@@ -1,10 +1,13 @@
 import chromadb
 import time
+import numpy as np
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 
-from .config import CHROMA_PATH, EMBED_MODEL_NAME
+from .config import CHROMA_PATH, EMBED_MODEL_NAME, CHROMA_USE_RRF, CHROMA_RRF_K
 from .utils import log
+from .cache import bump_kb_generation
+from .tracing import span
 
 # Embedding model (Lazy loading to speed up startup/reload)
 _embed_model = None
@@ -20,30 +23,110 @@ log(f"[DB] Connecting to ChromaDB at {CHROMA_PATH}")
 client = chromadb.PersistentClient(path=CHROMA_PATH)
 collection = client.get_or_create_collection("rag_docs_e5")
 
+def encode_queries(queries: List[str]) -> np.ndarray:
+    """Encode query strings in one batch (e5 "query:" prefix, normalized)."""
+    model = get_embed_model()
+    return model.encode([f"query: {q}" for q in queries], normalize_embeddings=True)
+
+def query_chroma_by_embeddings(query_embeddings: Any, n_results: int = 6) -> List[List[Dict]]:
+    """
+    One collection.query() for any number of query vectors. Returns one result
+    list per vector. Each result carries the chunk id, its stored embedding
+    ("emb") and the Chroma distance so callers never need to re-encode it.
+    """
+    if query_embeddings is None or len(query_embeddings) == 0:
+        return []
+    with span("search_chroma", queries=len(query_embeddings), n_results=n_results) as sp:
+        try:
+            res = collection.query(
+                query_embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in query_embeddings],
+                n_results=n_results,
+                include=["documents", "metadatas", "embeddings", "distances"]
+            )
+            out = [_unpack_query_result(res, i)[:n_results] for i in range(len(query_embeddings))]
+            sp.set_attribute("results", sum(len(r) for r in out))
+            return out
+        except Exception as e:
+            log("[Chroma] query error:", e)
+            sp.set_attribute("error", str(e)[:200])
+            return [[] for _ in query_embeddings]
+
+def merge_chroma_results(result_lists: List[List[Dict]], rrf: bool = CHROMA_USE_RRF, rrf_k: int = CHROMA_RRF_K) -> List[Dict]:
+    """
+    Merge per-query result lists by chunk id. With rrf=True the merged list is
+    ordered by reciprocal-rank fusion (sum of 1 / (rrf_k + rank)) across lists.
+    """
+    merged: Dict[Any, Dict] = {}
+    scores: Dict[Any, float] = {}
+    for results in result_lists:
+        for rank, r in enumerate(results):
+            key = r.get("id") or (r["meta"].get("source"), r["text"][:100])
+            if key not in merged:
+                merged[key] = r
+                scores[key] = 0.0
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+
+    if not rrf:
+        return list(merged.values())
+
+    ordered = sorted(merged, key=lambda k: scores[k], reverse=True)  # stable: ties keep first-seen order
+    out = []
+    for key in ordered:
+        item = merged[key]
+        item["rrf_score"] = scores[key]
+        out.append(item)
+    return out
+
 def search_chroma(query: str, n_results: int = 6) -> List[Dict]:
     try:
-        model = get_embed_model()
-        q_emb = model.encode([f"query: {query}"])
-        res = collection.query(query_embeddings=[q_emb[0]], n_results=n_results)
-        
-        documents = res.get("documents")
-        docs = documents[0] if documents else []
-        
-        metadatas = res.get("metadatas")
-        metas = metadatas[0] if metadatas else []
-        
-        # docs/metas が None の場合のガード
-        if docs is None: docs = []
-        if metas is None: metas = []
-        
-        results = []
-        for d, m in zip(docs, metas):
-            results.append({"text": d, "meta": m or {}})
-        return results[:n_results]
+        return query_chroma_by_embeddings(encode_queries([query]), n_results)[0]
     except Exception as e:
         log("[Chroma] query error:", e)
         return []
 
+def search_chroma_many(queries: List[str], n_results: int = 6, prior_results: Sequence[List[Dict]] = (),
+                       rrf: bool = CHROMA_USE_RRF) -> List[Dict]:
+    """
+    Search the KB with several query variants: one batched encode, one
+    multi-embedding collection.query(), results merged by chunk id.
+    prior_results are result lists the caller already has (the pipeline's
+    raw-question lookup); they are merged ahead of the new ones.
+    """
+    result_lists = list(prior_results)
+    if queries:
+        try:
+            result_lists += query_chroma_by_embeddings(encode_queries(queries), n_results)
+        except Exception as e:
+            log("[Chroma] query error:", e)
+    return merge_chroma_results(result_lists, rrf=rrf)
+
+def _unpack_query_result(res: Dict, i: int) -> List[Dict]:
+    """Turn the i-th query of a collection.query() response into result dicts."""
+    def _column(name):
+        col = res.get(name)
+        # docs/metas が None の場合のガード
+        if col is None or len(col) <= i or col[i] is None:
+            return []
+        return col[i]
+
+    ids = _column("ids")
+    docs = _column("documents")
+    metas = _column("metadatas")
+    embs = _column("embeddings")
+    dists = _column("distances")
+
+    results = []
+    for j, d in enumerate(docs):
+        item = {"text": d, "meta": (metas[j] if j < len(metas) else None) or {}}
+        if j < len(ids):
+            item["id"] = ids[j]
+        if j < len(embs) and embs[j] is not None:
+            item["emb"] = np.asarray(embs[j], dtype=np.float32)
+        if j < len(dists):
+            item["distance"] = float(dists[j])
+        results.append(item)
+    return results
+
 def add_document_to_kb(text: str, source: str, doc_metadata: Optional[Dict[str, Any]] = None):
     if not text:
         return
@@ -138,6 +221,7 @@ def add_document_to_kb(text: str, source: str, doc_metadata: Optional[Dict[str,
         embeddings=embeddings.tolist(),
         metadatas=metadatas
     )
+    bump_kb_generation()
     log(f"[DB] Added {len(chunks)} chunks from {source}")
 
 def clear_knowledge_base():
@@ -145,6 +229,7 @@ def clear_knowledge_base():
         all_ids = collection.get()['ids']
         if all_ids:
             collection.delete(ids=all_ids)
+        bump_kb_generation()
         log("[DB] Knowledge base cleared.")
     except Exception as e:
         log(f"[DB] clear_knowledge_base error: {e}")
@@ -197,6 +282,7 @@ def delete_document_from_kb(source: str) -> bool:
     """指定されたソースのドキュメントを削除"""
     try:
         collection.delete(where={"source": source})
+        bump_kb_generation()
         log(f"[DB] Deleted document: {source}")
         return True
     except Exception as e:
@@ -228,6 +314,7 @@ def update_document_title(source: str, new_title: str) -> bool:
             new_metadatas.append(m)
             
         collection.update(ids=ids, metadatas=new_metadatas)
+        bump_kb_generation()  # cached sources carry the old title
         log(f"[DB] Updated title for {source} to '{new_title}'")
         return True
     except Exception as e:
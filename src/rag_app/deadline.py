@@ -0,0 +1,53 @@
+import time
+import math
+from typing import List, Optional
+
+from .utils import log
+from .metrics import DEGRADED_STAGES
+from .tracing import current_span
+
+class Deadline:
+    """
+    Per-request latency budget shared by every pipeline stage.
+
+    Stages ask how much time is left (minus whatever must be kept back for
+    later stages) and shrink their work to fit; anything they cut short is
+    recorded with degrade() and reported back with the response.
+    A Deadline without a budget never expires and never shrinks anything.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.budget = budget_ms / 1000.0 if budget_ms and budget_ms > 0 else None
+        self.started = time.monotonic()
+        self.degraded: List[str] = []
+
+    @property
+    def limited(self) -> bool:
+        return self.budget is not None
+
+    def remaining(self, reserve: float = 0.0) -> float:
+        """Seconds left after setting aside `reserve` seconds for later stages."""
+        if self.budget is None:
+            return math.inf
+        return self.budget - (time.monotonic() - self.started) - reserve
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, needed: float, reserve: float = 0.0) -> bool:
+        """True if a step that needs `needed` seconds still fits before the reserve."""
+        return self.remaining(reserve) >= needed
+
+    def timeout(self, cap: float, reserve: float = 0.0, floor: float = 1.0) -> float:
+        """A timeout for one blocking call: the stage's normal cap, shortened to what is left."""
+        return max(min(cap, self.remaining(reserve)), floor)
+
+    def degrade(self, stage: str, reason: str = "") -> None:
+        if stage in self.degraded:
+            return
+        self.degraded.append(stage)
+        DEGRADED_STAGES.inc(stage=stage)
+        sp = current_span()
+        if sp is not None:
+            sp.set_attribute("degraded", ",".join(self.degraded))
+        log(f"[Deadline] {stage} degraded ({reason or 'budget'}), {self.remaining():.1f}s left")
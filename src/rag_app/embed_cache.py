@@ -0,0 +1,139 @@
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+from .config import (
+    EMBED_MODEL_NAME, EMBED_CACHE_ENABLED, EMBED_CACHE_PATH,
+    EMBED_CACHE_MAX_ENTRIES, EMBED_CACHE_DTYPE
+)
+from .utils import log
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache for passages (web chunks).
+
+    Rows are keyed by sha1(model name + text) and hold the vector as a compact
+    float16/float32 blob. last_used is refreshed on every hit; once the table
+    grows past max_entries the least recently used rows are deleted.
+    """
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+                 dtype: str = EMBED_CACHE_DTYPE):
+        self.path = path
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache (
+                                key TEXT PRIMARY KEY,
+                                model TEXT,
+                                dim INTEGER,
+                                dtype TEXT,
+                                vec BLOB,
+                                last_used REAL
+                            )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_last_used ON embedding_cache(last_used)")
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha1(f"{model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Return {text: vector} for the texts that are cached."""
+        if not texts:
+            return {}
+        keys = {self.make_key(model_name, t): t for t in texts}
+        found: Dict[str, np.ndarray] = {}
+        key_list = list(keys)
+        with self._connect() as conn:
+            for i in range(0, len(key_list), 500):  # stay under SQLite's variable limit
+                batch = key_list[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, dim, dtype, vec FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, dim, dtype, blob in rows:
+                    found[keys[key]] = np.frombuffer(blob, dtype=dtype).astype(np.float32).reshape(dim)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE key = ?",
+                    [(now, self.make_key(model_name, t)) for t in found],
+                )
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        CACHE_HITS.inc(len(found), cache="embedding")
+        CACHE_MISSES.inc(len(texts) - len(found), cache="embedding")
+        return found
+
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        now = time.time()
+        rows = []
+        for t, v in zip(texts, vectors):
+            v = np.asarray(v).astype(self.dtype)
+            rows.append((self.make_key(model_name, t), model_name, v.shape[0], self.dtype.name, v.tobytes(), now))
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, model, dim, dtype, vec, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            if count > self.max_entries:
+                # Evict a little extra so we do not trim on every insert
+                overflow = count - self.max_entries + max(self.max_entries // 20, 1)
+                conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN "
+                    "(SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+
+    def encode(self, model: Any, texts: List[str], prefix: str = "passage: ",
+               model_name: str = EMBED_MODEL_NAME) -> np.ndarray:
+        """
+        Embed texts, consulting the cache first. Only misses reach model.encode,
+        in one batch. Returns an (n, dim) float32 array in input order.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        cached = self.get_many(model_name, texts)
+        missing = [t for t in dict.fromkeys(texts) if t not in cached]
+        if missing:
+            embs = np.asarray(model.encode([f"{prefix}{t}" for t in missing]), dtype=np.float32)
+            self.put_many(model_name, missing, embs)
+            cached.update(zip(missing, embs))
+        return np.stack([cached[t] for t in texts]).astype(np.float32, copy=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+embedding_cache: Optional[EmbeddingCache] = None
+
+def encode_passages(model: Any, texts: List[str]) -> np.ndarray:
+    """Embed passages through the persistent cache, falling back to a plain encode."""
+    global embedding_cache
+    if EMBED_CACHE_ENABLED:
+        try:
+            if embedding_cache is None:
+                embedding_cache = EmbeddingCache()
+            return embedding_cache.encode(model, texts)
+        except Exception as e:
+            log(f"[EmbedCache] error, encoding without cache: {e}")
+    return np.asarray(model.encode([f"passage: {t}" for t in texts]), dtype=np.float32)
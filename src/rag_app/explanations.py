@@ -0,0 +1,139 @@
+import re
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .config import (
+    EXPLAIN_PREFETCH_ENABLED, EXPLAIN_PREFETCH_MAX_TERMS, EXPLAIN_PREFETCH_IDLE_POLL, EXPLAIN_JOIN_TIMEOUT
+)
+from .utils import log, normalize_question
+from .core import explain_term, pipelines_in_flight, EXPLAIN_ERROR_MESSAGE
+from .llm import llm_priority, PRIORITY_INTERACTIVE, PRIORITY_ENRICHMENT
+from .metrics import EXPLAIN_PREFETCH
+
+# final_answer_pipeline asks the model to mark key terms as [[用語]]
+_TERM_RE = re.compile(r"\[\[([^\[\]\n]{1,40})\]\]")
+
+def extract_terms(answer: str, limit: int = EXPLAIN_PREFETCH_MAX_TERMS) -> List[str]:
+    """[[terms]] of an answer in order of first appearance, without duplicates."""
+    terms: Dict[str, str] = {}
+    for match in _TERM_RE.finditer(answer or ""):
+        term = match.group(1).strip()
+        if term:
+            terms.setdefault(normalize_question(term), term)
+        if len(terms) >= limit:
+            break
+    return list(terms.values())
+
+class ExplanationPrefetcher:
+    """
+    One low-priority worker that explains [[terms]] ahead of the click.
+
+    Jobs run one at a time, only while no foreground pipeline is in flight
+    (busy() is polled), and at enrichment priority in the LLM gateway, so
+    prefetching never competes with a question for the LLM. Results land in the LLM memo through explain_term, which is
+    what makes a later /api/explain instant. A term that is already queued or
+    running is not queued twice; explain() on a queued term takes it out of
+    the queue and answers it right away, on a running one it waits up to
+    join_timeout and then explains the term itself.
+    """
+
+    def __init__(self, explain: Callable[[str], str] = explain_term,
+                 busy: Callable[[], bool] = lambda: pipelines_in_flight() > 0,
+                 idle_poll: float = EXPLAIN_PREFETCH_IDLE_POLL,
+                 join_timeout: float = EXPLAIN_JOIN_TIMEOUT):
+        self._explain = explain
+        self._busy = busy
+        self.idle_poll = idle_poll
+        self.join_timeout = join_timeout
+        self._cond = threading.Condition()
+        self._queue: Deque[Tuple[str, str]] = deque()  # (key, term)
+        self._pending: Dict[str, Future] = {}          # queued or running, by normalized term
+        self._running: set = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, terms: List[str]) -> List[Tuple[str, Future]]:
+        """Queue terms for explanation. Each future resolves to the text, or None on failure."""
+        out = []
+        with self._cond:
+            for term in terms:
+                key = normalize_question(term)
+                future = self._pending.get(key)
+                if future is None:
+                    future = self._pending[key] = Future()
+                    self._queue.append((key, term))
+                    EXPLAIN_PREFETCH.inc(outcome="queued")
+                out.append((term, future))
+            if self._queue and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._worker, name="explain-prefetch", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return out
+
+    def explain(self, term: str) -> str:
+        """Explanation for an interactive request; never waits behind the queue."""
+        key = normalize_question(term)
+        with self._cond:
+            future = self._pending.get(key)
+            running = key in self._running
+            if future is not None and not running:
+                self._queue = deque(job for job in self._queue if job[0] != key)
+                del self._pending[key]
+        if running:
+            EXPLAIN_PREFETCH.inc(outcome="joined")
+            try:
+                text = future.result(timeout=self.join_timeout)
+            except FuturesTimeout:
+                log(f"[Explain] prefetch of {term!r} still running after {self.join_timeout}s, explaining directly")
+                text = None
+            if text is not None:
+                return text
+            future = None  # the worker resolves it
+        with llm_priority(PRIORITY_INTERACTIVE):
+            text = self._explain(term)
+        if future is not None:
+            future.set_result(None if text == EXPLAIN_ERROR_MESSAGE else text)
+        return text
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    if not self._cond.wait(timeout=60):
+                        self._thread = None
+                        return
+            # Yield to foreground work; checked outside the lock so explain() is never blocked
+            while self._busy():
+                time.sleep(self.idle_poll)
+            with self._cond:
+                if not self._queue:
+                    continue
+                key, term = self._queue.popleft()
+                future = self._pending[key]
+                self._running.add(key)
+            try:
+                with llm_priority(PRIORITY_ENRICHMENT):
+                    text = self._explain(term)
+                text = None if text == EXPLAIN_ERROR_MESSAGE else text
+            except Exception as e:
+                log(f"[Explain] prefetch of {term!r} failed: {e}")
+                text = None
+            with self._cond:
+                self._running.discard(key)
+                self._pending.pop(key, None)
+            EXPLAIN_PREFETCH.inc(outcome="ok" if text else "error")
+            future.set_result(text)
+
+explanation_prefetcher = ExplanationPrefetcher()
+
+def prefetch_explanations(answer: str) -> List[Tuple[str, Future]]:
+    """Queue the [[terms]] of a finished answer; [] when prefetching is disabled."""
+    if not EXPLAIN_PREFETCH_ENABLED:
+        return []
+    return explanation_prefetcher.submit(extract_terms(answer))
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .config import FETCH_POOL_MAX_WORKERS, FETCH_POOL_PER_HOST
+from .metrics import FETCH_QUEUE_DEPTH, FETCH_ACTIVE
+
+_Job = Tuple[Future, str, Callable, tuple]
+
+class FetchPool:
+    """
+    One long-lived, process-wide executor for page fetches.
+
+    - At most max_workers fetches run at once across all requests.
+    - At most per_host fetches run against the same host at once; jobs for a
+      busy host wait while jobs for other hosts go ahead.
+    - Requests are served round-robin, so a request with 20 hits does not
+      starve one that arrives behind it with 5.
+
+    submit() returns a concurrent.futures.Future; cancelling it before a
+    worker picks the job up removes the fetch (asyncio.wrap_future propagates
+    cancellation, so cancelling the awaiting task is enough).
+    """
+
+    def __init__(self, max_workers: int = FETCH_POOL_MAX_WORKERS, per_host: int = FETCH_POOL_PER_HOST):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[Hashable, Deque[_Job]]" = OrderedDict()
+        self._host_active: Dict[str, int] = {}
+        self._active = 0
+        self._threads: List[threading.Thread] = []
+        self._shutdown = False
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    def submit(self, request_key: Hashable, url: str, fn: Callable, *args: Any) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("FetchPool is shut down")
+            self._queues.setdefault(request_key, deque()).append((future, self.host_of(url), fn, args))
+            self._ensure_workers()
+            self._cond.notify()
+        return future
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return sum(1 for q in self._queues.values() for job in q if not job[0].cancelled())
+
+    def active(self) -> int:
+        with self._cond:
+            return self._active
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._shutdown = True
+            for q in self._queues.values():
+                for future, *_ in q:
+                    future.cancel()
+            self._queues.clear()
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def _ensure_workers(self) -> None:
+        # Called with the lock held; threads are started lazily, up to max_workers.
+        self._threads = [t for t in self._threads if t.is_alive()]
+        busy_or_waiting = self._active + sum(len(q) for q in self._queues.values())
+        while len(self._threads) < min(self.max_workers, busy_or_waiting):
+            t = threading.Thread(target=self._worker, name=f"fetch-pool-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _next_job(self) -> Optional[_Job]:
+        """Round-robin over requests; within a request, the first job whose host has room. Lock held."""
+        for key in list(self._queues):
+            q = self._queues[key]
+            while q and q[0][0].cancelled():
+                q.popleft()
+            picked = None
+            for i, job in enumerate(q):
+                if job[0].cancelled():
+                    continue
+                if self._host_active.get(job[1], 0) < self.per_host:
+                    picked = i
+                    break
+            if picked is not None:
+                job = q[picked]
+                del q[picked]
+                # Served requests go to the back of the line
+                self._queues.move_to_end(key)
+                if not q:
+                    del self._queues[key]
+                return job
+            if not q:
+                del self._queues[key]
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = None
+                while not self._shutdown:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+                future, host, fn, args = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._active += 1
+                self._host_active[host] = self._host_active.get(host, 0) + 1
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._host_active[host] -= 1
+                    if not self._host_active[host]:
+                        del self._host_active[host]
+                    # A finished job may unblock a host-limited job for any waiting worker
+                    self._cond.notify_all()
+
+fetch_pool = FetchPool()
+FETCH_QUEUE_DEPTH.set_function(fetch_pool.queue_depth)
+FETCH_ACTIVE.set_function(fetch_pool.active)
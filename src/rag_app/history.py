@@ -0,0 +1,163 @@
+import re
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from .config import (
+    LM_SHORT_TIMEOUT, HISTORY_RECENT_ROWS, HISTORY_SUMMARY_ENABLED, HISTORY_SUMMARY_MAX_TOKENS
+)
+from .utils import log
+from .llm import lmstudio_chat, PRIORITY_ENRICHMENT
+
+SUMMARY_ROLE = "summary"
+
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uff00-\uffef]")
+_TURN_OVERHEAD = 4    # "- role: " and the line break
+_MIN_TURN_TOKENS = 16  # below this a cut turn is noise
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per four other characters."""
+    cjk = len(_CJK_RE.findall(text or ""))
+    return cjk + (len(text or "") - cjk + 3) // 4
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Cut text to about `tokens` tokens, keeping the beginning."""
+    total = estimate_tokens(text)
+    if total <= tokens:
+        return text
+    return text[:max(int(len(text) * tokens / total) - 1, 0)].rstrip() + "…"
+
+def history_view(history: List[Dict], budget_tokens: int) -> List[Dict]:
+    """
+    The part of the history that fits in budget_tokens, oldest first.
+
+    Turns are taken newest first. No single turn may use more than half the
+    budget, so one long markdown answer cuts to its opening (usually the
+    direct answer) instead of pushing every other turn out. The rolling
+    summary goes in front with whatever budget is left.
+    """
+    if not history or budget_tokens <= 0:
+        return []
+    summary = next((h for h in history if h.get("role") == SUMMARY_ROLE), None)
+    turns = [h for h in history if h.get("role") != SUMMARY_ROLE]
+
+    view: List[Dict] = []
+    left = budget_tokens
+    per_turn = max(budget_tokens // 2, 1)
+    for h in reversed(turns):
+        room = min(left, per_turn) - _TURN_OVERHEAD
+        content = h["content"]
+        if estimate_tokens(content) > room:
+            if room < _MIN_TURN_TOKENS:
+                break
+            content = truncate_to_tokens(content, room)
+        view.append({"role": h["role"], "content": content})
+        left -= estimate_tokens(content) + _TURN_OVERHEAD
+    view.reverse()
+
+    if summary is not None and left - _TURN_OVERHEAD >= _MIN_TURN_TOKENS:
+        view.insert(0, {"role": SUMMARY_ROLE, "content": truncate_to_tokens(summary["content"], left - _TURN_OVERHEAD)})
+    return view
+
+def summarize_turns(previous: str, turns: List[Dict], timeout: float = LM_SHORT_TIMEOUT) -> str:
+    """Fold turns into the previous running summary with one LLM call."""
+    lines = "\n".join(f"- {t['role']}: {truncate_to_tokens(t['content'], 400)}" for t in turns)
+    system = "You maintain a running summary of a conversation between a user and an assistant."
+    user = (
+        f"これまでの要約:\n{previous or '(なし)'}\n\n"
+        f"追加の会話:\n{lines}\n\n"
+        "追加の会話を反映した新しい要約を日本語で書いてください。"
+        "話題、固有名詞、ユーザーの関心や前提は残し、回答の細部は省いてください。要約だけを出力してください。"
+    )
+    return lmstudio_chat(
+        [{"role": "system", "content": system},
+         {"role": "user", "content": user}],
+        max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+        temperature=0.0,
+        timeout=timeout,
+        priority=PRIORITY_ENRICHMENT
+    ).strip()
+
+class HistoryStore:
+    """
+    Conversation history from the history table of chat_history.db.
+
+    The newest HISTORY_RECENT_ROWS rows are returned verbatim. Older rows are
+    folded into a rolling summary kept in the history_summary table, together
+    with the id of the last row it covers. refresh_summary() is meant to run
+    after an answer has been stored, off the request path, so load() never
+    waits on the LLM.
+    """
+
+    def __init__(self, path: str, recent_rows: int = HISTORY_RECENT_ROWS):
+        self.path = path
+        self.recent_rows = recent_rows
+        self._refresh_lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS history_summary (
+                                id INTEGER PRIMARY KEY CHECK (id = 1),
+                                summary TEXT,
+                                upto_id INTEGER
+                            )''')
+
+    def _summary(self, conn: sqlite3.Connection) -> Tuple[str, int]:
+        row = conn.execute("SELECT summary, upto_id FROM history_summary WHERE id = 1").fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    @staticmethod
+    def _as_turn(sender: str, text: str) -> Dict:
+        return {"role": "user" if sender == "user" else "assistant", "content": text or ""}
+
+    def load(self) -> List[Dict]:
+        """[summary entry, if any] + the newest rows not covered by it, oldest first."""
+        with self._connect() as conn:
+            summary, upto_id = self._summary(conn)
+            rows = conn.execute(
+                "SELECT sender, text FROM history WHERE id > ? ORDER BY id DESC LIMIT ?",
+                (upto_id, self.recent_rows)
+            ).fetchall()
+        history = [self._as_turn(sender, text) for sender, text in reversed(rows)]
+        if summary:
+            history.insert(0, {"role": SUMMARY_ROLE, "content": summary})
+        return history
+
+    def refresh_summary(self, summarize: Callable[[str, List[Dict]], str] = summarize_turns) -> bool:
+        """
+        Fold rows that dropped out of the verbatim window into the summary.
+        Returns True if the summary changed.
+        """
+        if not HISTORY_SUMMARY_ENABLED:
+            return False
+        with self._refresh_lock:
+            with self._connect() as conn:
+                summary, upto_id = self._summary(conn)
+                rows = conn.execute(
+                    "SELECT id, sender, text FROM history WHERE id > ? ORDER BY id", (upto_id,)
+                ).fetchall()
+            aged = rows[:-self.recent_rows] if self.recent_rows else rows
+            if not aged:
+                return False
+            # A long backlog (first run on an old database) is folded from its newest part only
+            aged = aged[-4 * max(self.recent_rows, 1):]
+            try:
+                new_summary = summarize(summary, [self._as_turn(sender, text) for _, sender, text in aged])
+            except Exception as e:
+                log("[History] summary refresh failed:", e)
+                return False
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO history_summary (id, summary, upto_id) VALUES (1, ?, ?)",
+                    (new_summary, aged[-1][0])
+                )
+            log(f"[History] summary now covers rows <= {aged[-1][0]} ({estimate_tokens(new_summary)} tokens)")
+            return True
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM history_summary")
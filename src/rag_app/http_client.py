@@ -0,0 +1,83 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .config import LM_CONNECT_TIMEOUT, LM_HTTP_POOL_SIZE, LMSTUDIO_URLS
+from .metrics import LLM_HTTP_CONNECTIONS
+
+# Connections opened by the current thread; urllib3 opens them on the thread that asked
+_opened = threading.local()
+
+def _count_open():
+    _opened.count = getattr(_opened, "count", 0) + 1
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count_open()
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count_open()
+        return super()._new_conn()
+
+class _PoolAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+class PooledHTTPClient:
+    """
+    Keep-alive HTTP client shared by every thread (request handlers, fetch
+    pool, batch workers, background jobs).
+
+    One HTTPAdapter, and so one urllib3 pool of up to pool_size idle
+    connections per host, is mounted on a Session per thread: the pool is
+    thread-safe, a Session (its cookie jar) is not. Timeouts are a
+    (connect, read) pair, so an unreachable server fails after
+    connect_timeout instead of after the long read timeout a generation
+    needs. Every request is counted in rag_llm_http_connections_total as
+    "new" (TCP handshake) or "reused" (keep-alive).
+    """
+
+    def __init__(self, pool_size: int = LM_HTTP_POOL_SIZE, connect_timeout: float = LM_CONNECT_TIMEOUT):
+        self.connect_timeout = connect_timeout
+        # pool_connections is the number of hosts whose pools are kept; one per LLM backend
+        self._adapter = _PoolAdapter(pool_connections=max(4, len(LMSTUDIO_URLS)), pool_maxsize=pool_size, max_retries=0)
+        self._local = threading.local()
+
+    def session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = requests.Session()
+            s.mount("http://", self._adapter)
+            s.mount("https://", self._adapter)
+        return s
+
+    def timeouts(self, read_timeout: float) -> Tuple[float, float]:
+        return (min(self.connect_timeout, read_timeout), read_timeout)
+
+    def post(self, url: str, body: bytes, timeout: float, headers: Optional[Dict[str, str]] = None,
+             stream: bool = False) -> requests.Response:
+        """POST a pre-encoded body. With stream=True the caller must close the response."""
+        before = getattr(_opened, "count", 0)
+        r = self.session().post(url, data=body, headers=headers, timeout=self.timeouts(timeout), stream=stream)
+        LLM_HTTP_CONNECTIONS.inc(connection="new" if getattr(_opened, "count", 0) > before else "reused")
+        return r
+
+    def get(self, url: str, timeout: float) -> requests.Response:
+        before = getattr(_opened, "count", 0)
+        r = self.session().get(url, timeout=self.timeouts(timeout))
+        LLM_HTTP_CONNECTIONS.inc(connection="new" if getattr(_opened, "count", 0) > before else "reused")
+        return r
+
+    def close(self) -> None:
+        self._adapter.close()
+
+llm_http = PooledHTTPClient()
@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .config import (
+    EMBED_MODEL_NAME, INTENT_CLASSIFIER_PATH,
+    INTENT_CLASSIFIER_MIN_CONFIDENCE, INTENT_CLASSIFIER_TEMPERATURE
+)
+from .utils import log
+from .vectors import as_unit_matrix, as_unit_vector
+
+INTENT_LABELS = ("informational", "local_search", "news", "weather", "document_qa", "other")
+
+# Labelled seed questions; evaluation_log.jsonl entries with a known intent are added on top.
+SEED_EXAMPLES: Dict[str, List[str]] = {
+    "informational": [
+        "富士山の標高は？", "RAGとは何ですか", "量子化とはどういう意味？", "光合成の仕組みを教えて",
+        "織田信長はいつ生まれた？", "TCPとUDPの違いは？", "Pythonのリスト内包表記の使い方",
+        "Qwen2.5のコンテキスト長は？", "GDPの定義を教えて", "なぜ空は青いの？",
+        "Transformerのアテンション機構について説明して", "日本で一番長い川は？",
+    ],
+    "local_search": [
+        "渋谷でおすすめのランチ", "新宿駅の近くのカフェ", "梅田で予約できる焼肉屋",
+        "近くの営業時間が遅いラーメン屋", "京都駅周辺のおいしい和食レストラン", "池袋の評判のいい寿司屋",
+        "この辺で子連れで行けるレストラン", "横浜中華街の口コミが高い店", "名古屋で手羽先の有名店",
+        "札幌駅近くの深夜営業の居酒屋",
+    ],
+    "news": [
+        "今日のニュースを教えて", "最新の為替ニュース", "昨日の地震の速報", "新型iPhoneの発表内容",
+        "選挙の結果はどうなった？", "株価が急落した原因は？", "日銀の金利発表について",
+        "最近話題の事件", "台風被害の最新情報", "今週のテック業界のニュース",
+    ],
+    "weather": [
+        "明日の東京の天気", "大阪の週間天気予報", "今日は雨が降る？", "週末の気温はどう？",
+        "台風の進路予報", "札幌の今の気温", "明後日の降水確率", "花粉の飛散予報",
+        "傘は必要？", "福岡の1時間ごとの天気",
+    ],
+    "document_qa": [
+        "このドキュメントを要約して", "アップロードした資料の第3章には何が書いてある？",
+        "このPDFの結論は？", "ファイルに書かれている手順を抜き出して", "この文書のセクション2を説明して",
+        "資料の中で予算について触れている部分", "アップロードしたファイルの要点を3つ",
+        "この仕様書の対応バージョンは？", "ドキュメント内で定義されている用語一覧", "この資料の著者は？",
+    ],
+    "other": [
+        "こんにちは", "ありがとう", "おはようございます", "あなたは誰ですか", "調子はどう？",
+        "はじめまして", "助かりました", "よろしくお願いします", "さようなら", "名前は何？",
+    ],
+}
+
+def load_training_examples(log_path: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Seed examples plus logged questions with a known intent and no bad rating."""
+    examples = [(q, label) for label, qs in SEED_EXAMPLES.items() for q in qs]
+    if log_path and os.path.exists(log_path):
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                question = (entry.get("question") or "").strip()
+                label = entry.get("intent")
+                rating = entry.get("rating")
+                if label in INTENT_LABELS and len(question) > 1 and question != "unknown" and rating != "bad":
+                    examples.append((question, label))
+    return list(dict.fromkeys(examples))
+
+def training_fingerprint(examples: Sequence[Tuple[str, str]], model_name: str = EMBED_MODEL_NAME) -> str:
+    raw = json.dumps([model_name, sorted(examples)], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class CentroidIntentClassifier:
+    """
+    Nearest-centroid classifier over e5 query embeddings. Each intent is the
+    mean of its examples' unit vectors; a question is scored against every
+    centroid with one matrix-vector product, and a temperature softmax over
+    the cosine scores gives the confidence.
+    """
+
+    def __init__(self, labels: Sequence[str], centroids: np.ndarray, fingerprint: str = "",
+                 temperature: float = INTENT_CLASSIFIER_TEMPERATURE):
+        self.labels = list(labels)
+        self.centroids = as_unit_matrix(centroids)
+        self.fingerprint = fingerprint
+        self.temperature = temperature
+
+    @classmethod
+    def fit(cls, examples: Sequence[Tuple[str, str]], encode: Callable[[List[str]], np.ndarray],
+            fingerprint: str = "") -> "CentroidIntentClassifier":
+        texts = [q for q, _ in examples]
+        embs = as_unit_matrix(encode(texts))
+        labels = [label for label in INTENT_LABELS if any(l == label for _, l in examples)]
+        centroids = np.stack([
+            embs[[i for i, (_, l) in enumerate(examples) if l == label]].mean(axis=0) for label in labels
+        ])
+        return cls(labels, centroids, fingerprint)
+
+    def predict(self, q_emb: np.ndarray) -> Tuple[str, float]:
+        sims = self.centroids @ as_unit_vector(q_emb)
+        z = (sims - sims.max()) / self.temperature
+        probs = np.exp(z) / np.exp(z).sum()
+        best = int(np.argmax(probs))
+        return self.labels[best], float(probs[best])
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, labels=np.array(self.labels), centroids=self.centroids,
+                 fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path: str) -> "CentroidIntentClassifier":
+        data = np.load(path, allow_pickle=False)
+        return cls([str(l) for l in data["labels"]], data["centroids"], str(data["fingerprint"]))
+
+def train_intent_classifier(encode: Callable[[List[str]], np.ndarray], log_path: Optional[str] = None,
+                            path: Optional[str] = INTENT_CLASSIFIER_PATH) -> CentroidIntentClassifier:
+    examples = load_training_examples(log_path)
+    clf = CentroidIntentClassifier.fit(examples, encode, training_fingerprint(examples))
+    if path:
+        clf.save(path)
+    log(f"[IntentClassifier] trained on {len(examples)} examples ({len(clf.labels)} intents)")
+    return clf
+
+_classifier: Optional[CentroidIntentClassifier] = None
+_classifier_lock = threading.Lock()
+
+def get_intent_classifier(encode: Callable[[List[str]], np.ndarray], log_path: Optional[str] = None) -> CentroidIntentClassifier:
+    """
+    The process-wide classifier: loaded from INTENT_CLASSIFIER_PATH when it was
+    trained on the current examples and embedding model, retrained otherwise.
+    """
+    global _classifier
+    if _classifier is not None:
+        return _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            fingerprint = training_fingerprint(load_training_examples(log_path))
+            clf = None
+            if INTENT_CLASSIFIER_PATH and os.path.exists(INTENT_CLASSIFIER_PATH):
+                try:
+                    clf = CentroidIntentClassifier.load(INTENT_CLASSIFIER_PATH)
+                except Exception as e:
+                    log(f"[IntentClassifier] could not load {INTENT_CLASSIFIER_PATH}: {e}")
+                if clf is not None and clf.fingerprint != fingerprint:
+                    clf = None
+            _classifier = clf or train_intent_classifier(encode, log_path)
+    return _classifier
+
+def classify_intent(q_emb: np.ndarray, encode: Callable[[List[str]], np.ndarray],
+                    log_path: Optional[str] = None) -> Optional[str]:
+    """The predicted intent, or None when confidence is below INTENT_CLASSIFIER_MIN_CONFIDENCE."""
+    label, confidence = get_intent_classifier(encode, log_path).predict(q_emb)
+    log(f"[IntentClassifier] {label} (p={confidence:.2f})")
+    return label if confidence >= INTENT_CLASSIFIER_MIN_CONFIDENCE else None
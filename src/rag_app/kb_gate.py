@@ -0,0 +1,63 @@
+import re
+import unicodedata
+import numpy as np
+from typing import List, Dict, Optional
+
+from .config import KB_GATE_ENABLED, KB_GATE_DEFAULT, KB_GATE_BY_INTENT, KB_GATE_COVERAGE_TOP_N
+from .vectors import as_unit_matrix, as_unit_vector
+
+# Content-bearing runs: kanji, katakana words, latin/digit tokens. Hiragana runs are
+# mostly particles and inflections, so they are left out.
+_TERM_RE = re.compile(r"[一-鿿々〆ヶ]+|[ァ-ヺー]{2,}|[a-z0-9][a-z0-9.+\-]*")
+_STOP_TERMS = {"何", "誰", "教", "方法", "意味", "違", "場合", "今", "最新"}
+
+def query_terms(question: str) -> List[str]:
+    """Distinct content terms of a question (NFKC, lowercased), in order."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    terms = [t for t in _TERM_RE.findall(text) if t not in _STOP_TERMS]
+    return list(dict.fromkeys(terms))
+
+def _similarities(q_emb: np.ndarray, items: List[Dict]) -> np.ndarray:
+    if all(it.get("emb") is not None for it in items):
+        return as_unit_matrix([it["emb"] for it in items]) @ as_unit_vector(q_emb)
+    # Chroma's default l2 space over unit vectors: d = 2 - 2cos
+    return np.array([1.0 - it.get("distance", 2.0) / 2.0 for it in items], dtype=np.float32)
+
+def kb_confidence(question: str, q_emb: np.ndarray, items: List[Dict]) -> Dict[str, float]:
+    """
+    Confidence signals for the raw-question Chroma hits:
+      top       cosine similarity of the best hit
+      gap       best minus worst of the returned hits; a flat distribution means
+                the question matched the KB only generically
+      coverage  share of the question's content terms found in the best hits' text
+    """
+    if not items:
+        return {"top": 0.0, "gap": 0.0, "coverage": 0.0, "hits": 0}
+    sims = _similarities(q_emb, items)
+    order = np.argsort(-sims, kind="stable")
+    top = float(sims[order[0]])
+    gap = top - float(sims[order[-1]]) if len(items) > 1 else top
+
+    terms = query_terms(question)
+    if terms:
+        top_text = unicodedata.normalize("NFKC", " ".join(items[i].get("text", "") for i in order[:KB_GATE_COVERAGE_TOP_N])).lower()
+        coverage = sum(1 for t in terms if t in top_text) / len(terms)
+    else:
+        coverage = 0.0
+    return {"top": top, "gap": gap, "coverage": coverage, "hits": len(items)}
+
+def kb_gate_thresholds(intent: str) -> Optional[Dict[str, float]]:
+    """Thresholds for an intent, or None when the KB may never replace web search for it."""
+    if not KB_GATE_ENABLED:
+        return None
+    return KB_GATE_BY_INTENT.get(intent, KB_GATE_DEFAULT)
+
+def kb_is_confident(confidence: Dict[str, float], intent: str) -> bool:
+    thresholds = kb_gate_thresholds(intent)
+    if thresholds is None:
+        return False
+    return (
+        confidence["top"] >= thresholds["min_top_sim"]
+        and confidence["gap"] >= thresholds["min_gap"]
+        and confidence["coverage"] >= thresholds["min_coverage"]
+    )
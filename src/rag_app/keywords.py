@@ -0,0 +1,94 @@
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, Optional, Sequence, Tuple
+
+from .config import (
+    NEWS_KEYWORDS, WEATHER_KEYWORDS, SPEC_KEYWORDS, RESTAURANT_KEYWORDS, INFORMATIONAL_KEYWORDS,
+    NEWS_FRESHNESS_KEYWORDS, WEATHER_TIME_KEYWORDS, CITATION_KEYWORDS, EXPLANATORY_KEYWORDS,
+    INTENT_TOKENS, FOLLOW_UP_TOKENS,
+)
+
+def normalize_text(text: str) -> str:
+    """NFKC + lowercase, the canonical form keywords are stored in."""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+# Inverse NFKC for the compatibility characters Japanese pages actually use:
+# fullwidth ASCII, halfwidth katakana (voiced ones are two characters) and ℃/℉.
+_WIDE = str.maketrans({chr(cp): chr(cp + 0xFEE0) for cp in range(0x21, 0x7F)})
+_NARROW: Dict[str, str] = {}
+for _cp in range(0xFF61, 0xFF9E):
+    _NARROW.setdefault(normalize_text(chr(_cp)), chr(_cp))
+    for _mark in ("ﾞ", "ﾟ"):
+        _composed = normalize_text(chr(_cp) + _mark)
+        if len(_composed) == 1:
+            _NARROW.setdefault(_composed, chr(_cp) + _mark)
+_COMPAT = {normalize_text(ch): ch for ch in ("℃", "℉")}
+
+def surface_forms(keyword: str) -> Tuple[str, ...]:
+    """
+    Spellings of a normalized keyword that lowercase to it under NFKC:
+    "api" -> ("api", "ａｐｉ"), "ニュース" -> ("ニュース", "ﾆｭｰｽ"), "°c" -> ("°c", "℃").
+    """
+    forms = [keyword, keyword.translate(_WIDE), "".join(_NARROW.get(ch, ch) for ch in keyword)]
+    forms += [keyword.replace(plain, ch) for plain, ch in _COMPAT.items() if plain in keyword]
+    return tuple(dict.fromkeys(forms))
+
+class KeywordMatcher:
+    """
+    Per-category keyword hits for a piece of text.
+
+    Built once from {category: keywords}. Keywords are NFKC-normalized and
+    deduplicated across categories, so a keyword that several lists share
+    ("今日", "速報", "api") is looked up once per scan, and each one is compiled
+    to its NFKC-equivalent surface forms so the scanned text only needs
+    lower(): normalizing a whole page costs more than all of its keyword
+    lookups. Only presence matters to the callers, so each form is one
+    substring check that stops at the first occurrence.
+    """
+
+    def __init__(self, categories: Dict[str, Sequence[str]]):
+        self.categories: Dict[str, Tuple[str, ...]] = {
+            name: tuple(dict.fromkeys(normalize_text(k) for k in keywords if k))
+            for name, keywords in categories.items()
+        }
+        self._forms = {k: surface_forms(k) for ks in self.categories.values() for k in ks}
+        self._by_names: Dict[Tuple[str, ...], Tuple[str, ...]] = {}  # category tuple -> its keywords
+
+    def _keywords_for(self, names: Tuple[str, ...]) -> Tuple[str, ...]:
+        keywords = self._by_names.get(names)
+        if keywords is None:
+            keywords = self._by_names[names] = tuple(dict.fromkeys(k for name in names for k in self.categories[name]))
+        return keywords
+
+    def scan(self, text: str, categories: Optional[Iterable[str]] = None,
+             lowered: bool = False) -> Dict[str, FrozenSet[str]]:
+        """
+        {category: matched keywords} for the requested categories (all by
+        default). Pass lowered=True when the text is already lowercased.
+        """
+        names = tuple(categories) if categories is not None else tuple(self.categories)
+        if not lowered:
+            text = (text or "").lower()
+        found = {k for k in self._keywords_for(names) if any(f in text for f in self._forms[k])}
+        return {name: frozenset(found.intersection(self.categories[name])) for name in names}
+
+    def counts(self, text: str, categories: Optional[Iterable[str]] = None,
+               lowered: bool = False) -> Dict[str, int]:
+        """{category: number of distinct keywords found}."""
+        return {name: len(hits) for name, hits in self.scan(text, categories, lowered).items()}
+
+# Shared by the intent heuristics (core) and the page scorers (scraper).
+keyword_matcher = KeywordMatcher({
+    "news": NEWS_KEYWORDS,
+    "weather": WEATHER_KEYWORDS,
+    "spec": SPEC_KEYWORDS,
+    "restaurant": RESTAURANT_KEYWORDS,
+    "informational": INFORMATIONAL_KEYWORDS,
+    "freshness": NEWS_FRESHNESS_KEYWORDS,
+    "forecast_time": WEATHER_TIME_KEYWORDS,
+    "citation": CITATION_KEYWORDS,
+    "explanatory": EXPLANATORY_KEYWORDS,
+    "follow_up": FOLLOW_UP_TOKENS,
+    **{f"intent:{label}": tokens for label, tokens in INTENT_TOKENS.items()},
+})
+
+INTENT_CATEGORIES = tuple(f"intent:{label}" for label in INTENT_TOKENS)
@@ -1,9 +1,18 @@
-import requests
 import json
 import time
-from typing import List, Dict, Any, Optional
-from .config import LMSTUDIO_URL, QWEN_MODEL, LM_TIMEOUT, LM_RETRIES
-from .utils import log
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator, Deque
+from .config import (
+    QWEN_MODEL, LM_TIMEOUT, LM_RETRIES, LLM_MAX_IN_FLIGHT, LLM_ENRICHMENT_MAX_IN_FLIGHT
+)
+from .utils import log, safe_json_load
+from .metrics import LLM_CALLS, LLM_QUEUE_WAIT, LLM_QUEUE_DEPTH, LLM_IN_FLIGHT
+from .http_client import llm_http
+from .backends import Backend, BackendPool, llm_backends
+from .tracing import span, start_span, finish_span
 
 def generate_system_prompt(difficulty: str = "normal") -> str:
     """
@@ -20,6 +29,129 @@ def generate_system_prompt(difficulty: str = "normal") -> str:
         
     return base
 
+def _build_messages(arg1: Any, arg2: Any, messages: Optional[List[Dict]]) -> List[Dict]:
+    # Case 1: messages argument provided
+    if messages is not None:
+        return messages
+    # Case 2: arg1 is a list (positional list input)
+    if isinstance(arg1, list):
+        return arg1
+    # Case 3: old style (system, user)
+    if isinstance(arg1, str) and isinstance(arg2, str):
+        return [
+            {"role": "system", "content": arg1},
+            {"role": "user", "content": arg2}
+        ]
+    raise ValueError("[lmstudio_chat] Invalid arguments provided. Need (system, user) or messages list.")
+
+def _encode_payload(payload: Dict) -> bytes:
+    # UTF-8 instead of \uXXXX escapes: Japanese prompts are about half the bytes
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+# -----------------------
+# Gateway (priority admission for LLM calls)
+# -----------------------
+PRIORITY_INTERACTIVE = "interactive"  # the answer a user is waiting for
+PRIORITY_PLANNING = "planning"        # intent, search plan, query generation, refine
+PRIORITY_ENRICHMENT = "enrichment"    # document analysis, history summaries, prefetched explanations
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_PLANNING, PRIORITY_ENRICHMENT)  # highest first
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("rag_llm_priority", default=PRIORITY_PLANNING)
+
+@contextmanager
+def llm_priority(priority: str) -> Iterator[None]:
+    """
+    Run the LLM calls made in this block at `priority` (asyncio.to_thread
+    work started inside it inherits the setting).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class LLMGateway:
+    """
+    Process-wide admission control for LLM calls.
+
+    At most max_in_flight calls (streams included, for their whole length)
+    hold a slot at once. A freed slot goes to the oldest waiter of the
+    highest class, so a waiting answer always goes before planning calls,
+    and those before enrichment. Enrichment is also capped at
+    LLM_ENRICHMENT_MAX_IN_FLIGHT slots, so an upload or prefetch burst never
+    leaves an arriving answer without a slot.
+
+    Callers block on a threading.Event rather than an asyncio primitive:
+    pipeline LLM stages run on per-request executor threads (each request
+    has its own event loop), and uploads, summaries and prefetches run on
+    plain threads, so only a thread-level gate sees all of them.
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT,
+                 enrichment_max_in_flight: int = LLM_ENRICHMENT_MAX_IN_FLIGHT):
+        self.max_in_flight = max(max_in_flight, 1)
+        self.caps = {p: self.max_in_flight for p in PRIORITIES}
+        self.caps[PRIORITY_ENRICHMENT] = min(max(enrichment_max_in_flight, 1), self.max_in_flight)
+        self._lock = threading.Lock()
+        self._waiting: Dict[str, Deque[threading.Event]] = {p: deque() for p in PRIORITIES}
+        self._in_flight: Dict[str, int] = {p: 0 for p in PRIORITIES}
+
+    def _dispatch(self) -> None:
+        # Called with the lock held: hand free slots to waiters, highest class first
+        for p in PRIORITIES:
+            waiting = self._waiting[p]
+            while (waiting and sum(self._in_flight.values()) < self.max_in_flight
+                   and self._in_flight[p] < self.caps[p]):
+                self._in_flight[p] += 1
+                waiting.popleft().set()
+
+    def acquire(self, priority: str, timeout: Optional[float] = None) -> float:
+        """Wait for a slot; returns the seconds waited. Raises RuntimeError after timeout."""
+        if priority not in self._waiting:
+            raise ValueError(f"[LLMGateway] unknown priority {priority!r}")
+        granted = threading.Event()
+        start = time.perf_counter()
+        with self._lock:
+            self._waiting[priority].append(granted)
+            self._dispatch()
+        if not granted.wait(timeout):
+            with self._lock:
+                if not granted.is_set():
+                    self._waiting[priority].remove(granted)
+                    LLM_QUEUE_WAIT.observe(time.perf_counter() - start, priority=priority)
+                    raise RuntimeError(f"[LLMGateway] no {priority} slot within {timeout}s")
+        waited = time.perf_counter() - start
+        LLM_QUEUE_WAIT.observe(waited, priority=priority)
+        return waited
+
+    def release(self, priority: str) -> None:
+        with self._lock:
+            self._in_flight[priority] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[float]:
+        """Hold a slot for the block; yields the seconds spent waiting for it."""
+        priority = priority or _priority.get()
+        waited = self.acquire(priority, timeout)
+        try:
+            yield waited
+        finally:
+            self.release(priority)
+
+    def queue_depth(self, priority: str) -> int:
+        with self._lock:
+            return len(self._waiting[priority])
+
+    def in_flight(self, priority: str) -> int:
+        with self._lock:
+            return self._in_flight[priority]
+
+llm_gateway = LLMGateway()
+for _p in PRIORITIES:
+    LLM_QUEUE_DEPTH.set_function(lambda p=_p: llm_gateway.queue_depth(p), priority=_p)
+    LLM_IN_FLIGHT.set_function(lambda p=_p: llm_gateway.in_flight(p), priority=_p)
+
 def lmstudio_chat(
     arg1: Any = None,
     arg2: Any = None,
@@ -28,7 +160,9 @@ def lmstudio_chat(
     max_tokens: int = 1000,
     timeout: int = LM_TIMEOUT,
     retries: int = LM_RETRIES,
-    messages: List[Dict] = None
+    messages: List[Dict] = None,
+    priority: Optional[str] = None,
+    backends: Optional[BackendPool] = None
 ) -> str:
     """
     Simpler interface for chat completion.
@@ -36,26 +170,14 @@ def lmstudio_chat(
       - lmstudio_chat(system_prompt, user_prompt, ...)
       - lmstudio_chat(messages=[...], ...)
       - lmstudio_chat([{"role":...}, ...], ...)
+    The call waits for an llm_gateway slot of `priority` (default: the
+    llm_priority() in effect); the wait counts against timeout. It is sent
+    to the least loaded server of `backends` (default: llm_backends, from
+    LMSTUDIO_URLS); a retry goes to another server when there is one.
     """
     
-    final_messages = []
-
-    # Case 1: messages argument provided
-    if messages is not None:
-        final_messages = messages
-    # Case 2: arg1 is a list (positional list input)
-    elif isinstance(arg1, list):
-        final_messages = arg1
-    # Case 3: old style (system, user)
-    elif isinstance(arg1, str) and isinstance(arg2, str):
-        final_messages = [
-            {"role": "system", "content": arg1},
-            {"role": "user", "content": arg2}
-        ]
-    else:
-        raise ValueError("[lmstudio_chat] Invalid arguments provided. Need (system, user) or messages list.")
+    final_messages = _build_messages(arg1, arg2, messages)
 
-    
     payload = {
         "model": model, 
         "messages": final_messages,
@@ -63,35 +185,155 @@ def lmstudio_chat(
         "max_tokens": max_tokens,
         "stream": False
     }
-    headers = {"Content-Type": "application/json"}
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    body = _encode_payload(payload)
+
+    prompt_chars = sum(len(m.get("content") or "") for m in final_messages)
+    priority = priority or _priority.get()
+    with span("lmstudio_chat", model=model, max_tokens=max_tokens, prompt_chars=prompt_chars, priority=priority) as sp:
+        with llm_gateway.slot(priority, timeout) as waited:
+            sp.set_attribute("queue_wait_ms", round(waited * 1000, 1))
+            timeout = max(timeout - waited, 1)
+            pool = backends or llm_backends
+            tried: List[Backend] = []
+            last_exc = None
+            for attempt in range(retries + 1):
+                # Each attempt goes to the best backend not tried yet (the same one if it is the only one)
+                with pool.use(exclude=tried) as backend:
+                    tried.append(backend)
+                    started = time.perf_counter()
+                    try:
+                        r = llm_http.post(backend.url, body, timeout, headers=headers)
+                        r.raise_for_status()
+                        # Handle empty/invalid JSON response
+                        try:
+                            resp_json = r.json()
+                        except json.JSONDecodeError:
+                            # If connection worked but response body is empty/bad
+                            raise ValueError(f"Invalid JSON response: {r.text[:100]}")
+
+                        if "choices" not in resp_json or not resp_json["choices"]:
+                             raise ValueError(f"Unexpected response format: {resp_json}")
 
+                        LLM_CALLS.inc(mode="chat", outcome="ok")
+                        usage = resp_json.get("usage") or {}
+                        pool.record_success(backend, usage.get("completion_tokens"), time.perf_counter() - started)
+                        sp.set_attributes(
+                            attempts=attempt + 1,
+                            backend=backend.url,
+                            prompt_tokens=usage.get("prompt_tokens"),
+                            completion_tokens=usage.get("completion_tokens"),
+                            response_bytes=len(r.content),
+                        )
+                        return resp_json["choices"][0]["message"]["content"]
+                    except Exception as e:
+                        LLM_CALLS.inc(mode="chat", outcome="error")
+                        pool.record_failure(backend, e)
+                        last_exc = e
+                if attempt < retries:
+                    log(f"[lmstudio_chat] Retry {attempt+1}/{retries} due to {last_exc}")
+                    time.sleep(0.3)
+
+            # If all retries failed
+            raise RuntimeError(f"[lmstudio_chat] Network/API error after {retries} retries: {last_exc}")
+
+
+def lmstudio_chat_stream(
+    arg1: Any = None,
+    arg2: Any = None,
+    model: str = QWEN_MODEL,
+    temperature: float = 0.7,
+    max_tokens: int = 1000,
+    timeout: int = LM_TIMEOUT,
+    retries: int = LM_RETRIES,
+    messages: List[Dict] = None,
+    priority: Optional[str] = None,
+    backends: Optional[BackendPool] = None
+) -> Iterator[str]:
+    """
+    Streaming variant of lmstudio_chat. Yields content deltas as the
+    OpenAI-compatible endpoint sends them (SSE "data:" lines).
+    Retries only happen before the first delta has been yielded. The
+    llm_gateway slot is held until the stream ends or is closed.
+    """
+    final_messages = _build_messages(arg1, arg2, messages)
+
+    payload = {
+        "model": model,
+        "messages": final_messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+    headers = {"Content-Type": "application/json; charset=utf-8", "Accept": "text/event-stream"}
+
+    priority = priority or _priority.get()
+    sp = start_span(
+        "lmstudio_chat_stream", model=model, max_tokens=max_tokens, priority=priority,
+        prompt_chars=sum(len(m.get("content") or "") for m in final_messages)
+    )
+    try:
+        with llm_gateway.slot(priority, timeout) as waited:
+            sp.set_attribute("queue_wait_ms", round(waited * 1000, 1))
+            yield from _stream_deltas(payload, headers, max(timeout - waited, 1), retries, sp, backends or llm_backends)
+    except GeneratorExit:
+        sp.set_attribute("closed_early", True)
+        finish_span(sp)
+        raise
+    except BaseException as e:
+        finish_span(sp, e)
+        raise
+    finish_span(sp)
+
+def _stream_deltas(payload: Dict, headers: Dict, timeout: int, retries: int, sp, pool: BackendPool) -> Iterator[str]:
+    body = _encode_payload(payload)
+    tried: List[Backend] = []
     last_exc = None
     for attempt in range(retries + 1):
-        try:
-            r = requests.post(
-                LMSTUDIO_URL,
-                headers=headers,
-                data=json.dumps(payload),
-                timeout=timeout
-            )
-            r.raise_for_status()
-            # Handle empty/invalid JSON response
+        started = False
+        with pool.use(exclude=tried) as backend:
+            tried.append(backend)
+            begin = time.perf_counter()
+            tokens = 0
             try:
-                resp_json = r.json()
-            except json.JSONDecodeError:
-                # If connection worked but response body is empty/bad
-                raise ValueError(f"Invalid JSON response: {r.text[:100]}")
-
-            if "choices" not in resp_json or not resp_json["choices"]:
-                 raise ValueError(f"Unexpected response format: {resp_json}")
-
-            return resp_json["choices"][0]["message"]["content"]
-        except Exception as e:
-            last_exc = e
-            if attempt < retries:
-                log(f"[lmstudio_chat] Retry {attempt+1}/{retries} due to {e}")
-                time.sleep(0.3)
-                continue
-    
-    # If all retries failed
-    raise RuntimeError(f"[lmstudio_chat] Network/API error after {retries} retries: {last_exc}")
+                with llm_http.post(backend.url, body, timeout, headers=headers, stream=True) as r:
+                    r.raise_for_status()
+                    for line in r.iter_lines(decode_unicode=False):
+                        if not line or not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            r.raw.drain_conn()  # read the end of the body so the connection goes back to the pool
+                            break
+                        chunk = safe_json_load(data.decode("utf-8", errors="replace"))
+                        if not chunk:
+                            continue
+                        usage = chunk.get("usage")
+                        if usage:
+                            sp.set_attributes(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+                        if not chunk.get("choices"):
+                            continue
+                        delta = chunk["choices"][0].get("delta") or {}
+                        content = delta.get("content")
+                        if content:
+                            if not started:
+                                sp.set_attribute("ttft_ms", round((time.time() - sp.start) * 1000, 1))
+                            started = True
+                            tokens += 1  # servers send about one token per delta
+                            sp.set_attribute("deltas", tokens)
+                            yield content
+                LLM_CALLS.inc(mode="stream", outcome="ok")
+                pool.record_success(backend, sp.attributes.get("completion_tokens") or tokens, time.perf_counter() - begin)
+                sp.set_attributes(attempts=attempt + 1, backend=backend.url)
+                return
+            except Exception as e:
+                LLM_CALLS.inc(mode="stream", outcome="error")
+                pool.record_failure(backend, e)
+                if started:
+                    raise RuntimeError(f"[lmstudio_chat_stream] Stream interrupted: {e}")
+                last_exc = e
+        if attempt < retries:
+            log(f"[lmstudio_chat_stream] Retry {attempt+1}/{retries} due to {last_exc}")
+            time.sleep(0.3)
+
+    raise RuntimeError(f"[lmstudio_chat_stream] Network/API error after {retries} retries: {last_exc}")
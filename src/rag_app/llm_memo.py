@@ -0,0 +1,194 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from .config import (
+    QWEN_MODEL, LLM_MEMO_ENABLED, LLM_MEMO_PATH, LLM_MEMO_MAX_ENTRIES, LLM_MEMO_MEMORY_ENTRIES
+)
+from .utils import log
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+class LLMMemo:
+    """
+    Disk-backed memo for deterministic LLM sub-tasks (query expansion, term
+    explanations, search plans).
+
+    Rows are keyed by sha1(task, prompt template version, model, inputs), so
+    bumping a template's version makes its old results unreachable; they age
+    out through the normal eviction. The most recently used rows are also
+    kept in an in-memory LRU, filled by warm() at startup, so a popular term
+    is answered without touching SQLite. last_used of memory hits is written
+    back with the next put() instead of on every lookup.
+    """
+
+    def __init__(self, path: str = LLM_MEMO_PATH, max_entries: int = LLM_MEMO_MAX_ENTRIES,
+                 memory_entries: int = LLM_MEMO_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, str]" = OrderedDict()  # key -> JSON value
+        self._touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS llm_memo (
+                                key TEXT PRIMARY KEY,
+                                task TEXT,
+                                version INTEGER,
+                                value TEXT,
+                                last_used REAL
+                            )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_memo_last_used ON llm_memo(last_used)")
+
+    @staticmethod
+    def make_key(task: str, version: int, inputs: Any, model: str = QWEN_MODEL) -> str:
+        raw = json.dumps([task, version, model, inputs], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, value: str):
+        # caller holds self._lock
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def warm(self, limit: Optional[int] = None) -> int:
+        """Load the most recently used rows into memory. Returns the number loaded."""
+        limit = self.memory_entries if limit is None else min(limit, self.memory_entries)
+        if limit <= 0:
+            return 0
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, value FROM llm_memo ORDER BY last_used DESC LIMIT ?", (limit,)
+            ).fetchall()
+        with self._lock:
+            for key, value in reversed(rows):  # oldest first, so the newest end up most recent
+                if key not in self._memory:
+                    self._remember(key, value)
+        return len(rows)
+
+    def get(self, task: str, version: int, inputs: Any) -> Optional[Any]:
+        key = self.make_key(task, version, inputs)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._touched[key] = time.time()
+                self.hits += 1
+                value = self._memory[key]
+            else:
+                value = None
+        if value is not None:
+            CACHE_HITS.inc(cache=f"llm_{task}")
+            return json.loads(value)  # a fresh object per caller
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM llm_memo WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_memo SET last_used = ? WHERE key = ?", (time.time(), key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._remember(key, row[0])
+        if row is None:
+            CACHE_MISSES.inc(cache=f"llm_{task}")
+            return None
+        CACHE_HITS.inc(cache=f"llm_{task}")
+        return json.loads(row[0])
+
+    def put(self, task: str, version: int, inputs: Any, value: Any):
+        key = self.make_key(task, version, inputs)
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._remember(key, encoded)
+            touched, self._touched = self._touched, {}
+        with self._connect() as conn:
+            if touched:
+                conn.executemany(
+                    "UPDATE llm_memo SET last_used = MAX(last_used, ?) WHERE key = ?",
+                    [(ts, k) for k, ts in touched.items()],
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_memo (key, task, version, value, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, task, version, encoded, now),
+            )
+            count = conn.execute("SELECT COUNT(*) FROM llm_memo").fetchone()[0]
+            if count > self.max_entries:
+                # Evict a little extra so we do not trim on every insert
+                overflow = count - self.max_entries + max(self.max_entries // 20, 1)
+                conn.execute(
+                    "DELETE FROM llm_memo WHERE key IN "
+                    "(SELECT key FROM llm_memo ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "in_memory": len(self._memory),
+        }
+
+llm_memo: Optional[LLMMemo] = None
+
+def _get_memo() -> Optional[LLMMemo]:
+    global llm_memo
+    if not LLM_MEMO_ENABLED:
+        return None
+    if llm_memo is None:
+        llm_memo = LLMMemo()
+    return llm_memo
+
+def warm_llm_memo() -> int:
+    """Open the memo and load its most recently used rows; called once at server startup."""
+    try:
+        memo = _get_memo()
+        if memo is None:
+            return 0
+        loaded = memo.warm()
+        log(f"[LLMMemo] warmed {loaded} entries")
+        return loaded
+    except Exception as e:
+        log(f"[LLMMemo] warm-load failed: {e}")
+        return 0
+
+def memoized(task: str, version: int, inputs: Any, compute: Callable[[], Any],
+             cacheable: Callable[[Any], bool] = lambda value: value is not None) -> Any:
+    """
+    compute() through the memo. Only results that pass cacheable() are stored,
+    so callers return fallbacks (template queries, error text) from compute()
+    without them sticking. Memo errors never fail the call.
+    """
+    memo = None
+    try:
+        memo = _get_memo()
+        if memo is not None:
+            cached = memo.get(task, version, inputs)
+            if cached is not None:
+                return cached
+    except Exception as e:
+        log(f"[LLMMemo] lookup error, computing without memo: {e}")
+        memo = None
+
+    value = compute()
+    if memo is not None and cacheable(value):
+        try:
+            memo.put(task, version, inputs, value)
+        except Exception as e:
+            log(f"[LLMMemo] store error: {e}")
+    return value
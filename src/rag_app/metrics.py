@@ -0,0 +1,224 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format (0.0.4), kept dependency-free.
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(v: float) -> str:
+    v = float(v)
+    if v == float("inf"):
+        return "+Inf"
+    if v.is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(v)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"[metrics] {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items
+        ]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        """Sample fn() at scrape time instead of storing a value."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = fn
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        if key in self._functions:
+            return float(self._functions[key]())
+        return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                values[key] = float(fn())
+            except Exception:
+                continue
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in sorted(values.items())
+        ]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = sorted((k, list(c), self._sums[k]) for k, c in self._counts.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for upper, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _format_labels(self.labelnames, key, ("le", _format_value(upper)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+# -----------------------
+# Pipeline metrics
+# -----------------------
+STAGE_LATENCY = histogram("rag_stage_latency_seconds", "Latency of each RAG pipeline stage.", ["stage"])
+REQUEST_LATENCY = histogram("rag_request_latency_seconds", "End-to-end latency of process_question.", ["outcome"])
+LLM_CALLS = counter("rag_llm_calls_total", "LLM chat completion calls.", ["mode", "outcome"])
+LLM_HTTP_CONNECTIONS = counter("rag_llm_http_connections_total", "LLM HTTP requests by connection: new (TCP handshake) or reused (keep-alive).", ["connection"])
+LLM_QUEUE_WAIT = histogram("rag_llm_queue_wait_seconds", "Time LLM calls waited for a gateway slot.", ["priority"])
+LLM_QUEUE_DEPTH = gauge("rag_llm_queue_depth", "LLM calls waiting for a gateway slot.", ["priority"])
+LLM_IN_FLIGHT = gauge("rag_llm_in_flight", "LLM calls holding a gateway slot.", ["priority"])
+LLM_BACKEND_UP = gauge("rag_llm_backend_up", "1 when the LLM backend takes requests, 0 while it is ejected.", ["backend"])
+LLM_BACKEND_OUTSTANDING = gauge("rag_llm_backend_outstanding", "LLM calls in progress per backend.", ["backend"])
+LLM_BACKEND_TOKENS_PER_SECOND = gauge("rag_llm_backend_tokens_per_second", "Smoothed completion throughput per backend.", ["backend"])
+LLM_BACKEND_EJECTIONS = counter("rag_llm_backend_ejections_total", "Times an LLM backend was taken out of rotation.", ["backend"])
+FETCH_FAILURES = counter("rag_fetch_failures_total", "Page fetches that failed or returned no content.", ["reason"])
+CACHE_HITS = counter("rag_cache_hits_total", "Cache hits.", ["cache"])
+CACHE_MISSES = counter("rag_cache_misses_total", "Cache misses.", ["cache"])
+KB_GATE_DECISIONS = counter("rag_kb_gate_total", "KB-confidence gate decisions (pass = web search skipped).", ["intent", "outcome"])
+FETCH_STAGE_EXITS = counter("rag_fetch_stage_exits_total", "How the web fetch stage finished (complete / enough / cap / deadline).", ["reason"])
+FETCH_QUEUE_DEPTH = gauge("rag_fetch_queue_depth", "Page fetches waiting in the shared fetch pool.")
+FETCH_ACTIVE = gauge("rag_fetch_active", "Page fetches currently running in the shared fetch pool.")
+FETCH_CANCELLED = counter("rag_fetch_cancelled_total", "Page fetches abandoned by an early fetch-stage exit.")
+COALESCED_REQUESTS = counter("rag_coalesced_requests_total", "Requests that joined an identical in-flight pipeline run instead of starting one.")
+INFLIGHT_PIPELINES = gauge("rag_inflight_pipelines", "Distinct pipeline runs in flight (after coalescing).")
+BATCH_SHARED_WORK = counter("rag_batch_shared_work_total", "DDGS queries / page fetches reused from another question of the same batch.", ["kind"])
+INTENT_DECISIONS = counter("rag_intent_decisions_total", "How the intent was decided (heuristic / classifier / plan / llm / fallback).", ["source"])
+PLAN_CALLS = counter("rag_plan_calls_total", "Fused intent + query planning calls; invalid and error fall back to two calls.", ["outcome"])
+DEGRADED_STAGES = counter("rag_degraded_stages_total", "Stages shortened or skipped to meet a request deadline.", ["stage"])
+EXPLAIN_PREFETCH = counter("rag_explain_prefetch_total", "Background [[term]] explanations (queued / ok / error / joined by /api/explain).", ["outcome"])
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Observe the wall-clock duration of the enclosed block as STAGE_LATENCY{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage=stage)
@@ -1,17 +1,20 @@
 import requests
 import re
 from urllib.parse import urlparse
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
 from bs4 import BeautifulSoup
 
 from .config import (
     USER_AGENT, REQUESTS_TIMEOUT, VERBOSE, 
     PRIORITY_DOMAINS, BOOST_KEYWORDS, 
     BLACKLIST_DOMAINS, WHITELIST_DOMAINS,
-    DOMAIN_AUTHORITY, NEWS_KEYWORDS, WEATHER_KEYWORDS, INFORMATIONAL_KEYWORDS,
-    RESTAURANT_KEYWORDS, SPEC_KEYWORDS
+    DOMAIN_AUTHORITY,
 )
 from .utils import log
+from .keywords import KeywordMatcher, keyword_matcher
+from .metrics import stage_timer, FETCH_FAILURES
+from .tracing import span, current_span
 
 # optional libs
 try:
@@ -26,20 +29,33 @@ except Exception:
     ReadabilityDocument = None
     _HAS_READABILITY = False
 
-def fetch_html(url: str) -> str:
+def fetch_html(url: str, timeout: float = REQUESTS_TIMEOUT) -> str:
     if not url:
         return ""
     headers = {"User-Agent": USER_AGENT}
-    try:
-        r = requests.get(url, headers=headers, timeout=REQUESTS_TIMEOUT)
-        if r.status_code == 200 and r.content:
-            r.encoding = r.apparent_encoding or "utf-8"
-            return r.text
-    except Exception as e:
-        log("[fetch_html] error:", url, e)
+    with stage_timer("fetch"), span("fetch_html", url=url) as sp:
+        try:
+            r = requests.get(url, headers=headers, timeout=timeout)
+            sp.set_attributes(status=r.status_code, bytes=len(r.content))
+            if r.status_code == 200 and r.content:
+                r.encoding = r.apparent_encoding or "utf-8"
+                return r.text
+            FETCH_FAILURES.inc(reason=f"http_{r.status_code}" if r.status_code != 200 else "empty")
+        except requests.Timeout as e:
+            FETCH_FAILURES.inc(reason="timeout")
+            log("[fetch_html] timeout:", url, e)
+        except Exception as e:
+            FETCH_FAILURES.inc(reason="error")
+            log("[fetch_html] error:", url, e)
     return ""
 
-def extract_text(url: str, html: Optional[str] = None) -> str:
+def extract_text(url: str, html: Optional[str] = None, timeout: float = REQUESTS_TIMEOUT) -> str:
+    with span("extract_text", url=url) as sp:
+        text = _extract_text(url, html, timeout)
+        sp.set_attribute("chars", len(text))
+        return text
+
+def _extract_text(url: str, html: Optional[str] = None, timeout: float = REQUESTS_TIMEOUT) -> str:
     parsed = urlparse(url)
     domain = parsed.netloc.lower()
     
@@ -53,12 +69,17 @@ def extract_text(url: str, html: Optional[str] = None) -> str:
             return ""
 
     if html is None:
-        html = fetch_html(url)
+        html = fetch_html(url, timeout)
 
     if not html or len(html) < 200:
         log(f"[extract_text] empty HTML for {url}")
         return ""
 
+    with stage_timer("extract"):
+        current_span().set_attribute("html_bytes", len(html))
+        return _extract_from_html(html, domain)
+
+def _extract_from_html(html: str, domain: str) -> str:
     # Sanitize HTML
     html = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', html)
 
@@ -137,26 +158,27 @@ def score_text_for_restaurant(text: str, title: str = "", url: str = "") -> floa
     quality_score = get_content_quality_score(text, optimal_min=200, optimal_max=1500)
     
     # 3. Relevance - Restaurant Keywords (0-3.0, weight: 0.2)
-    relevance_score = count_keyword_density(text + " " + title, RESTAURANT_KEYWORDS)
+    combined = (text + " " + title).lower()
+    hits = keyword_matcher.scan(combined, ["restaurant"], lowered=True)["restaurant"]
+    relevance_score = keyword_density(len(hits), len(text) + len(title) + 1)
     
     # 4. Features (0-2.0, weight: 0.3)
     feature_score = 0.0
-    combined = (title + "\n" + text).lower()
     
     # Hours existence
-    if re.search(r"\d{1,2}:\d{2}", combined) or "営業時間" in combined:
+    if "営業時間" in hits or re.search(r"\d{1,2}:\d{2}", combined):
         feature_score += 0.5
         
     # Price info
-    if re.search(r"円", combined) or re.search(r"¥", combined):
+    if "円" in combined or "¥" in combined:
         feature_score += 0.5
         
     # Location info
-    if re.search(r"\d{3}-\d{4}", combined) or "〒" in combined or "住所" in combined:
+    if "住所" in hits or "〒" in combined or re.search(r"\d{3}-\d{4}", combined):
         feature_score += 0.5
         
     # Reviews/Menu mention
-    if "口コミ" in combined or "メニュー" in combined:
+    if "口コミ" in hits or "メニュー" in combined:
         feature_score += 0.5
         
     feature_score = min(feature_score, 2.0)
@@ -182,14 +204,15 @@ def score_text_for_spec(text: str, title: str = "", url: str = "") -> float:
     quality_score = get_content_quality_score(text, optimal_min=500, optimal_max=5000)
     
     # 3. Relevance - Spec Keywords (0-3.0, weight: 0.2)
-    relevance_score = count_keyword_density(text + " " + title, SPEC_KEYWORDS)
+    combined = (text + " " + title).lower()
+    hits = keyword_matcher.scan(combined, ["spec"], lowered=True)["spec"]
+    relevance_score = keyword_density(len(hits), len(text) + len(title) + 1)
     
     # 4. Features (0-2.0, weight: 0.2)
     feature_score = 0.0
-    combined = (title + " " + text).lower()
     
     # Versioning
-    if re.search(r"v\d+(\.\d+)*", combined) or "version" in combined:
+    if "version" in hits or re.search(r"v\d+(\.\d+)*", combined):
         feature_score += 0.5
         
     # Date/Recency in context of release
@@ -248,6 +271,11 @@ def get_domain_authority(url: str, intent: str) -> float:
     # Default score
     return 1.0
 
+@lru_cache(maxsize=32)
+def _matcher_for(keywords: Tuple[str, ...]) -> KeywordMatcher:
+    """One compiled matcher per keyword list, shared by every count_keyword_density call with it."""
+    return KeywordMatcher({"keywords": keywords})
+
 def count_keyword_density(text: str, keywords: list) -> float:
     """
     Count keyword density in text.
@@ -255,12 +283,14 @@ def count_keyword_density(text: str, keywords: list) -> float:
     """
     if not text:
         return 0.0
-    
-    text_lower = text.lower()
-    count = sum(1 for keyword in keywords if keyword in text_lower)
-    
-    # Normalize by text length (per 1000 chars)
-    density = (count / max(len(text), 1)) * 1000
+    count = _matcher_for(tuple(keywords)).counts(text)["keywords"]
+    return keyword_density(count, len(text))
+
+def keyword_density(count: int, text_len: int) -> float:
+    """Distinct keyword hits per 1000 chars, capped at 3.0."""
+    if not text_len:
+        return 0.0
+    density = (count / text_len) * 1000
     return min(density, 3.0)  # Cap at 3.0
 
 def get_content_quality_score(text: str, optimal_min: int = 300, optimal_max: int = 2000) -> float:
@@ -311,11 +341,12 @@ def score_text_for_news(text: str, title: str = "", url: str = "") -> float:
     quality_score = get_content_quality_score(text, optimal_min=300, optimal_max=2000)
     
     # 3. Relevance - News Keywords (0-3.0, weight: 0.2)
-    relevance_score = count_keyword_density(text + " " + title, NEWS_KEYWORDS)
+    combined = (text + " " + title).lower()
+    hits = keyword_matcher.scan(combined, ["news", "freshness"], lowered=True)
+    relevance_score = keyword_density(len(hits["news"]), len(text) + len(title) + 1)
     
     # 4. Freshness (0-2.0, weight: 0.1)
     freshness_score = 0.0
-    combined = (text + " " + title).lower()
     
     # Recent year mentions
     if "2026" in combined:
@@ -326,8 +357,7 @@ def score_text_for_news(text: str, title: str = "", url: str = "") -> float:
         freshness_score += 0.5
     
     # Time indicators
-    time_indicators = ["今日", "本日", "昨日", "速報", "最新"]
-    if any(indicator in combined for indicator in time_indicators):
+    if hits["freshness"]:
         freshness_score += 0.5
     
     # Date format (YYYY年MM月DD日)
@@ -358,23 +388,23 @@ def score_text_for_weather(text: str, title: str = "", url: str = "") -> float:
     quality_score = get_content_quality_score(text, optimal_min=200, optimal_max=1500)
     
     # 3. Relevance - Weather Keywords (0-3.0, weight: 0.2)
-    relevance_score = count_keyword_density(text + " " + title, WEATHER_KEYWORDS)
+    combined = text + " " + title
+    hits = keyword_matcher.scan(combined, ["weather", "forecast_time"])
+    relevance_score = keyword_density(len(hits["weather"]), len(combined))
     
     # 4. Weather Data Presence (0-2.0, weight: 0.1)
     data_score = 0.0
-    combined = text + " " + title
     
     # Temperature data
     if re.search(r'\d+℃', combined) or re.search(r'\d+度', combined):
         data_score += 0.5
     
     # Precipitation probability
-    if re.search(r'\d+%', combined) or "降水確率" in combined:
+    if "降水確率" in hits["weather"] or re.search(r'\d+%', combined):
         data_score += 0.5
     
     # Time-based forecast
-    time_keywords = ["今日", "明日", "週間", "時間ごと", "3時間"]
-    if any(kw in combined for kw in time_keywords):
+    if hits["forecast_time"]:
         data_score += 0.5
     
     # Location info
@@ -405,11 +435,12 @@ def score_text_for_informational(text: str, title: str = "", url: str = "") -> f
     quality_score = get_content_quality_score(text, optimal_min=400, optimal_max=3000)
     
     # 3. Relevance - Informational Keywords (0-3.0, weight: 0.2)
-    relevance_score = count_keyword_density(text + " " + title, INFORMATIONAL_KEYWORDS)
+    combined = text + " " + title
+    hits = keyword_matcher.scan(combined, ["informational", "citation", "explanatory"])
+    relevance_score = keyword_density(len(hits["informational"]), len(combined))
     
     # 4. Structure & References (0-2.0, weight: 0.1)
     structure_score = 0.0
-    combined = text + " " + title
     
     # Headings/sections
     if re.search(r'[第章節]', combined):
@@ -420,13 +451,11 @@ def score_text_for_informational(text: str, title: str = "", url: str = "") -> f
         structure_score += 0.5
     
     # References/citations
-    citation_keywords = ["参考", "出典", "引用", "文献", "source"]
-    if any(kw in combined.lower() for kw in citation_keywords):
+    if hits["citation"]:
         structure_score += 0.5
     
     # Educational content indicators
-    edu_keywords = ["例えば", "具体的", "つまり", "すなわち"]
-    if any(kw in combined for kw in edu_keywords):
+    if hits["explanatory"]:
         structure_score += 0.5
     
     structure_score = min(structure_score, 2.0)
@@ -5,6 +5,7 @@ from typing import List, Dict, Any
 from .config import DDGS_MAX_PER_QUERY, DDGS_USE_NEWS
 from .utils import log
 from .llm import lmstudio_chat
+from .tracing import span
 
 # ddgs import with fallback
 try:
@@ -16,6 +17,12 @@ except Exception:
         DDGS = None
 
 def ddgs_search_many(queries: List[str], per_query: int = DDGS_MAX_PER_QUERY) -> List[Dict]:
+    with span("ddgs_search_many", queries=len(queries), per_query=per_query) as sp:
+        out = _ddgs_search_many(queries, per_query)
+        sp.set_attribute("hits", len(out))
+        return out
+
+def _ddgs_search_many(queries: List[str], per_query: int) -> List[Dict]:
     results = []
     if DDGS is None:
         log("[DDGS] ddgs/duckduckgo not available.")
@@ -59,6 +66,7 @@ def refine_queries_from_hits(
     n_extra: int = 2,
     *,
     intent: str | None = None,
+    timeout: float = 12,
 ) -> List[str]:
     """
     Generate additional search queries from top search hits.
@@ -90,10 +98,10 @@ def refine_queries_from_hits(
             ],
             max_tokens=120,
             temperature=0.0,
-            timeout=12,
+            timeout=timeout,
         )
 
-        text = resp["choices"][0]["message"]["content"]
+        text = resp
 
         lines = [l.strip(" -•\"'") for l in text.splitlines() if l.strip()]
         out: List[str] = []
@@ -0,0 +1,137 @@
+import json
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .utils import normalize_question, history_fingerprint
+from .metrics import COALESCED_REQUESTS, INFLIGHT_PIPELINES
+
+EventCallback = Callable[[Dict], None]
+
+def flight_key(question: str, difficulty: str, history: List[Dict]) -> str:
+    """Identity of a pipeline run: normalized question, difficulty and a fingerprint of the history."""
+    raw = json.dumps([normalize_question(question), difficulty, history_fingerprint(history)], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class _Flight:
+    """
+    One in-flight pipeline run and everyone waiting on it. Events are kept so a
+    late joiner first gets a replay, then live events, in publish order.
+    Callbacks run under the flight lock, so they must be quick (queue puts).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: List[Dict] = []
+        self._subscribers: List[EventCallback] = []
+        self._done_callbacks: List[Callable[[], None]] = []
+        self.done = False
+        self.result: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+
+    def publish(self, event: Dict) -> None:
+        with self._lock:
+            self._events.append(event)
+            for cb in self._subscribers:
+                cb(event)
+
+    def subscribe(self, cb: EventCallback) -> None:
+        with self._lock:
+            for event in self._events:
+                cb(event)
+            self._subscribers.append(cb)
+
+    def unsubscribe(self, cb: EventCallback) -> None:
+        with self._lock:
+            if cb in self._subscribers:
+                self._subscribers.remove(cb)
+
+    def finish(self, result: Optional[Dict] = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.done = True
+            self.result, self.error = result, error
+            self._subscribers.clear()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for cb in callbacks:
+            cb()
+
+    def add_done_callback(self, cb: Callable[[], None]) -> None:
+        with self._lock:
+            if not self.done:
+                self._done_callbacks.append(cb)
+                return
+        cb()
+
+    async def wait(self) -> Dict:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def _wake():
+            try:
+                loop.call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+            except RuntimeError:
+                pass  # The waiting loop is gone (its caller went away)
+
+        self.add_done_callback(_wake)
+        await waiter
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent pipeline runs, across threads and event
+    loops: the first caller for a key runs the pipeline, callers arriving
+    while it is in flight subscribe to its events and share its result.
+    Once the run finishes the key is released; later callers start afresh
+    (and normally hit the response cache).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    async def run(
+        self,
+        key: str,
+        on_event: Optional[EventCallback],
+        start: Callable[[EventCallback], Awaitable[Dict]],
+    ) -> Dict:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if on_event:
+            flight.subscribe(on_event)
+
+        if not leader:
+            COALESCED_REQUESTS.inc()
+            try:
+                result = await flight.wait()
+            finally:
+                if on_event:
+                    flight.unsubscribe(on_event)
+            return dict(result, coalesced=True)
+
+        try:
+            result = await start(flight.publish)
+        except BaseException as e:
+            self._release(key, flight, error=e)
+            raise
+        self._release(key, flight, result=result)
+        return result
+
+    def _release(self, key: str, flight: _Flight, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+single_flight = SingleFlight()
+INFLIGHT_PIPELINES.set_function(single_flight.in_flight)
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .config import TRACE_ENABLED, TRACE_PATH, TRACE_MAX_BYTES, TRACE_BACKUPS
+from .metrics import stage_timer
+
+class RotatingJsonlSink:
+    """Append-only JSONL file rotated by size: traces.jsonl -> traces.jsonl.1 -> ... .N"""
+
+    def __init__(self, path: str = TRACE_PATH, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def files(self) -> List[str]:
+        """Current file first, then rotated files newest to oldest."""
+        candidates = [self.path] + [f"{self.path}.{i}" for i in range(1, self.backups + 1)]
+        return [p for p in candidates if os.path.exists(p)]
+
+    def _rotate(self):
+        for i in range(self.backups, 0, -1):
+            src = self.path if i == 1 else f"{self.path}.{i - 1}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i}")
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(((self.end or time.time()) - self.start) * 1000, 2),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+_sink = RotatingJsonlSink()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("rag_current_span", default=None)
+
+def get_sink() -> RotatingJsonlSink:
+    return _sink
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def current_trace_id() -> Optional[str]:
+    s = _current_span.get()
+    return s.trace_id if s else None
+
+@contextmanager
+def span(name: str, new_trace: bool = False, **attributes) -> Iterator[Span]:
+    """
+    Open a span as a child of the current one (or as a new trace root). The
+    span is written to the JSONL sink when the block exits; exceptions mark it
+    as an error and propagate.
+    """
+    parent = None if new_trace else _current_span.get()
+    s = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.attributes["error"] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        s.end = time.time()
+        _current_span.reset(token)
+        if TRACE_ENABLED:
+            try:
+                _sink.write(s.to_dict())
+            except Exception:
+                pass  # tracing must never break a request
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    Create a child of the current span without activating it. For generators,
+    where a context variable set inside would leak into the consumer; close it
+    with finish_span().
+    """
+    parent = _current_span.get()
+    return Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attributes)
+
+def finish_span(s: Span, error: Optional[BaseException] = None):
+    s.end = time.time()
+    if error is not None:
+        s.status = "error"
+        s.attributes["error"] = f"{type(error).__name__}: {error}"[:300]
+    if TRACE_ENABLED:
+        try:
+            _sink.write(s.to_dict())
+        except Exception:
+            pass
+
+@contextmanager
+def stage(name: str, **attributes) -> Iterator[Span]:
+    """A pipeline stage: a span plus the matching rag_stage_latency_seconds observation."""
+    with stage_timer(name), span(name, **attributes) as s:
+        yield s
+
+def run_stage(name: str, fn: Callable, *args, **kwargs):
+    """Call fn under stage(name); handy with asyncio.to_thread, which carries the span context."""
+    with stage(name):
+        return fn(*args, **kwargs)
+
+def bind_context(fn: Callable) -> Callable:
+    """Wrap fn to run in a copy of the caller's context (for executors that do not copy it)."""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, fn)
+
+def read_trace(trace_id: str, sink: Optional[RotatingJsonlSink] = None) -> List[Dict[str, Any]]:
+    spans = []
+    for path in (sink or _sink).files():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if trace_id in line:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if rec.get("trace_id") == trace_id:
+                        spans.append(rec)
+    return sorted(spans, key=lambda r: r["start"])
+
+def last_trace_id(sink: Optional[RotatingJsonlSink] = None) -> Optional[str]:
+    """trace_id of the most recently finished root span."""
+    for path in (sink or _sink).files():
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+        for line in reversed(lines):
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if rec.get("parent_id") is None:
+                return rec.get("trace_id")
+    return None
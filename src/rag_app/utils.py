@@ -1,6 +1,8 @@
 import json
 import re
+import hashlib
 import datetime
+import unicodedata
 from .config import VERBOSE
 
 def log(*args, **kwargs):
@@ -13,6 +15,22 @@ def safe_json_load(s: str):
     except Exception:
         return None
 
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for cache keys: NFKC, lowercase, collapsed
+    whitespace, trailing punctuation removed.
+    """
+    q = unicodedata.normalize("NFKC", question).lower()
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip("?？!！。.、 ")
+
+def history_fingerprint(history) -> str:
+    """sha1 of the (role, content) turns of a conversation history; "" when there is none."""
+    if not history:
+        return ""
+    raw = json.dumps([[h.get("role"), h.get("content")] for h in history], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
 def try_fast_path(question: str) -> str | None:
     # --- 正規化 ---
     q = question.strip()
@@ -0,0 +1,50 @@
+import numpy as np
+from typing import List, Sequence
+
+def as_unit_matrix(vectors: Sequence) -> np.ndarray:
+    """
+    Stack vectors into one contiguous float32 matrix with L2-normalized rows.
+    """
+    m = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    if m.ndim == 1:
+        m = m.reshape(1, -1)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    m /= np.maximum(norms, 1e-8)
+    return m
+
+def as_unit_vector(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    return v / max(float(np.linalg.norm(v)), 1e-8)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first. Uses argpartition so only the
+    selected k are fully sorted.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    part.sort()  # keep input order among ties, like a stable sort
+    return part[np.argsort(-scores[part], kind="stable")]
+
+def greedy_dedupe(matrix: np.ndarray, threshold: float) -> List[int]:
+    """
+    Greedy near-duplicate removal over unit rows, in input order: a row is kept
+    unless its cosine similarity to an already kept row is >= threshold.
+    """
+    n = matrix.shape[0]
+    if n == 0:
+        return []
+    sims = matrix @ matrix.T
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in range(n):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= sims[i] >= threshold
+    return keep